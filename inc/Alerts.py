@@ -0,0 +1,247 @@
+import json
+import operator
+import os
+from datetime import date, datetime
+
+import requests
+
+from inc.Db import Db, record_class
+from inc.Metrics import metrics
+
+# поле правила -> колонка bonds, от которой оно зависит
+FIELDS = {
+    'price': 'price',
+    'yieldsec': 'yieldsec',
+    'calc_yield': 'calc_yield',
+    'ytm': 'ytm',
+    'ytp': 'ytp',
+    'days_to_buyback': 'buybackdate',
+    'days_to_finish': 'matdate',
+}
+# поля от сегодняшней даты: меняются каждый день, хотя сама колонка даты почти никогда не меняется
+DATE_FIELDS = ('days_to_buyback', 'days_to_finish')
+OPS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+ALERTS_FILE = os.path.join("reports", "alerts.jsonl")
+# правила держу копиями без сессии - сессии обновления короткие (Db.batch_session)
+_RULE_COLUMNS = ('id', 'name', 'secid', 'field', 'op', 'value')
+
+
+class StdoutSink:
+    def send(self, event: dict):
+        print(f"🔔 {event['time']} {event['secid']}: {event['rule']} ({event['field']} = {event['value']})")
+
+
+class FileSink:
+    """
+    Событие - строка json в файле
+    """
+
+    def __init__(self, filename=ALERTS_FILE):
+        self.filename = filename
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def send(self, event: dict):
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    """
+    Заготовка вебхука: POST json на url, без url - только печать, что было бы отправлено
+    ошибки доставки не прерывают обновление
+    """
+
+    def __init__(self, url: str = None, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, event: dict):
+        if not self.url:
+            print(f"webhook (url не задан): {json.dumps(event, ensure_ascii=False)}")
+            return
+        try:
+            requests.post(self.url, json=event, timeout=self.timeout).raise_for_status()
+        except Exception as e:
+            metrics.inc("alert_webhook_failures_total")
+            print(f"Не удалось отправить оповещение на {self.url}: {e}")
+
+
+class AlertEngine:
+    """
+    Оповещения по правилам из alert_rules, считаются только по изменившимся облигам:
+    - правила разложены по колонкам, от которых зависят (индекс колонка -> поля -> правила)
+    - на вход evaluate идут только изменения из последнего обновления (дельты watch, спеки, ytm)
+    - по облиге проверяются только правила на поля, значение которых действительно поменялось
+    - поля от даты (DATE_FIELDS) зависят еще и от сегодняшнего дня: check_dates раз в день
+      пересчитывает их по облигам с такими правилами, день последней проверки хранится в базе
+    Срабатывание - переход условия из ложного в истинное, повторно пока условие держится не шлется
+    state - последние значения колонок и полей правил по облиге, поля от даты - на день их расчета
+    """
+
+    def __init__(self, db: Db, sinks: list):
+        self.db = db
+        self.sinks = sinks
+        self.load()
+
+    def load(self):
+        """
+        Правила из базы и последние известные значения нужных им колонок
+        :return:
+        """
+        # колонка -> поле -> правила
+        self.index = {}
+        make = record_class(_RULE_COLUMNS, "AlertRuleRecord")
+        for rule in (make(tuple(getattr(r, c) for c in _RULE_COLUMNS)) for r in self.db.get_alert_rules()):
+            if rule.field not in FIELDS or rule.op not in OPS:
+                print(f"Пропускаю правило {rule.id}: {rule.field} {rule.op}")
+                continue
+            self.index.setdefault(FIELDS[rule.field], {}).setdefault(rule.field, []).append(rule)
+        self.rules = {field: rules for fields in self.index.values() for field, rules in fields.items()}
+
+        # дни до дат - на день прошлой проверки, тогда и переход через порог с тех пор будет виден
+        # проверок еще не было - значения неизвестны, уже выполненные условия сработают при первой
+        self.checked = self.db.get_alerts_checked()
+        self.state = {}
+        if not self.index:
+            return
+        columns = sorted(self.index)
+        for row in self.db.iter_bonds(['secid'] + columns):
+            values = {c: self._normalize(v) for c, v in zip(columns, row[1:])}
+            self.state[row[0]] = self._with_fields(values, self.checked)
+
+    @staticmethod
+    def _normalize(value):
+        """
+        Значения из базы и из json ISS к одному виду: даты - date, числа - float
+        :param value:
+        :return:
+        """
+        if value is None or value == '':
+            return None
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        if isinstance(value, str) and len(value) == 10 and value[4] == '-':
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        # NaN != NaN - иначе облига считалась бы измененной на каждом обновлении
+        return None if value != value else value
+
+    @staticmethod
+    def _value(field: str, row: dict, today: date):
+        value = row.get(FIELDS[field])
+        if isinstance(value, date):
+            return (value - today).days if today else None
+        return value
+
+    def _with_fields(self, row: dict, today: date) -> dict:
+        """
+        Колонки облиги и значения полей правил по ним на день today
+        :param row:
+        :param today:
+        :return:
+        """
+        return {**row, **{field: self._value(field, row, today) for field in self.rules}}
+
+    @staticmethod
+    def _hit(rule, value) -> bool:
+        return value is not None and OPS[rule.op](value, rule.value)
+
+    def evaluate(self, changes: dict, today: date = None) -> list:
+        """
+        Проверка изменений и отправка сработавших событий в sinks
+        поля от даты у облиг из changes пересчитываются на today, даже если сама дата не менялась
+        :param changes: secid -> {колонка: новое значение}, лишние колонки игнорируются
+        :param today: по умолчанию сегодня
+        :return: события
+        """
+        if not self.index:
+            return []
+
+        today = today or date.today()
+        events = []
+        for secid, row in changes.items():
+            old = self.state.get(secid) or {}
+            touched = {column: self._normalize(value) for column, value in row.items() if column in self.index}
+            events += self._check(secid, old, {**old, **touched}, today)
+        self._send(events)
+        return events
+
+    def check_dates(self, today: date = None) -> list:
+        """
+        Пересчет полей от даты по всем облигам с такими правилами, не чаще раза в день
+        (колонки дат почти не меняются, через evaluate до них дело не доходит)
+        :param today: по умолчанию сегодня
+        :return: события
+        """
+        today = today or date.today()
+        rules = [rule for field in DATE_FIELDS for rule in self.rules.get(field, [])]
+        if not rules or today == self.checked:
+            return []
+
+        if any(rule.secid is None for rule in rules):
+            secids = list(self.state)
+        else:
+            secids = [secid for secid in {rule.secid for rule in rules} if secid in self.state]
+        events = []
+        for secid in secids:
+            old = self.state[secid]
+            events += self._check(secid, old, old, today)
+
+        self.checked = today
+        self.db.set_alerts_checked(today)
+        self._send(events)
+        return events
+
+    def _check(self, secid: str, old: dict, row: dict, today: date) -> list:
+        """
+        Правила на поля облиги, значение которых поменялось с прошлого раза
+        :param secid:
+        :param old: state облиги
+        :param row: колонки облиги сейчас
+        :param today:
+        :return: события
+        """
+        new = self._with_fields(row, today)
+        changed = [field for field in self.rules if new[field] != old.get(field)]
+        if not changed:
+            return []
+
+        self.state[secid] = new
+        metrics.inc("alert_rows_evaluated_total")
+        events = []
+        now = datetime.now().isoformat(timespec='seconds')
+        for field in changed:
+            value, previous = new[field], old.get(field)
+            for rule in self.rules[field]:
+                if rule.secid and rule.secid != secid:
+                    continue
+                if not self._hit(rule, value) or self._hit(rule, previous):
+                    continue
+                events.append({
+                    'time': now,
+                    'rule_id': rule.id,
+                    'rule': rule.name,
+                    'secid': secid,
+                    'field': field,
+                    'value': value,
+                    'previous': previous,
+                })
+        return events
+
+    def _send(self, events: list):
+        for event in events:
+            metrics.inc("alerts_fired_total", field=event['field'])
+            for sink in self.sinks:
+                sink.send(event)
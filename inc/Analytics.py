@@ -1,13 +1,23 @@
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 
 from inc.Db import Db
 
+# лестница погашений по эмитентам: корзины срока до погашения, лет
+ISSUER_LADDER_YEARS = (0, 1, 2, 3, 5, 10)
+
 
 class Analytics:
-    def __init__(self, db: Db):
-        self.df = db.get_df()
+    def __init__(self, db: Db, mirror=None):
+        """
+        :param db:
+        :param mirror: Mirror - брать данные и агрегаты из колоночной копии в DuckDB
+        """
+        self.db = db
+        self.mirror = mirror
+        self.df = mirror.get_df() if mirror else db.get_snapshot_df()
 
         # Безопасное вычисление matdays
         if not self.df.empty and 'matdate' in self.df.columns:
@@ -27,6 +37,9 @@ class Analytics:
             self.df['matdays'] = pd.NaT
 
     def get_main_stats(self):
+        if self.mirror:
+            return self.mirror.main_stats()
+
         # Проверяем что DataFrame не пустой
         if self.df.empty:
             return {
@@ -135,6 +148,48 @@ class Analytics:
 
         return stats
 
+    def issuer_stats(self, yield_column='ytm') -> pd.DataFrame:
+        """
+        Агрегаты по эмитентам одним groupby по всем облигам, а не отбор по каждому эмитенту:
+        выпусков, торгуемых, issuesize, объем по номиналу, средневзвешенная по объему доходность
+        и лестница погашений - объем по номиналу в корзинах ISSUER_LADDER_YEARS (mat_0-1 ...)
+        объемы в разных валютах не складываются - у эмитента по строке на каждую валюту номинала
+        :param yield_column:
+        :return: по строке на эмитента и faceunit, с названием из таблицы issuers
+        """
+        df = self.df[self.df['emitent_id'].notna()] if 'emitent_id' in self.df.columns else pd.DataFrame()
+        if df.empty:
+            return pd.DataFrame()
+
+        notional = (df['issuesize'] * df['facevalue']).fillna(0)
+        y = df[yield_column]
+        weighted = y.notna() & (notional > 0)
+
+        edges = list(ISSUER_LADDER_YEARS) + [np.inf]
+        labels = [f"mat_{a}-{b}" if b != np.inf else f"mat_{a}+" for a, b in zip(edges, edges[1:])]
+        bucket = pd.cut(df['days_to_finish'] / 365, bins=edges, right=False, labels=labels)
+        ladder = pd.get_dummies(bucket, dtype=float).mul(notional, axis=0)
+
+        parts = pd.concat([pd.DataFrame({
+            'emitent_id': df['emitent_id'].astype(int),
+            # снимок может отдать категорию, в нее '' не вписать; NULL - облиги без спеков
+            'faceunit': df['faceunit'].astype(object).fillna('') if 'faceunit' in df.columns else '',
+            'bonds': 1,
+            'traded': df['is_traded'].fillna(0).astype(int),
+            'issuesize': df['issuesize'].fillna(0),
+            'outstanding': notional,
+            '_w': notional.where(weighted, 0),
+            '_wy': (notional * y).where(weighted, 0),
+        }), ladder], axis=1)
+        result = parts.groupby(['emitent_id', 'faceunit']).sum()
+
+        result.insert(4, 'weighted_yield', (result['_wy'] / result['_w'].where(result['_w'] > 0)).round(2))
+        result = result.drop(columns=['_w', '_wy'])
+
+        issuers = self.db.get_issuers_df().set_index('id')
+        result.insert(0, 'title', issuers['title'].reindex(result.index.get_level_values('emitent_id')).to_numpy())
+        return result.sort_values('outstanding', ascending=False).reset_index()
+
     def report_lowest_price(self, min_normal=90):
         if self.df.empty or 'price' not in self.df.columns or 'effectiveyield' not in self.df.columns:
             return pd.DataFrame()
@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from inc.Analytics import Analytics
+from inc.Db import Db
+from inc.Metrics import metrics
+from inc.Screener import Screener
+
+# как часто сверять версию данных в базе, сек - между проверками отвечаю из памяти без SQL
+VERSION_CHECK_SECONDS = 1.0
+# сколько разных ответов (url с параметрами) держать в памяти
+MAX_CACHED_RESPONSES = 4096
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiState:
+    """
+    Данные API одной версии базы: Analytics, Screener, облиги по secid и готовые ответы
+    данные после создания не меняются, пополняется только кеш ответов этой версии
+    при смене версии ApiCache заменяет весь объект одним присваиванием,
+    запрос, начатый до перезагрузки, дочитывает старые данные и кладет ответ в кеш старой версии
+    """
+
+    def __init__(self, db: Db, version: int):
+        self.db = db
+        self.version = version
+        self.analytics = Analytics(db)
+        self.screener = Screener(self.analytics.df.drop(columns=['matdays']))
+        self.by_secid = {secid: i for i, secid in enumerate(self.screener.df['secid'])}
+        # url -> (etag, тело json в байтах)
+        self.responses = {}
+
+    def route(self, url: str):
+        parts = urlsplit(url)
+        path = [p for p in parts.path.split('/') if p]
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+        if path == ['version']:
+            return {'data_version': self.version}
+        if path == ['stats']:
+            return self.analytics.get_main_stats()
+        if path == ['issuers']:
+            return _records(self.analytics.issuer_stats(params.get('yield_column', 'ytm')))
+        if len(path) == 2 and path[0] == 'reports':
+            method = getattr(self.analytics, f"report_{path[1]}", None)
+            if method is None:
+                raise ApiError(404, f"Нет отчета {path[1]}")
+            return _records(method())
+        if len(path) == 2 and path[0] == 'bonds':
+            i = self.by_secid.get(path[1])
+            if i is None:
+                raise ApiError(404, f"Нет облиги {path[1]}")
+            return _records(self.screener.df.iloc[[i]])[0]
+        if path == ['screen']:
+            return _records(self._screen(params))
+        if path == ['search']:
+            return _records(self._search(params))
+        raise ApiError(404, f"Нет метода {parts.path}")
+
+    def _screen(self, params: dict) -> pd.DataFrame:
+        """
+        /screen?listlevel=1,2&faceunit=SUR&price=,100&ytm=12,&order_by=ytm&asc=0&limit=20&all=0
+        числовые колонки - "от,до" (пустая граница - без границы), категории - список через запятую
+        """
+        sc = self.screener
+        criteria = {}
+        for col, value in params.items():
+            if col in sc.sorted:
+                lo, _, hi = value.partition(',')
+                criteria[col] = (_number(lo), _number(hi))
+            elif col in sc.bitmaps:
+                criteria[col] = [_category(v) for v in value.split(',')]
+        if params.get('all') != '1':
+            criteria.setdefault('is_traded', True)
+
+        order_by = params.get('order_by')
+        if order_by and order_by not in sc.order:
+            raise ApiError(400, f"Нет индекса по {order_by}")
+        try:
+            limit = int(params.get('limit', 20))
+        except ValueError:
+            raise ApiError(400, "limit - число")
+        return sc.screen(order_by, params.get('asc') == '1', limit, **criteria)
+
+    def _search(self, params: dict) -> pd.DataFrame:
+        """
+        /search?q=газпром капитал&limit=20&traded=1 - запрос к индексу поиска в базе,
+        ответ кешируется по url до смены версии данных, как остальные
+        """
+        if not params.get('q', '').strip():
+            raise ApiError(400, "Нужен параметр q")
+        try:
+            limit = int(params.get('limit', 20))
+        except ValueError:
+            raise ApiError(400, "limit - число")
+        return self.db.search(params['q'], limit, params.get('traded') == '1')
+
+
+class ApiCache:
+    """
+    Данные для API в памяти (ApiState) перечитываются из базы только когда меняется Db.data_version,
+    готовые ответы (json в байтах + ETag) кешируются по url до следующей смены версии
+    """
+
+    def __init__(self, db: Db):
+        self.db = db
+        self.state = None
+        self.checked = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Перезагрузка, если версия данных в базе поменялась (не чаще VERSION_CHECK_SECONDS)
+        :return:
+        """
+        now = time.monotonic()
+        if now - self.checked < VERSION_CHECK_SECONDS:
+            return
+        with self._lock:
+            if now - self.checked < VERSION_CHECK_SECONDS:
+                return
+            version = self.db.data_version()
+            if self.state is None or version != self.state.version:
+                with metrics.timer("stage_seconds", stage="api_reload"):
+                    self.state = ApiState(self.db, version)
+            self.checked = time.monotonic()
+
+    def get(self, url: str) -> tuple:
+        """
+        Ответ на GET url
+        :param url: путь с параметрами
+        :return: (etag, тело json в байтах)
+        """
+        self.refresh()
+        # состояние читаю один раз - перезагрузка в другом потоке не смешает старые и новые данные
+        state = self.state
+        cached = state.responses.get(url)
+        if cached is None:
+            body = json.dumps(state.route(url), ensure_ascii=False, default=_json_default).encode('utf-8')
+            cached = (f'"{state.version}-{zlib.crc32(body):x}"', body)
+            if len(state.responses) >= MAX_CACHED_RESPONSES:
+                state.responses.clear()
+            state.responses[url] = cached
+        return cached
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # keep-alive: клиенты дашбордов не открывают соединение на каждый запрос
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело уходят отдельными send - без TCP_NODELAY ответ ждет delayed ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+    cache: ApiCache = None
+
+    def do_GET(self):
+        start = time.perf_counter()
+        try:
+            etag, body = self.cache.get(self.path)
+        except ApiError as e:
+            self._send(e.status, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self._send(500, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'))
+        else:
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, b'', etag)
+            else:
+                self._send(200, body, etag)
+        metrics.observe("api_request_seconds", time.perf_counter() - start)
+
+    def _send(self, status: int, body: bytes, etag: str = None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if status != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        metrics.inc("api_requests_total", status=str(status))
+
+    def log_message(self, format, *args):
+        # без строки в консоль на каждый запрос
+        pass
+
+
+def serve(db: Db, host='127.0.0.1', port=8080) -> ThreadingHTTPServer:
+    """
+    Сервер API, запуск - serve_forever()
+    :param db:
+    :param host:
+    :param port:
+    :return:
+    """
+    cache = ApiCache(db)
+    cache.refresh()
+    handler = type("BoundApiHandler", (ApiHandler,), {'cache': cache})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def _records(df: pd.DataFrame) -> list:
+    # to_json сам переводит NaN в null и даты в iso
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False)) if not df.empty else []
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _number(value: str):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ApiError(400, f"Не число: {value}")
+
+
+def _category(value: str):
+    # числа (листинг, корзины) как числа, остальное строкой
+    try:
+        return float(value) if '.' in value else int(value)
+    except ValueError:
+        return {'true': True, 'false': False}.get(value.lower(), value)
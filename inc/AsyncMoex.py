@@ -0,0 +1,254 @@
+import asyncio
+import datetime
+import json
+import time
+
+from bs4 import BeautifulSoup
+
+from inc.Metrics import metrics
+from inc.Moex import Moex, ISS_URL, SMARTLAB_URL, SMARTLAB_FACEUNITS
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# таймауты как у синхронного клиента, сек
+ISS_TIMEOUT = 1
+SMARTLAB_TIMEOUT = 30
+
+
+class AsyncMoex(Moex):
+    """
+    Асинхронный клиент ISS MOEX и Smart-Lab с тем же интерфейсом, что Moex (методы с сетью - корутины)
+    для встраивания в asyncio сервисы (бот) без потоков:
+    - один пул соединений aiohttp на клиент, запросы мультиплексируются по нему
+    - одновременных запросов не больше concurrency к ISS и smartlab_concurrency к Smart-Lab
+    - независимые запросы одной облиги (описание, НКД, доходность, тип, график) идут одновременно,
+      время облиги - самый долгий запрос, а не сумма
+    aiohttp - необязательная зависимость: pip install aiohttp
+
+    async with AsyncMoex() as moex:
+        specs, flows, failures = await moex.get_refresh("RU000A1047S3")
+    """
+
+    def __init__(self, iss_url=ISS_URL, smartlab_url=SMARTLAB_URL, concurrency=16, smartlab_concurrency=4):
+        if aiohttp is None:
+            raise ImportError("Для асинхронного клиента нужен aiohttp: python -m pip install aiohttp")
+
+        super().__init__(iss_url, smartlab_url)
+        self.concurrency = concurrency
+        self.smartlab_concurrency = smartlab_concurrency
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency + self.smartlab_concurrency)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._iss_slots = asyncio.Semaphore(self.concurrency)
+        self._smartlab_slots = asyncio.Semaphore(self.smartlab_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    async def query(self, method: str, **kwargs):
+        """
+        Отправка запроса к ISS MOEX, повторы и метрики как в Moex.query
+        """
+        endpoint = self.endpoint_family(method)
+        params = {k: str(v) for k, v in kwargs.items()}
+        error = None
+        for attempt in range(3):
+            if attempt:
+                metrics.inc("iss_retries_total", endpoint=endpoint)
+            async with self._iss_slots:
+                # время - без ожидания свободного слота
+                start = time.perf_counter()
+                try:
+                    async with self.session.get(f"{self.iss_url}/{method}.json", params=params,
+                                                timeout=aiohttp.ClientTimeout(total=ISS_TIMEOUT)) as response:
+                        content = await response.read()
+                    metrics.inc("iss_bytes_total", len(content), endpoint=endpoint)
+                    response.raise_for_status()
+                    result = json.loads(content)
+                    metrics.observe("iss_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+                    metrics.inc("iss_requests_total", endpoint=endpoint, status="ok")
+                    return result
+
+                except Exception as e:
+                    error = e
+                    metrics.observe("iss_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+                    metrics.inc("iss_requests_total", endpoint=endpoint, status="error")
+                    print(f"Попытка {attempt + 1}/3 ошибка: {e or type(e).__name__}")
+            if attempt >= 2:
+                await asyncio.sleep(10)
+        metrics.inc("iss_failures_total", endpoint=endpoint)
+        self._fail(endpoint, error)
+        return None
+
+    async def get_bonds(self, page=1, limit=10):
+        data_dict = await self.query("securities",
+                                     group_by="group",
+                                     group_by_filter="stock_bonds",
+                                     limit=limit,
+                                     start=(page-1)*limit)
+
+        if data_dict is None:
+            print(f"Не удалось получить данные для страницы {page}")
+            return []
+
+        flattened_data = self.flatten(data_dict, 'securities')
+        print(f"📊 Страница {page}: получено {len(flattened_data)} облигаций")
+        return flattened_data
+
+    async def get_marketdata(self):
+        params = {
+            "iss.only": "marketdata",
+            "iss.meta": "off",
+            "marketdata.columns": "SECID,BOARDID,LAST,YIELD,VOLTODAY,SYSTIME"
+        }
+        data_dict = await self.query("engines/stock/markets/bonds/securities", **params)
+        if data_dict is None:
+            print("Не удалось получить marketdata")
+            return []
+
+        return self.flatten(data_dict, 'marketdata')
+
+    async def get_bondization(self, secid: str):
+        params = {
+            "iss.only": "coupons,amortizations",
+            "iss.meta": "off",
+            "limit": "unlimited"
+        }
+        data_dict = await self.query(f"securities/{secid}/bondization", **params)
+        if data_dict is None:
+            print(f"Не удалось получить график платежей для {secid}")
+            return []
+
+        return self._parse_bondization(data_dict)
+
+    async def get_candles(self, secid: str, interval: int, since: str, page_size=500):
+        params = {
+            "from": since,
+            "interval": interval,
+            "iss.only": "candles",
+            "iss.meta": "off",
+        }
+        candles = []
+        while True:
+            data_dict = await self.query(f"engines/stock/markets/bonds/securities/{secid}/candles",
+                                         start=len(candles), **params)
+            if data_dict is None:
+                print(f"Не удалось получить свечи для {secid}")
+                return None
+
+            page = self.flatten(data_dict, 'candles')
+            candles += page
+            if len(page) < page_size:
+                return candles
+
+    async def get_history(self, secid: str, since: str, page_size=100):
+        params = {
+            "from": since,
+            "marketprice_board": 1,
+            "iss.only": "history",
+            "iss.meta": "off",
+            "history.columns": "TRADEDATE,CLOSE,ACCINT,YIELDCLOSE,VOLUME,FACEVALUE",
+        }
+        rows = []
+        while True:
+            data_dict = await self.query(f"history/engines/stock/markets/bonds/securities/{secid}",
+                                         start=len(rows), **params)
+            if data_dict is None:
+                print(f"Не удалось получить историю для {secid}")
+                return None
+
+            page = self.flatten(data_dict, 'history')
+            rows += page
+            if len(page) < page_size:
+                return self._history_rows(secid, rows)
+
+    async def get_bond_type_from_smartlab(self, secid):
+        for attempt in range(3):
+            async with self._smartlab_slots:
+                try:
+                    start = time.perf_counter()
+                    async with self.session.get(f"{self.smartlab_url}/q/bonds/{secid}/",
+                                                timeout=aiohttp.ClientTimeout(total=SMARTLAB_TIMEOUT)) as response:
+                        text = await response.text()
+                    metrics.observe("smartlab_request_seconds", time.perf_counter() - start)
+                    metrics.inc("smartlab_bytes_total", len(text.encode('utf-8')))
+                    metrics.inc("smartlab_requests_total", status=str(response.status))
+                    if response.status != 200:
+                        return None
+
+                    title_tag = BeautifulSoup(text, 'html.parser').find('h1', class_='qn-menu__title')
+                    if title_tag:
+                        return self._bond_type_from_title(title_tag.get_text())
+
+                except Exception as e:
+                    metrics.inc("smartlab_requests_total", status="error")
+                    print(f"Попытка {attempt + 1}/3 ошибка: {e or type(e).__name__}")
+            if attempt < 2:
+                await asyncio.sleep(2)
+        return None
+
+    async def get_specs(self, secid: str):
+        """
+        То же что Moex.get_specs, но описание, НКД, доходность и тип со Smart-Lab запрашиваются одновременно
+        тип нужен только рублевым - если по описанию облига нерублевая, запрос к Smart-Lab отменяется
+        """
+        async with asyncio.TaskGroup() as tg:
+            description = tg.create_task(self.query(f"securities/{secid}"))
+            nkd = tg.create_task(self.get_nkd(secid))
+            yield_dict = tg.create_task(self.get_yield(secid))
+            bondtype = tg.create_task(self.get_bond_type_from_smartlab(secid))
+
+            data_dict = await description
+            specs = self.rows_to_dict(data_dict, 'description') if data_dict is not None else {}
+            if specs.get("faceunit") not in SMARTLAB_FACEUNITS:
+                bondtype.cancel()
+
+        if data_dict is None:
+            print(f"Не удалось получить спецификации для {secid}")
+            return {}
+        return self._build_specs(specs, nkd.result(), yield_dict.result(),
+                                 None if bondtype.cancelled() else bondtype.result())
+
+    async def get_nkd(self, secid: str):
+        params = {
+            "iss.only": "securities",
+            "iss.meta": "off",
+            "securities.columns": "ACCRUEDINT"
+        }
+        return self._parse_nkd(await self.query(f"engines/stock/markets/bonds/securities/{secid}", **params))
+
+    async def get_yield(self, secid: str):
+        path = f"history/engines/stock/markets/bonds/sessions/3/securities/{secid}"
+        from_date = (datetime.datetime.now() -
+                     datetime.timedelta(days=7)).strftime("%Y-%m-%d")
+        return self._parse_yield(secid, await self.query(path, **{"from": from_date}))
+
+    async def get_refresh(self, secid: str) -> tuple:
+        """
+        Все для обновления облиги одновременно: спеки (get_specs) и график платежей
+        :param secid:
+        :return: (specs, flows, failures) - failures только по этой облиге, для Db.apply_refresh
+        """
+        # задачи TaskGroup получают копию контекста - их неудачи попадают в этот же список
+        with self.collect_failures() as failures:
+            async with asyncio.TaskGroup() as tg:
+                specs = tg.create_task(self.get_specs(secid))
+                flows = tg.create_task(self.get_bondization(secid))
+        return specs.result(), flows.result(), failures
+
+    async def get_refreshes(self, secids: list) -> dict:
+        """
+        get_refresh по многим облигам разом, одновременность ограничена слотами клиента
+        :param secids:
+        :return: secid -> (specs, flows, failures)
+        """
+        async with asyncio.TaskGroup() as tg:
+            tasks = {secid: tg.create_task(self.get_refresh(secid)) for secid in secids}
+        return {secid: task.result() for secid, task in tasks.items()}
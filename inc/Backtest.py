@@ -0,0 +1,268 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from inc.CashFlows import CashFlows
+from inc.Db import Db
+
+# статика облиги из bonds для правил и графика платежей
+STATIC_COLUMNS = ('secid', 'shortname', 'listlevel', 'faceunit', 'bondtype', 'isqualifiedinvestors', 'matdate',
+                  'buybackdate', 'coupondate', 'couponfrequency', 'couponvalue', 'facevalue')
+
+
+class Backtest:
+    """
+    Бэктест правил отбора по дневной истории (bond_history), сразу по всем датам:
+    - история разворачивается в матрицы дата x облига (цена, НКД, доходность, объем)
+    - правило (rule_*, screen) - маска отбора дата x облига одним выражением numpy по всем датам
+    - раз в step торговых дней покупаю на равные суммы все отобранные в эту дату облиги по закрытию с НКД
+      и держу horizon дней: купоны после НДФЛ и погашения по графику (CashFlows) - накопленными суммами по датам,
+      в конце продаю по последней цене с НКД, НДФЛ с дохода сверх цены покупки
+    Статика облиги (листинг, даты, график) - текущая из bonds, погашенных и исключенных из списка облиг там нет -
+    результат не учитывает их потерь
+    Пример:
+        bt = Backtest.from_db(db)
+        periods = bt.run(bt.rule_365_yieldest(), horizon=180)
+        bt.summary(periods)
+    """
+
+    def __init__(self, history: pd.DataFrame, bonds: pd.DataFrame, flows: pd.DataFrame = None,
+                 tax_rate=0.13, fee_rate=0.0):
+        """
+        :param history: Db.get_history_df
+        :param bonds: как в Db.get_df
+        :param flows: Db.get_cashflows_df
+        :param tax_rate: НДФЛ с купонов и с дохода от погашения / продажи
+        :param fee_rate: комиссия от суммы покупки и продажи, в долях
+        """
+        self.tax_rate = tax_rate
+        self.fee_rate = fee_rate
+
+        bonds = bonds.drop_duplicates('secid')
+        history = history[(history['price'] > 0) & history['secid'].isin(bonds['secid'])]
+        d, dates = pd.factorize(history['date'].dt.normalize(), sort=True)
+        j, secids = pd.factorize(history['secid'], sort=True)
+        self.dates = dates.to_numpy(dtype='datetime64[D]')
+        self.bonds = bonds.set_index('secid').reindex(secids)[list(STATIC_COLUMNS[1:])]
+        self.bonds = self.bonds.rename_axis('secid').reset_index()
+        shape = (len(self.dates), len(secids))
+
+        def matrix(col):
+            m = np.full(shape, np.nan, dtype=np.float32)
+            m[d, j] = history[col].to_numpy(dtype=np.float32)
+            return m
+
+        self.price = matrix('price')
+        self.accruedint = np.nan_to_num(matrix('accruedint'))
+        self.yieldsec = matrix('yieldsec')
+        self.volume = matrix('volume')
+        self.quoted = self.price > 0
+        # на каждую дату - последняя дата с ценой, для оценки при продаже в день без сделок
+        self._last = np.where(self.quoted, np.arange(shape[0], dtype=np.int32)[:, None], 0)
+        np.maximum.accumulate(self._last, axis=0, out=self._last)
+        self._cash(flows, matrix('facevalue'))
+
+    @classmethod
+    def from_db(cls, db: Db, start=None, end=None, **kwargs):
+        return cls(db.get_history_df(start, end), db.get_snapshot_df(), db.get_cashflows_df(), **kwargs)
+
+    @classmethod
+    def rules(cls) -> list:
+        return sorted(name[len('rule_'):] for name in dir(cls) if name.startswith('rule_'))
+
+    def _cash(self, flows: pd.DataFrame, facevalue: np.ndarray):
+        """
+        Накопленные с начала истории купоны и погашения номинала на каждую дату, дата x облига:
+        выплата между торговыми днями засчитывается в следующий торговый день,
+        получено за (вход, выход] = накоплено на выход - накоплено на вход
+        остаток номинала - по графику, у облиг без графика (бессрочные) - номинал из истории
+        """
+        shape = self.price.shape
+        self.coupons = np.zeros(shape)
+        self.principal = np.zeros(shape)
+        self.face = np.zeros(shape)
+        if not shape[0]:
+            return
+
+        start = pd.Timestamp(self.dates[0])
+        bonds = self.bonds.assign(coupondate=self._first_coupon(start))
+        cf = CashFlows(bonds, flows, today=start - pd.Timedelta(days=1))
+
+        pos = np.searchsorted(self.dates, cf.dates)
+        rows, k = np.nonzero(~np.isnat(cf.dates) & (pos < shape[0]))
+        np.add.at(self.coupons, (pos[rows, k], rows), cf.coupons[rows, k])
+        np.add.at(self.principal, (pos[rows, k], rows), cf.principal[rows, k])
+        np.cumsum(self.coupons, axis=0, out=self.coupons)
+        np.cumsum(self.principal, axis=0, out=self.principal)
+
+        total = cf.principal.sum(axis=1)
+        last_face = facevalue[self._last, np.arange(shape[1])]
+        self.face = np.where(total > 0, total - self.principal, np.nan_to_num(last_face))
+
+    def _first_coupon(self, start: pd.Timestamp) -> pd.Series:
+        """
+        Дата купона, с которой CashFlows строит купоны облиг без графика: от ближайшего будущего
+        назад с шагом 365 / частота до начала истории - иначе прошлых купонов не будет
+        """
+        freq = self.bonds['couponfrequency'].to_numpy(dtype=float)
+        first = pd.to_datetime(self.bonds['coupondate']).to_numpy(dtype='datetime64[D]')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = 365 / freq
+            back = np.floor((first - np.datetime64(start.date(), 'D')).astype(float) / step)
+            shift = np.rint(np.clip(back, 0, None) * step)
+        shift = np.where(np.isfinite(shift), shift, 0).astype('timedelta64[D]')
+        return pd.Series(first - shift, index=self.bonds.index)
+
+    def static(self, col: str) -> np.ndarray:
+        """
+        Колонка статики как строка матрицы, для сравнения с матрицами дата x облига
+        """
+        return self.bonds[col].to_numpy()[None, :]
+
+    def days_to(self, col='matdate') -> np.ndarray:
+        """
+        Дней от каждой даты истории до даты col облиги (погашения, оферты), дата x облига
+        """
+        until = pd.to_datetime(self.bonds[col]).to_numpy(dtype='datetime64[D]')
+        return (until[None, :] - self.dates[:, None]).astype(np.float32)
+
+    def screen(self, listlevel=None, faceunit=None, bondtype=None, price=(None, None), yield_=(None, None),
+               days=(None, None), min_volume=0, qualified=True) -> np.ndarray:
+        """
+        Маска отбора по критериям как у Screener: списки - допустимые значения, пары - от и до (None - без границы)
+        :param listlevel:
+        :param faceunit:
+        :param bondtype:
+        :param price: цена, %
+        :param yield_: доходность мосбиржи по закрытию, %
+        :param days: дней до погашения
+        :param min_volume: объем за день не меньше
+        :param qualified: включая облиги только для квалов
+        :return: дата x облига
+        """
+        mask = self.quoted.copy()
+        for col, values in (('listlevel', listlevel), ('faceunit', faceunit), ('bondtype', bondtype)):
+            if values:
+                mask &= self.bonds[col].isin(values).to_numpy()[None, :]
+        if not qualified:
+            mask &= self.static('isqualifiedinvestors') != True
+        for values, (lo, hi) in ((self.price, price), (self.yieldsec, yield_), (self.days_to(), days)):
+            if lo is not None:
+                mask &= values >= lo
+            if hi is not None:
+                mask &= values <= hi
+        if min_volume:
+            mask &= self.volume >= min_volume
+        return mask
+
+    def rule_365_cheap_ll21(self) -> np.ndarray:
+        """
+        Как Analytics.report_365_cheap_ll21 на каждую дату: лл 1-2, погашение в сл 365 дней, цена ниже медианы группы
+        """
+        matdays = self.days_to()
+        group = self.quoted & (self.static('listlevel') <= 2) & (matdays > 0) & (matdays < 365)
+        return group & (self.price < _median(self.price, group))
+
+    def rule_365_yieldest(self) -> np.ndarray:
+        """
+        Как Analytics.report_365_yieldest на каждую дату: погашение в сл 365 дней, лл 1-2, доходность выше медианы группы
+        доходность - мосбиржи по закрытию (yieldsec)
+        """
+        matdays = self.days_to()
+        group = self.quoted & (self.static('listlevel') <= 2) & (matdays > 0) & (matdays < 365)
+        return group & (self.yieldsec > _median(self.yieldsec, group))
+
+    def returns(self, entries: np.ndarray, exits: np.ndarray) -> np.ndarray:
+        """
+        Доходность покупки каждой облиги в даты entries с продажей в exits, после налогов и комиссий
+        :param entries: номера дат входа
+        :param exits: номера дат выхода
+        :return: вход x облига, доли; NaN - в дату входа нет цены
+        """
+        cols = np.arange(self.price.shape[1])
+        last = self._last[exits]
+        face_in, face_out = self.face[entries], self.face[exits]
+        alive = face_out > 1e-9
+
+        clean_in = self.price[entries] / 100 * face_in
+        cost = (clean_in + self.accruedint[entries]) * (1 + self.fee_rate)
+        clean_out = np.where(alive, self.price[last, cols] / 100 * face_out, 0)
+        sale = (clean_out + np.where(alive, self.accruedint[last, cols], 0)) * (1 - self.fee_rate)
+
+        coupons = self.coupons[exits] - self.coupons[entries]
+        principal = self.principal[exits] - self.principal[entries]
+        gain = np.maximum(principal + clean_out - clean_in, 0)
+        income = coupons * (1 - self.tax_rate) + principal + sale - gain * self.tax_rate
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(cost > 0, income / cost - 1, np.nan)
+
+    def run(self, mask: np.ndarray, horizon=365, step=21) -> pd.DataFrame:
+        """
+        Вход раз в step торговых дней, пока до конца истории хватает horizon дней
+        рынок (universe) - все облиги с ценой в дату входа на тех же условиях
+        :param mask: дата x облига, напр. rule_365_yieldest()
+        :param horizon: дней держать
+        :param step: торговых дней между входами
+        :return: по строке на вход: date, exit, days, bonds, return и annual (%), universe и excess (годовых, %)
+        """
+        entries = np.arange(0, len(self.dates), step)
+        target = self.dates[entries] + np.timedelta64(horizon, 'D')
+        entries = entries[target <= self.dates[-1]] if len(entries) else entries
+        exits = np.searchsorted(self.dates, target[:len(entries)], side='right') - 1
+
+        r = self.returns(entries, exits)
+        days = (self.dates[exits] - self.dates[entries]).astype(float)
+        chosen, total = _mean(r, mask[entries])
+        universe, _ = _mean(r, self.quoted[entries])
+        annual = _annual(chosen, days)
+        universe = _annual(universe, days)
+        return pd.DataFrame({
+            'date': self.dates[entries],
+            'exit': self.dates[exits],
+            'days': days.astype(int),
+            'bonds': total,
+            'return': np.round(chosen * 100, 2),
+            'annual': np.round(annual * 100, 2),
+            'universe': np.round(universe * 100, 2),
+            'excess': np.round((annual - universe) * 100, 2),
+        })
+
+    @staticmethod
+    def summary(periods: pd.DataFrame) -> dict:
+        """
+        Итог по всем входам
+        :param periods: run
+        :return:
+        """
+        done = periods[periods['bonds'] > 0]
+        return {
+            'входов': len(periods),
+            'входов с отбором': len(done),
+            'облиг на входе, в среднем': round(done['bonds'].mean(), 1) if len(done) else 0,
+            'доходность за период, средняя %': round(done['return'].mean(), 2),
+            'годовых, среднее %': round(done['annual'].mean(), 2),
+            'годовых, медиана %': round(done['annual'].median(), 2),
+            'рынок годовых, среднее %': round(done['universe'].mean(), 2),
+            'лучше рынка, доля входов %': round((done['excess'] > 0).mean() * 100, 1) if len(done) else 0,
+        }
+
+
+def _median(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # медиана по облигам группы на каждую дату, пустая группа - NaN без предупреждения
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(np.where(mask, values, np.nan), axis=1)[:, None]
+
+
+def _mean(returns: np.ndarray, mask: np.ndarray) -> tuple:
+    # равные суммы в каждую облигу - доходность портфеля = средняя доходность облиг
+    chosen = mask & np.isfinite(returns)
+    count = chosen.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(chosen, returns, 0).sum(axis=1) / count, count
+
+
+def _annual(r: np.ndarray, days: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (1 + r) ** (365 / days) - 1
@@ -0,0 +1,197 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from inc.Metrics import metrics
+from inc.Moex import Moex
+
+CANDLES_DIR = os.path.join("_db", "candles")
+# ISS отдает время свечей по Москве
+MOEX_TZ = ZoneInfo("Europe/Moscow")
+
+# запись свечи в файле: 40 байт, время начала - unix секунды (время биржи)
+BAR = np.dtype([
+    ('begin', '<i8'),
+    ('open', '<f4'),
+    ('high', '<f4'),
+    ('low', '<f4'),
+    ('close', '<f4'),
+    ('value', '<f8'),
+    ('volume', '<i8'),
+])
+
+# интервал ISS -> свечей в году, для годовой волатильности
+# основная сессия по облигам ~ 10:00 - 18:40, 252 торговых дня
+INTERVALS = {1: 252 * 520, 10: 252 * 52, 60: 252 * 9, 24: 252, 7: 52, 31: 12}
+# насколько назад забирать историю, если по облиге еще ничего нет
+DEFAULT_HISTORY_DAYS = {1: 7, 10: 30, 60: 90, 24: 365 * 3, 7: 365 * 5, 31: 365 * 10}
+
+
+class CandleStore:
+    """
+    Свечи на диске: файл на облигу и интервал (_db/candles/<interval>/<secid>.bin),
+    внутри подряд записи BAR по возрастанию времени. Файлы только дописываются,
+    последнее время - последние 40 байт, диапазон - memmap + searchsorted без чтения всего файла
+    """
+
+    def __init__(self, path=CANDLES_DIR):
+        self.path = path
+
+    def _file(self, secid: str, interval: int) -> str:
+        return os.path.join(self.path, str(interval), f"{secid}.bin")
+
+    def last(self, secid: str, interval: int):
+        """
+        Время начала последней сохраненной свечи
+        :param secid:
+        :param interval:
+        :return: unix секунды или None
+        """
+        filename = self._file(secid, interval)
+        if not os.path.exists(filename) or os.path.getsize(filename) < BAR.itemsize:
+            return None
+        with open(filename, 'rb') as f:
+            # недописанный хвост (упали посреди записи) пропускаю
+            f.seek((os.path.getsize(filename) // BAR.itemsize - 1) * BAR.itemsize)
+            return int(np.frombuffer(f.read(BAR.itemsize), dtype=BAR)['begin'][0])
+
+    def append(self, secid: str, interval: int, bars: np.ndarray) -> int:
+        """
+        Дописать свечи новее последней сохраненной
+        :param secid:
+        :param interval:
+        :param bars: массив BAR
+        :return: сколько записано
+        """
+        last = self.last(secid, interval)
+        bars = np.sort(bars, order='begin')
+        if last is not None:
+            bars = bars[bars['begin'] > last]
+        if not len(bars):
+            return 0
+
+        filename = self._file(secid, interval)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'r+b' if os.path.exists(filename) else 'wb') as f:
+            # обрезаю недописанный хвост, если был
+            f.truncate(os.path.getsize(filename) // BAR.itemsize * BAR.itemsize)
+            f.seek(0, os.SEEK_END)
+            bars.tofile(f)
+        return len(bars)
+
+    def read(self, secid: str, interval: int, start: datetime = None, end: datetime = None) -> np.ndarray:
+        """
+        Свечи с началом в [start, end)
+        :param secid:
+        :param interval:
+        :param start:
+        :param end:
+        :return: массив BAR (копия)
+        """
+        filename = self._file(secid, interval)
+        size = os.path.getsize(filename) // BAR.itemsize if os.path.exists(filename) else 0
+        if not size:
+            return np.empty(0, dtype=BAR)
+
+        bars = np.memmap(filename, dtype=BAR, mode='r', shape=(size,))
+        begin = bars['begin']
+        left = 0 if start is None else np.searchsorted(begin, _to_unix(start), side='left')
+        right = size if end is None else np.searchsorted(begin, _to_unix(end), side='left')
+        return np.array(bars[left:right])
+
+    def read_df(self, secid: str, interval: int, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """
+        То же что read, но DataFrame с begin в datetime, для графиков
+        """
+        df = pd.DataFrame(self.read(secid, interval, start, end))
+        df['begin'] = pd.to_datetime(df['begin'], unit='s')
+        return df
+
+    def secids(self, interval: int) -> list:
+        folder = os.path.join(self.path, str(interval))
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-4] for f in os.listdir(folder) if f.endswith('.bin'))
+
+    def volatility(self, interval: int, start: datetime = None, end: datetime = None,
+                   secids: list = None, min_bars=10) -> pd.DataFrame:
+        """
+        Годовая волатильность по логарифмам изменения close
+        :param interval:
+        :param start:
+        :param end:
+        :param secids: по умолчанию все, по которым есть свечи
+        :param min_bars: меньше свечей - волатильность не считаю
+        :return: колонки secid, bars, volatility (%), last (последний close)
+        """
+        per_year = INTERVALS[interval]
+        rows = []
+        for secid in secids or self.secids(interval):
+            close = self.read(secid, interval, start, end)['close'].astype(float)
+            close = close[close > 0]
+            vol = np.nan
+            if len(close) >= min_bars:
+                vol = np.std(np.diff(np.log(close)), ddof=1) * np.sqrt(per_year) * 100
+            rows.append((secid, len(close), round(vol, 2), close[-1] if len(close) else np.nan))
+        return pd.DataFrame(rows, columns=['secid', 'bars', 'volatility', 'last'])
+
+
+class CandleIngester:
+    """
+    Докачка свечей из ISS: по каждой облиге только свечи новее последней сохраненной,
+    облиги параллельно в workers потоках (запросы - ожидание сети, GIL не мешает)
+    текущая незакрытая свеча не сохраняется - она еще меняется, придет при следующем запуске
+    """
+
+    def __init__(self, moex: Moex, store: CandleStore, workers=8):
+        self.moex = moex
+        self.store = store
+        self.workers = workers
+
+    def ingest(self, secids: list, interval=24) -> dict:
+        """
+        :param secids:
+        :param interval: ключ INTERVALS
+        :return: secid -> сколько свечей дописано, None если запрос не удался
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            counts = pool.map(lambda secid: self._ingest_one(secid, interval), secids)
+            return dict(zip(secids, counts))
+
+    def _ingest_one(self, secid: str, interval: int):
+        now = datetime.now(MOEX_TZ).replace(tzinfo=None)
+        last = self.store.last(secid, interval)
+        if last is None:
+            since = now - timedelta(days=DEFAULT_HISTORY_DAYS[interval])
+        else:
+            since = pd.Timestamp(last, unit='s')
+
+        with metrics.timer("stage_seconds", stage="candles"):
+            candles = self.moex.get_candles(secid, interval, since.strftime("%Y-%m-%d %H:%M:%S"))
+        if candles is None:
+            return None
+
+        now = now.strftime("%Y-%m-%d %H:%M:%S")
+        closed = [c for c in candles if c.get('begin') and c.get('end') and c['end'] < now]
+        bars = np.zeros(len(closed), dtype=BAR)
+        if closed:
+            bars['begin'] = _to_unix([c['begin'] for c in closed])
+            for field in ('open', 'high', 'low', 'close', 'value', 'volume'):
+                bars[field] = [c.get(field) or 0 for c in closed]
+        written = self.store.append(secid, interval, bars)
+        metrics.inc("candles_written_total", written, interval=str(interval))
+        return written
+
+
+def _to_unix(value):
+    """
+    Время биржи как unix секунды без перевода часовых поясов - только для сравнения и хранения
+    :param value: "YYYY-MM-DD HH:MM:SS" / datetime или список таких
+    :return: int или массив int64
+    """
+    seconds = pd.to_datetime(value).to_numpy().astype('datetime64[s]').astype(np.int64)
+    return seconds if isinstance(value, list) else int(seconds)
@@ -0,0 +1,148 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# сколько дней разрешаю синтетическому купону "перелететь" дату погашения
+# (шаг 365/частота не совпадает с реальным календарем выплат)
+_DATE_TOLERANCE_DAYS = 3
+
+
+class CashFlows:
+    """
+    Будущие платежи по облигациям в виде матриц numpy:
+    строка - облигация (в порядке bonds), столбец - платеж по порядку дат,
+    пустые ячейки добиты нулями
+
+    Если по облиге сохранен график из bondization (таблица cashflows) - беру его,
+    иначе строю купоны от coupondate с шагом 365 / couponfrequency
+    и погашение facevalue в конце
+    """
+
+    def __init__(self, bonds: pd.DataFrame, flows: pd.DataFrame = None, to_put=False, today: datetime = None):
+        """
+        :param bonds: колонки secid, coupondate, couponfrequency, couponvalue, facevalue, matdate, buybackdate
+        :param flows: колонки secid, date, kind, value (Db.get_cashflows_df)
+        :param to_put: платежи только до оферты (buybackdate) с выкупом номинала в дату оферты
+        :param today:
+        """
+        self.today = pd.Timestamp(today or datetime.now()).normalize()
+        self.secids = bonds['secid'].to_numpy()
+        n = len(bonds)
+
+        end = pd.to_datetime(bonds['buybackdate'] if to_put else bonds['matdate'])
+        end = end.where(end > self.today)
+        self.end = end.to_numpy(dtype='datetime64[D]')
+
+        long = self._long_format(bonds.reset_index(drop=True), flows, end.reset_index(drop=True))
+
+        if long.empty:
+            m = 0
+        else:
+            long = long.sort_values(['row', 'date'], kind='stable')
+            long['pos'] = long.groupby('row').cumcount()
+            m = int(long['pos'].max()) + 1
+
+        rows = long['row'].to_numpy() if m else np.empty(0, dtype=int)
+        pos = long['pos'].to_numpy() if m else np.empty(0, dtype=int)
+
+        self.dates = np.full((n, m), np.datetime64('NaT', 'D'), dtype='datetime64[D]')
+        self.coupons = np.zeros((n, m))
+        self.principal = np.zeros((n, m))
+        if m:
+            self.dates[rows, pos] = long['date'].to_numpy(dtype='datetime64[D]')
+            self.coupons[rows, pos] = long['coupon'].to_numpy(dtype=float)
+            self.principal[rows, pos] = long['principal'].to_numpy(dtype=float)
+
+        self.counts = np.bincount(rows, minlength=n)
+        days = (self.dates - np.datetime64(self.today.date(), 'D')).astype('float64')
+        self.times = np.where(np.isnat(self.dates), 0.0, days) / 365
+
+    @property
+    def amounts(self) -> np.ndarray:
+        return self.coupons + self.principal
+
+    def _long_format(self, bonds: pd.DataFrame, flows: pd.DataFrame, end: pd.Series) -> pd.DataFrame:
+        """
+        Все платежи одной таблицей row / date / coupon / principal
+        :param bonds:
+        :param flows:
+        :param end: последняя дата платежей по каждой облиге (погашение или оферта)
+        :return:
+        """
+        has_end = end.notna()
+        parts = []
+
+        stored = set()
+        if flows is not None and not flows.empty:
+            # secid в bonds может повторяться - график достается каждой строке с этим secid
+            rows = pd.DataFrame({'secid': bonds['secid'], 'row': bonds.index})
+            f = flows.merge(rows, on='secid')
+            f['date'] = pd.to_datetime(f['date'])
+            f = f[(f['date'] > self.today) & (f['date'] <= end.loc[f['row']].to_numpy())]
+            # будущие плавающие купоны неизвестны - считаю что равны текущему
+            # амортизация без суммы остается NaN (потом 0) - непогашенный номинал вернется в дату окончания
+            is_coupon = f['kind'] == 'coupon'
+            current = pd.Series(bonds['couponvalue'].loc[f['row']].to_numpy(), index=f.index)
+            known = f['value'].fillna(current.where(is_coupon))
+            parts.append(pd.DataFrame({
+                'row': f['row'],
+                'date': f['date'],
+                'coupon': known.where(is_coupon, 0.0),
+                'principal': known.where(~is_coupon, 0.0),
+            }))
+            stored = set(f['row'])
+
+        synthetic = bonds[has_end & ~bonds.index.isin(stored)]
+        parts.append(self._synthetic_coupons(synthetic, end.loc[synthetic.index]))
+
+        long = pd.concat(parts, ignore_index=True)
+        long = long.fillna({'coupon': 0.0, 'principal': 0.0})
+
+        # номинал, не погашенный к дате окончания, выкупается в эту дату
+        paid = long.groupby('row')['principal'].sum().reindex(bonds.index, fill_value=0.0)
+        residual = (bonds['facevalue'].fillna(0.0) - paid)[has_end]
+        residual = residual[residual > 1e-9]
+        parts = [long, pd.DataFrame({
+            'row': residual.index,
+            'date': end.loc[residual.index].to_numpy(),
+            'coupon': 0.0,
+            'principal': residual.to_numpy(),
+        })]
+        long = pd.concat(parts, ignore_index=True)
+        return long.groupby(['row', 'date'], as_index=False)[['coupon', 'principal']].sum()
+
+    def _synthetic_coupons(self, bonds: pd.DataFrame, end: pd.Series) -> pd.DataFrame:
+        """
+        Купоны от даты след. купона с шагом 365 / частота, пока не дойду до end
+        :param bonds:
+        :param end:
+        :return:
+        """
+        freq = bonds['couponfrequency'].fillna(0).to_numpy(dtype=float)
+        first = pd.to_datetime(bonds['coupondate']).to_numpy(dtype='datetime64[D]')
+        last = end.to_numpy(dtype='datetime64[D]')
+        ok = (freq > 0) & ~np.isnat(first) & (bonds['couponvalue'].fillna(0).to_numpy(dtype=float) > 0)
+        if not ok.any():
+            return pd.DataFrame(columns=['row', 'date', 'coupon', 'principal'])
+
+        freq, first, last = freq[ok], first[ok], last[ok]
+        idx = bonds.index.to_numpy()[ok]
+        values = bonds['couponvalue'].to_numpy(dtype=float)[ok]
+
+        span = (last - first).astype('float64')
+        k_max = int(np.nanmax(np.ceil(span * freq / 365))) + 1 if len(span) else 0
+        k = np.arange(max(k_max, 1))
+        offsets = np.rint(k[None, :] * 365 / freq[:, None]).astype('timedelta64[D]')
+        dates = first[:, None] + offsets
+        mask = dates <= (last + np.timedelta64(_DATE_TOLERANCE_DAYS, 'D'))[:, None]
+        mask &= dates > np.datetime64(self.today.date(), 'D')
+        dates = np.minimum(dates, last[:, None])
+
+        r, c = np.nonzero(mask)
+        return pd.DataFrame({
+            'row': idx[r],
+            'date': dates[r, c],
+            'coupon': values[r],
+            'principal': 0.0,
+        })
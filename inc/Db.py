@@ -1,13 +1,72 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from contextlib import contextmanager
 from importlib import resources
 
-from sqlalchemy import create_engine, func, desc, and_, or_
+from sqlalchemy import create_engine, func, desc, and_, or_, inspect, text, select, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 
-from inc.Models import Bond
+from inc.Metrics import metrics
+from inc.Models import Base, Bond, BondHistory, CashFlow, Issuer, Meta, Quarantine, AlertRule, LIVE_DAYS_TO, LIVE_VIEW, \
+    SEARCH_INDEX
 import pandas as pd
 import os
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# интервал повтора для облиг в карантине: 15 мин, 30 мин, 1 час ... не больше недели
+QUARANTINE_BASE_SECONDS = 15 * 60
+QUARANTINE_MAX_SECONDS = 7 * 24 * 60 * 60
+# данные эмитента меняются редко - перезаписываю не чаще раза в месяц
+ISSUER_TTL_SECONDS = 30 * 24 * 60 * 60
+# снимок bonds_live для аналитики: Arrow IPC (Feather v2) без сжатия, читается через memory-map
+SNAPSHOT_PATH = os.path.join("_db", "bonds.arrow")
+# такой же снимок всей bond_history для бэктеста, пересобирается после записи истории (history_version)
+HISTORY_SNAPSHOT_PATH = os.path.join("_db", "history.arrow")
+# колонки поискового индекса и их вес в bm25: точное совпадение кода важнее слова в названии
+SEARCH_WEIGHTS = {'secid': 10.0, 'isin': 10.0, 'shortname': 5.0, 'name': 2.0, 'issuer': 1.0}
+# что отдает поиск, кроме названий
+SEARCH_METRICS = ('is_traded', 'price', 'ytm', 'yieldsec', 'couponpercent', 'faceunit', 'listlevel',
+                  'matdate', 'days_to_finish', 'buybackdate')
+# рыночные колонки дневного снимка bond_history, одноименные колонкам bonds
+HISTORY_COLUMNS = ('price', 'accruedint', 'yieldsec', 'volume', 'facevalue')
+
+
+@lru_cache(maxsize=None)
+def record_class(columns: tuple, name="BondRecord") -> type:
+    """
+    Компактный класс записи со __slots__ под набор колонок (кешируется)
+    без __dict__ и без привязки к сессии, в отличие от Bond
+    :param columns:
+    :param name: имя класса, для repr
+    :return:
+    """
+    def __init__(self, row):
+        for column, value in zip(columns, row):
+            setattr(self, column, value)
+
+    def __repr__(self):
+        return name + "(" + ", ".join(f"{c}={getattr(self, c)!r}" for c in columns) + ")"
+
+    return type(name, (), {'__slots__': columns, '__init__': __init__, '__repr__': __repr__})
+
+
+def arrow_schema(table, columns: tuple):
+    """
+    Схема pyarrow по типам колонок модели
+    тип из самих данных у пачки из одних NULL выходит null, и пачки получаются с разными схемами
+    :param table: Model.__table__
+    :param columns:
+    :return:
+    """
+    types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64(), str: pa.string(), datetime: pa.timestamp('us')}
+    return pa.schema([(c, types[table.c[c].type.python_type]) for c in columns])
 
 
 class Db:
@@ -23,19 +82,254 @@ class Db:
             db_path = str(path)
             engine = create_engine(f"sqlite:///{db_path}")
 
-            # Создаем таблицы только если БД не существует
             if not os.path.exists(db_path):
-                Bond.metadata.create_all(engine)
                 print(f"✅ База данных создана: {db_path}")
             else:
                 print(f"📊 База данных уже существует: {db_path}")
 
+            # create_all создает только недостающие таблицы, существующие не трогает
+            Base.metadata.create_all(engine)
+            self._migrate(engine)
+            self._create_live_view(engine)
+            self._create_search_index(engine)
+            with engine.begin() as conn:
+                conn.execute(text("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)"))
+                conn.execute(text("INSERT OR IGNORE INTO meta (key, value) VALUES ('history_version', 0)"))
+
             _session = sessionmaker()
             _session.configure(bind=engine)
+            self._session_factory = _session
             self.session = _session()
 
+    @contextmanager
+    def batch_session(self):
+        """
+        Короткоживущая сессия на порцию работы (пачку облиг, страницу, цикл демона)
+        все методы Db внутри блока работают через нее, на выходе она закрывается
+        и загруженные Bond освобождаются, так память не растет на длинных прогонах
+        незакоммиченное внутри блока теряется
+        :return:
+        """
+        outer = self.session
+        self.session = self._session_factory()
+        try:
+            yield self.session
+        finally:
+            self.session.close()
+            self.session = outer
+
+    def _migrate(self, engine):
+        """
+        Досоздание новых колонок моделей в уже существующей базе
+        create_all в старые таблицы колонки не добавляет
+        :param engine:
+        :return:
+        """
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                existing = {col['name'] for col in inspector.get_columns(table.name)}
+                for col in table.columns:
+                    if col.name in existing:
+                        continue
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"))
+                    print(f"➕ Добавлена колонка {table.name}.{col.name}")
+
+    def commit(self):
+        """
+        Коммит сессии с замером времени записи
+        версия данных растет в той же транзакции, что и сама запись
+        :return:
+        """
+        with metrics.timer("db_commit_seconds"):
+            self.session.execute(text("UPDATE meta SET value = value + 1 WHERE key = 'data_version'"))
+            self.session.commit()
+
+    def data_version(self) -> int:
+        """
+        Текущая версия данных, отдельным соединением - видны коммиты других процессов
+        :return:
+        """
+        with self.engine.connect() as conn:
+            return conn.execute(select(Meta.value).where(Meta.key == 'data_version')).scalar() or 0
+
+    def _create_live_view(self, engine):
+        """
+        Представление bonds_live: все колонки bonds, но "дней до/с" считаются
+        от сегодняшней даты при каждом чтении, а не берутся из снимка на момент загрузки
+        пересоздаю при каждом запуске - колонки могли добавиться миграцией
+        :param engine:
+        :return:
+        """
+        today = "julianday(date('now', 'localtime'))"
+        live = {col: f"CAST(julianday(date({date_col})) - {today} AS INTEGER)"
+                for col, date_col in LIVE_DAYS_TO.items()}
+        # как Moex._calc_days_since_prev_coupon: пред. купон = след. купон - 365 / частота (целых) дней
+        live['days_since_prev_coupon'] = (
+            "CASE WHEN coupondate IS NULL OR coalesce(couponfrequency, 0) = 0 THEN 0 "
+            "ELSE MAX(0, CAST({today} - julianday(date(coupondate)) + CAST(365.0 / couponfrequency AS INTEGER) AS INTEGER)) END"
+        ).format(today=today)
+
+        columns = ", ".join(f"{live[c.name]} AS {c.name}" if c.name in live else c.name
+                            for c in Bond.__table__.columns)
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP VIEW IF EXISTS {LIVE_VIEW}"))
+            conn.execute(text(f"CREATE VIEW {LIVE_VIEW} AS SELECT {columns} FROM {Bond.__tablename__}"))
+
+    def _create_search_index(self, engine):
+        """
+        Индекс FTS5 с trigram токенизатором - поиск по любой части secid, isin, названия и эмитента
+        синхронизируется триггерами на запись в bonds и issuers (любой путь записи, вкл. executemany),
+        эмитент может прийти позже облиги (get-bonds пишет их в одной странице) - триггер issuers дописывает его
+        при создании индекса заполняю его из уже имеющихся облиг
+        :param engine:
+        :return:
+        """
+        columns = ", ".join(SEARCH_WEIGHTS)
+        values = "new.id, new.secid, new.isin, new.shortname, new.name, " \
+                 "(SELECT title FROM issuers WHERE id = new.emitent_id)"
+        triggers = {
+            'bonds_search_insert': f"AFTER INSERT ON bonds BEGIN "
+                                   f"INSERT INTO {SEARCH_INDEX} (rowid, {columns}) VALUES ({values}); END",
+            'bonds_search_update': f"AFTER UPDATE OF secid, isin, shortname, name, emitent_id ON bonds BEGIN "
+                                   f"DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id; "
+                                   f"INSERT INTO {SEARCH_INDEX} (rowid, {columns}) VALUES ({values}); END",
+            'bonds_search_delete': f"AFTER DELETE ON bonds BEGIN "
+                                   f"DELETE FROM {SEARCH_INDEX} WHERE rowid = old.id; END",
+            'issuers_search_insert': f"AFTER INSERT ON issuers BEGIN UPDATE {SEARCH_INDEX} SET issuer = new.title "
+                                     f"WHERE rowid IN (SELECT id FROM bonds WHERE emitent_id = new.id); END",
+            'issuers_search_update': f"AFTER UPDATE OF title ON issuers BEGIN UPDATE {SEARCH_INDEX} SET issuer = new.title "
+                                     f"WHERE rowid IN (SELECT id FROM bonds WHERE emitent_id = new.id); END",
+        }
+        created = SEARCH_INDEX not in inspect(engine).get_table_names()
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX} "
+                              f"USING fts5({columns}, tokenize='trigram')"))
+            # пересоздаю как представление - могли поменяться колонки
+            for name, body in triggers.items():
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+        if created:
+            self.rebuild_search_index(engine)
+
+    def rebuild_search_index(self, engine=None) -> int:
+        """
+        Заполнение индекса поиска заново из bonds и issuers
+        :param engine:
+        :return: сколько облиг в индексе
+        """
+        engine = engine or self.engine
+        with engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {SEARCH_INDEX}"))
+            conn.execute(text(
+                f"INSERT INTO {SEARCH_INDEX} (rowid, {', '.join(SEARCH_WEIGHTS)}) "
+                f"SELECT b.id, b.secid, b.isin, b.shortname, b.name, i.title "
+                f"FROM bonds AS b LEFT JOIN issuers AS i ON i.id = b.emitent_id"))
+            return conn.execute(text(f"SELECT count(*) FROM {SEARCH_INDEX}")).scalar()
+
+    def search(self, query: str, limit=20, traded_only=False) -> pd.DataFrame:
+        """
+        Поиск облиг по части secid, isin, названия или эмитента, вкл. неторгуемые
+        слово - подстрока любой из колонок, слова через И: от 3 символов по индексу с ранжированием bm25,
+        короче (trigram их не ищет) - LIKE по уже найденным индексом строкам
+        отдельным соединением, можно звать из потоков API
+        :param query:
+        :param limit:
+        :param traded_only:
+        :return: колонки secid, isin, shortname, name, issuer, SEARCH_METRICS, score (меньше - лучше)
+        """
+        words = query.split()
+        if not words:
+            return pd.DataFrame(columns=['secid', 'isin', 'shortname', 'name', 'issuer', *SEARCH_METRICS, 'score'])
+
+        # FTS5 не принимает псевдоним таблицы в MATCH и bm25 - везде полное имя
+        s = SEARCH_INDEX
+        params = {'limit': limit}
+        where = []
+        score = "0.0"
+        long_words = [w for w in words if len(w) >= 3]
+        if long_words:
+            # каждое слово - строка FTS5 в кавычках, спецсимволы запроса не интерпретируются
+            params['match'] = " ".join('"' + w.replace('"', '""') + '"' for w in long_words)
+            weights = ", ".join(str(w) for w in SEARCH_WEIGHTS.values())
+            where.append(f"{s} MATCH :match")
+            score = f"bm25({s}, {weights})"
+        for i, w in enumerate(w for w in words if len(w) < 3):
+            params[f"w{i}"] = f"%{w}%"
+            where.append("(" + " OR ".join(f"{s}.{c} LIKE :w{i}" for c in SEARCH_WEIGHTS) + ")")
+        if traded_only:
+            where.append("b.is_traded = 1")
+        where = " AND ".join(where)
+
+        metrics_columns = ", ".join(f"b.{c}" for c in SEARCH_METRICS)
+        sql = (f"SELECT {s}.secid, {s}.isin, {s}.shortname, {s}.name, {s}.issuer, {metrics_columns}, {score} AS score "
+               f"FROM {s} JOIN {LIVE_VIEW} AS b ON b.id = {s}.rowid "
+               f"WHERE {where} ORDER BY score, b.is_traded DESC, b.volume DESC LIMIT :limit")
+        with metrics.timer("stage_seconds", stage="search"), self.engine.connect() as conn:
+            return pd.read_sql(text(sql), conn, params=params, parse_dates=['matdate', 'buybackdate'])
+
     def get_df(self):
-        return pd.read_sql(self.session.query(Bond).statement, self.session.bind)
+        """
+        Все облиги с актуальными на сегодня "дней до/с" (из bonds_live)
+        :return:
+        """
+        dates = [c.name for c in Bond.__table__.columns if isinstance(c.type, DateTime)]
+        return pd.read_sql(f"SELECT * FROM {LIVE_VIEW}", self.session.bind, parse_dates=dates)
+
+    def get_snapshot_df(self) -> pd.DataFrame:
+        """
+        То же что get_df, с теми же типами колонок, но из колоночного снимка на диске
+        снимок пересобирается при первом чтении после смены версии данных (Db.commit) или дня ("дней до" на сегодня)
+        без pyarrow - просто get_df
+        :return:
+        """
+        if pa is None:
+            return self.get_df()
+
+        # версию беру до чтения данных: запись между ними даст лишнюю пересборку, но не устаревший снимок
+        key = {b'data_version': str(self.data_version()).encode(), b'date': date.today().isoformat().encode()}
+        with metrics.timer("stage_seconds", stage="snapshot_load"):
+            table = self._read_snapshot(key)
+            if table is not None:
+                return table.to_pandas()
+
+        with metrics.timer("stage_seconds", stage="snapshot_build"):
+            df = self.get_df()
+            self._write_snapshot(df, key)
+        return df
+
+    @staticmethod
+    def _read_snapshot(key: dict, path=SNAPSHOT_PATH, columns: list = None):
+        if not os.path.exists(path):
+            return None
+        try:
+            # данные не читаются до обращения к колонкам, проверка метаданных почти бесплатна
+            table = feather.read_table(path, memory_map=True)
+        except Exception as e:
+            print(f"Снимок {path} не читается, пересобираю: {e}")
+            return None
+        metadata = table.schema.metadata or {}
+        if any(metadata.get(k) != v for k, v in key.items()):
+            return None
+        # колонки добавились миграцией
+        if table.column_names != (columns or [c.name for c in Bond.__table__.columns]):
+            return None
+        return table
+
+    @staticmethod
+    def _write_snapshot(df: pd.DataFrame, key: dict, path=SNAPSHOT_PATH):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **key})
+        # во временный файл и подмена - читатели не увидят недописанный снимок
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            feather.write_feather(table, tmp, compression='uncompressed')
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Не удалось сохранить снимок {path}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
     def add_bond(self, j):
         """
@@ -50,6 +344,41 @@ class Db:
 
         o.from_json(j)
         self.session.add(o)
+        metrics.inc("db_rows_written_total", table="bonds")
+
+    def add_issuers(self, rows: List[dict]) -> int:
+        """
+        Эмитенты из строк списка облиг (emitent_id, emitent_title ..)
+        у эмитента бывают десятки выпусков - пишу каждого один раз, и только новых или старше ISSUER_TTL_SECONDS
+        :param rows:
+        :return: сколько записано
+        """
+        issuers = {}
+        for j in rows:
+            if j.get('emitent_id'):
+                issuers.setdefault(int(j['emitent_id']), j)
+        if not issuers:
+            return 0
+
+        fresh = datetime.now() - timedelta(seconds=ISSUER_TTL_SECONDS)
+        known = {o.id: o for o in self.session.query(Issuer).filter(Issuer.id.in_(issuers))}
+        written = 0
+        for emitent_id, j in issuers.items():
+            o = known.get(emitent_id)
+            if o is not None and o.updated and o.updated > fresh:
+                continue
+            o = o or Issuer(id=emitent_id)
+            o.title = j.get('emitent_title')
+            o.inn = j.get('emitent_inn')
+            o.okpo = j.get('emitent_okpo')
+            o.updated = datetime.now()
+            self.session.add(o)
+            written += 1
+        metrics.inc("db_rows_written_total", written, table="issuers")
+        return written
+
+    def get_issuers_df(self) -> pd.DataFrame:
+        return pd.read_sql(select(Issuer.__table__), self.engine)
 
     def update_bond_from_json(self, bond: Bond, j: dict):
         """
@@ -62,20 +391,287 @@ class Db:
         bond.from_json(j)
         bond.updated = datetime.now()
         self.session.add(bond)
+        metrics.inc("db_rows_written_total", table="bonds")
+
+    def get_market_state(self) -> List[tuple]:
+        """
+        Текущие цены торгуемых облиг без загрузки моделей целиком
+        :return: список (secid, primary_boardid, price, yieldsec, volume)
+        """
+        return self.session.query(Bond.secid, Bond.primary_boardid, Bond.price, Bond.yieldsec, Bond.volume)\
+            .filter(Bond.is_traded == True).all()
+
+    def apply_deltas(self, deltas: dict):
+        """
+        Запись только изменившихся рыночных данных
+        updated не трогаю - он про спеки, а не про цены
+        :param deltas: secid -> json
+        :return:
+        """
+        for bond in self.session.query(Bond).filter(Bond.secid.in_(list(deltas))).all():
+            bond.from_json(deltas[bond.secid])
+        metrics.inc("db_rows_written_total", len(deltas), table="bonds")
+        self.commit()
+
+    def replace_cashflows(self, secid: str, flows: List[dict]):
+        """
+        Перезапись графика платежей облиги
+        пустой ответ (ошибка запроса) старый график не затирает
+        :param secid:
+        :param flows: список {'date': 'YYYY-mm-dd', 'kind': ..., 'value': ...}
+        :return:
+        """
+        if not flows:
+            return
+
+        now = datetime.now()
+        self.session.query(CashFlow).filter(CashFlow.secid == secid).delete()
+        self.session.add_all([CashFlow(secid=secid,
+                                       date=datetime.strptime(f['date'], "%Y-%m-%d"),
+                                       kind=f['kind'],
+                                       value=float(f['value']) if f.get('value') is not None else None,
+                                       updated=now)
+                              for f in flows])
+        metrics.inc("db_rows_written_total", len(flows), table="cashflows")
+
+    def get_cashflows_df(self) -> pd.DataFrame:
+        """
+        Все сохраненные графики платежей
+        :return:
+        """
+        return pd.read_sql(self.session.query(CashFlow.secid, CashFlow.date, CashFlow.kind, CashFlow.value).statement,
+                           self.session.bind, parse_dates=['date'])
+
+    def record_history(self) -> int:
+        """
+        Снимок цен торгуемых облиг из bonds в bond_history одним INSERT .. SELECT
+        строка пишется на день последних торгов облиги (tradedate), а не на сегодня - цена без сделок сегодня
+        не выдается за сегодняшнее закрытие; облиги без сделок (нулевые цена или объем) не пишутся
+        повторный снимок перезаписывает только свои же строки и только если значения поменялись,
+        итоги дня из ISS (source = iss) не трогает
+        :return: сколько строк записано или изменено
+        """
+        table = BondHistory.__tablename__
+        columns = ", ".join(HISTORY_COLUMNS)
+        changed = " OR ".join(f"{table}.{c} IS NOT excluded.{c}" for c in HISTORY_COLUMNS)
+        # дата в том же текстовом виде, в каком SQLAlchemy хранит DateTime - иначе уникальный индекс не совпадет
+        sql = text(f"INSERT INTO {table} (date, secid, {columns}, source) "
+                   f"SELECT date(tradedate) || ' 00:00:00.000000', secid, {columns}, 'snapshot' "
+                   f"FROM {Bond.__tablename__} "
+                   f"WHERE is_traded = 1 AND price > 0 AND volume > 0 AND tradedate IS NOT NULL "
+                   f"ON CONFLICT (date, secid) DO UPDATE SET " +
+                   ", ".join(f"{c} = excluded.{c}" for c in HISTORY_COLUMNS) +
+                   f" WHERE {table}.source IS NOT 'iss' AND ({changed})")
+        with metrics.timer("stage_seconds", stage="history_snapshot"), self.engine.begin() as conn:
+            written = conn.execute(sql).rowcount
+            # без изменений версию не трогаю - снимок истории на диске остается годным
+            if written:
+                self.history_changed(conn)
+        metrics.inc("db_rows_written_total", written, table="bond_history")
+        return written
+
+    def add_history(self, rows: List[dict]) -> int:
+        """
+        Запись истории (докачка из ISS), строки за уже сохраненные дни перезаписываются
+        :param rows: {'date': datetime, 'secid': .., HISTORY_COLUMNS}
+        :return:
+        """
+        if not rows:
+            return 0
+        stmt = sqlite_insert(BondHistory)
+        stmt = stmt.on_conflict_do_update(index_elements=['date', 'secid'],
+                                          set_={c: stmt.excluded[c] for c in (*HISTORY_COLUMNS, 'source')})
+        with self.engine.begin() as conn:
+            conn.execute(stmt, [{**row, 'source': 'iss'} for row in rows])
+            self.history_changed(conn)
+        metrics.inc("db_rows_written_total", len(rows), table="bond_history")
+        return len(rows)
+
+    @staticmethod
+    def history_changed(conn):
+        """
+        Рост history_version в транзакции записи в bond_history - снимок истории на диске устарел
+        :param conn: соединение или сессия записи
+        """
+        conn.execute(text("UPDATE meta SET value = value + 1 WHERE key = 'history_version'"))
+
+    def get_history_last(self, source='iss') -> dict:
+        """
+        Дата последней строки истории по каждой облиге
+        :param source: iss - докачанные из ISS (снимки из bonds не в счет), None - любые
+        :return: secid -> datetime
+        """
+        query = select(BondHistory.secid, func.max(BondHistory.date)).group_by(BondHistory.secid)
+        if source:
+            query = query.where(BondHistory.source == source)
+        with self.engine.connect() as conn:
+            return dict(conn.execute(query).all())
+
+    def get_history_df(self, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        """
+        Дневные снимки за [start, end]
+        через колоночный снимок всей истории на диске, как get_snapshot_df - построчное чтение
+        миллионов строк из SQLite на порядок дольше; без pyarrow - запросом
+        :param start:
+        :param end:
+        :return: колонки date, secid, HISTORY_COLUMNS
+        """
+        columns = ['date', 'secid', *HISTORY_COLUMNS]
+        if pa is None:
+            return self._read_history(start, end)
+
+        with self.engine.connect() as conn:
+            version = conn.execute(select(Meta.value).where(Meta.key == 'history_version')).scalar() or 0
+        key = {b'history_version': str(version).encode()}
+        with metrics.timer("stage_seconds", stage="history_load"):
+            table = self._read_snapshot(key, HISTORY_SNAPSHOT_PATH, columns)
+            if table is not None:
+                df = table.to_pandas()
+        if table is None:
+            with metrics.timer("stage_seconds", stage="history_build"):
+                df = self._read_history()
+                self._write_snapshot(df, key, HISTORY_SNAPSHOT_PATH)
+
+        if start is not None:
+            df = df[df['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['date'] <= pd.Timestamp(end)]
+        return df
+
+    def _read_history(self, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+        query = select(BondHistory.date, BondHistory.secid, *(getattr(BondHistory, c) for c in HISTORY_COLUMNS))
+        if start is not None:
+            query = query.where(BondHistory.date >= start)
+        if end is not None:
+            query = query.where(BondHistory.date <= end)
+        with metrics.timer("stage_seconds", stage="history_query"):
+            return pd.read_sql(query, self.engine, parse_dates=['date'])
+
+    def update_yields(self, df: pd.DataFrame):
+        """
+        Массовая запись доходностей по id, без загрузки моделей
+        :param df: колонки id, ytm, ytp
+        :return:
+        """
+        records = df[['id', 'ytm', 'ytp']].astype(object).where(df[['id', 'ytm', 'ytp']].notna(), None)
+        self.session.bulk_update_mappings(Bond, records.to_dict('records'))
+        metrics.inc("db_rows_written_total", len(records), table="bonds")
+        self.commit()
+
+    def apply_refresh(self, bond: Bond, specs: dict, flows: List[dict], failures: List[tuple]) -> bool:
+        """
+        Запись результата обновления облиги
+        если хоть один запрос к ISS не прошел - ничего не пишу и не ставлю updated,
+        а отправляю облигу в карантин, иначе пустые данные выглядели бы как обновление
+        :param bond:
+        :param specs: Moex.get_specs
+        :param flows: Moex.get_bondization
+        :param failures: Moex.collect_failures
+        :return: True если данные записаны
+        """
+        if failures:
+            for endpoint, error in failures:
+                self.quarantine(bond.secid, endpoint, error)
+            return False
+
+        self.update_bond_from_json(bond, specs)
+        self.replace_cashflows(bond.secid, flows)
+        self.session.query(Quarantine).filter(Quarantine.secid == bond.secid).delete()
+        return True
+
+    def quarantine(self, secid: str, endpoint: str, error: str):
+        """
+        Отметка неудачи по облиге и методу, следующая попытка через
+        QUARANTINE_BASE_SECONDS * 2 ** (attempts - 1)
+        :param secid:
+        :param endpoint:
+        :param error:
+        :return:
+        """
+        now = datetime.now()
+        q = self.session.query(Quarantine).filter_by(secid=secid, endpoint=endpoint).first()
+        if not q:
+            q = Quarantine(secid=secid, endpoint=endpoint, attempts=0, first_failed=now)
+
+        q.attempts += 1
+        q.last_error = error[:500] if error else None
+        q.last_failed = now
+        q.next_retry = now + timedelta(
+            seconds=min(QUARANTINE_BASE_SECONDS * 2 ** (q.attempts - 1), QUARANTINE_MAX_SECONDS))
+        self.session.add(q)
+        metrics.inc("quarantined_total", endpoint=endpoint)
+
+    def get_quarantine(self) -> List[Quarantine]:
+        return self.session.query(Quarantine).order_by(Quarantine.next_retry).all()
+
+    def requeue(self, secids: List[str] = None) -> int:
+        """
+        Выпуск облиг из карантина (все, если secids не указаны)
+        :param secids:
+        :return: сколько записей удалено
+        """
+        query = self.session.query(Quarantine)
+        if secids:
+            query = query.filter(Quarantine.secid.in_(secids))
+        count = query.delete(synchronize_session=False)
+        self.commit()
+        return count
+
+    def add_alert_rule(self, field: str, op: str, value: float, secid: str = None, name: str = None) -> AlertRule:
+        rule = AlertRule(field=field, op=op, value=value, secid=secid, name=name or f"{secid or '*'} {field} {op} {value:g}")
+        self.session.add(rule)
+        self.commit()
+        return rule
+
+    def get_alert_rules(self) -> List[AlertRule]:
+        return self.session.query(AlertRule).order_by(AlertRule.id).all()
+
+    def remove_alert_rules(self, ids: List[int]) -> int:
+        count = self.session.query(AlertRule).filter(AlertRule.id.in_(ids)).delete(synchronize_session=False)
+        self.commit()
+        return count
+
+    def get_alerts_checked(self):
+        """
+        День последней проверки правил от даты (AlertEngine.check_dates)
+        :return: date или None, если проверок еще не было
+        """
+        with self.engine.connect() as conn:
+            value = conn.execute(select(Meta.value).where(Meta.key == 'alerts_checked')).scalar()
+        return date.fromordinal(value) if value else None
+
+    def set_alerts_checked(self, day: date):
+        # мимо Db.commit - служебная отметка не меняет данных, кеши по data_version сбрасывать незачем
+        with self.engine.begin() as conn:
+            conn.execute(text("INSERT OR REPLACE INTO meta (key, value) VALUES ('alerts_checked', :value)"),
+                         {'value': day.toordinal()})
 
     def get_random_bond(self) -> Bond:
         return self.session.query(Bond).filter_by(is_traded=True).order_by(func.random()).first()
 
     def get_next_bond(self, seconds=18000) -> Bond:
-        before = (datetime.now() - timedelta(seconds=seconds))
-        return self.session.query(Bond).filter(and_(or_(Bond.updated == None, Bond.updated < before), Bond.is_traded == True)).order_by(desc(Bond.updated)).first()
+        bonds = self.get_next_bonds(seconds, 1)
+        return bonds[0] if bonds else None
+
+    def get_next_bonds(self, seconds=18000, limit=100) -> List[Bond]:
+        """
+        Пачка торгуемых облиг, не обновлявшихся seconds секунд
+        :param seconds:
+        :param limit:
+        :return:
+        """
+        now = datetime.now()
+        before = (now - timedelta(seconds=seconds))
+        # облиги в карантине пропускаю до next_retry
+        quarantined = select(Quarantine.secid).where(Quarantine.next_retry > now)
+        return self.session.query(Bond).filter(and_(or_(Bond.updated == None, Bond.updated < before), Bond.is_traded == True, Bond.secid.not_in(quarantined))).order_by(desc(Bond.updated)).limit(limit).all()
 
     def reset_all_updated(self):
         """
         Устанавливает все значения в колонке Bond.updated равными None
         """
         self.session.query(Bond).update({Bond.updated: None})
-        self.session.commit()
+        self.commit()
 
     # Если нужны только определенные поля
     def get_upd_none_bonds_ids(self) -> List[str]:
@@ -118,14 +714,45 @@ class Db:
         Удобно для конвертации в DataFrame
         :return: Список словарей с данными облигаций
         """
-        bonds = self.get_all_bonds()
-        bonds_data = []
-        for bond in bonds:
-            bond_dict = {}
-            for column in bond.__table__.columns:
-                bond_dict[column.name] = getattr(bond, column.name)
-            bonds_data.append(bond_dict)
-        return bonds_data
+        return list(self.iter_bonds(output='dict'))
+
+    def iter_bonds(self, columns: List[str] = None, output='tuple', batch_size=1000, **filters) -> Iterator:
+        """
+        Потоковое чтение облиг напрямую из SQL, без моделей Bond и identity map сессии
+        Читает отдельным соединением - незакоммиченные изменения сессии не видны
+        :param columns: какие колонки читать, по умолчанию все
+        :param output: tuple - кортежи в порядке columns,
+                       record - объекты со __slots__ (record_class),
+                       dict - словари,
+                       arrow - pyarrow.RecordBatch по batch_size строк (нужен pyarrow)
+        :param batch_size: сколько строк забирать из курсора за раз
+        :param filters: колонка=значение, как в get_all_bonds_filtered
+        :return:
+        """
+        table = Bond.__table__
+        columns = tuple(columns or table.columns.keys())
+        query = select(*[table.c[c] for c in columns])
+        for attr, value in filters.items():
+            query = query.where(table.c[attr] == value)
+
+        if output == 'arrow':
+            if pa is None:
+                raise ImportError("Для output='arrow' нужен pyarrow: python -m pip install pyarrow")
+            schema = arrow_schema(table, columns)
+
+        make = record_class(columns) if output == 'record' else None
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            for rows in result.partitions(batch_size):
+                if output == 'arrow':
+                    arrays = [pa.array(col, type=t) for col, t in zip(zip(*rows), schema.types)]
+                    yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+                elif output == 'record':
+                    yield from (make(row) for row in rows)
+                elif output == 'dict':
+                    yield from (dict(zip(columns, row)) for row in rows)
+                else:
+                    yield from (tuple(row) for row in rows)
 
     def get_all_bonds_dataframe(self) -> pd.DataFrame:
         """
@@ -140,3 +767,4 @@ class Db:
         Получить engine базы данных для прямых SQL запросов
         """
         return self.session.bind
+
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from inc.Db import Db
+from inc.Metrics import metrics
+from inc.Moex import Moex
+
+# насколько назад забирать историю, если по облиге еще ничего нет
+DEFAULT_HISTORY_DAYS = 365 * 3
+
+
+class HistoryIngester:
+    """
+    Докачка дневной истории (bond_history) из ISS: по каждой облиге только дни после последнего докачанного из ISS
+    (снимки из bonds за сегодня не в счет, иначе после update-bonds докачка начиналась бы с завтра),
+    запросы облиг параллельно в workers потоках, запись в базу - из вызывающего потока по мере ответов
+    """
+
+    def __init__(self, moex: Moex, db: Db, workers=8):
+        self.moex = moex
+        self.db = db
+        self.workers = workers
+
+    def ingest(self, secids: list, days=DEFAULT_HISTORY_DAYS) -> dict:
+        """
+        :param secids:
+        :param days: глубина для облиг без истории
+        :return: secid -> сколько дней записано, None если запрос не удался
+        """
+        last = self.db.get_history_last()
+        default_since = datetime.now() - timedelta(days=days)
+        since = {secid: last[secid] + timedelta(days=1) if secid in last else default_since for secid in secids}
+
+        counts = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            fetched = pool.map(lambda secid: self._fetch(secid, since[secid]), secids)
+            for secid, rows in zip(secids, fetched):
+                counts[secid] = None if rows is None else self.db.add_history(rows)
+        return counts
+
+    def _fetch(self, secid: str, since: datetime):
+        with metrics.timer("stage_seconds", stage="history"):
+            return self.moex.get_history(secid, since.strftime("%Y-%m-%d"))
@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# границы корзин гистограмм задержек, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Гистограмма задержек с фиксированными корзинами (как в Prometheus)
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Оценка квантиля по корзинам - верхняя граница корзины, куда он попал
+        (но не больше максимума)
+        :param q:
+        :return:
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'buckets': {str(b): c for b, c in zip(list(self.buckets) + ['+Inf'], self.counts)},
+        }
+
+
+class Metrics:
+    """
+    Счетчики и гистограммы задержек за время работы процесса
+    ключ метрики - имя + метки, напр. iss_request_seconds{endpoint="securities/:secid"}
+    пишут в метрики и потоки (докачка свечей и истории, API), поэтому все через блокировку
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.counters = {}
+            self.histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return not self.counters and not self.histograms
+
+    def total(self, name: str) -> float:
+        """
+        Сумма счетчика или времени гистограммы по всем меткам
+        :param name:
+        :return:
+        """
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name) + \
+                sum(h.sum for (n, _), h in self.histograms.items() if n == name)
+
+    def breakdown(self, name='stage_seconds', label='stage') -> list:
+        """
+        Разбивка времени гистограммы по значениям метки, по убыванию
+        :param name:
+        :param label:
+        :return: список (значение метки, кол-во, сек, доля от времени работы)
+        """
+        wall = time.perf_counter() - self.started
+        with self._lock:
+            rows = [(dict(labels).get(label), h.count, h.sum, h.sum / wall if wall else 0)
+                    for (n, labels), h in self.histograms.items() if n == name]
+        return sorted(rows, key=lambda r: r[2], reverse=True)
+
+    @staticmethod
+    def _labels_str(labels: tuple) -> str:
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+    def summary(self) -> list:
+        """
+        Строки итогов для вывода в конце запуска
+        :return:
+        """
+        with self._lock:
+            wall = time.perf_counter() - self.started
+            lines = [f"время работы: {wall:.1f} сек"]
+            for (name, labels), h in sorted(self.histograms.items()):
+                lines.append(f"{name}{self._labels_str(labels)}: {h.count} шт, "
+                             f"ср {h.sum / h.count * 1000:.0f} мс, p95 <= {h.quantile(0.95) * 1000:.0f} мс, "
+                             f"макс {h.max * 1000:.0f} мс, всего {h.sum:.1f} сек")
+            for (name, labels), v in sorted(self.counters.items()):
+                lines.append(f"{name}{self._labels_str(labels)}: {v}")
+
+            smartlab = self.total('smartlab_request_seconds')
+            if smartlab and wall:
+                lines.append(f"доля Smart-Lab во времени работы: {smartlab / wall * 100:.1f}%")
+            return lines
+
+    def to_json(self) -> str:
+        with self._lock:
+            counters = [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.counters.items())]
+            histograms = [{'name': n, 'labels': dict(l), **h.to_dict()} for (n, l), h in sorted(self.histograms.items())]
+        return json.dumps({
+            'uptime_seconds': round(time.perf_counter() - self.started, 3),
+            'counters': counters,
+            'histograms': histograms,
+        }, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Текстовый формат Prometheus (exposition format 0.0.4)
+        :return:
+        """
+        with self._lock:
+            lines = []
+            typed = set()
+            for (name, labels), v in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{self._labels_str(labels)} {v}")
+
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for le, c in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{self._labels_str(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels_str(labels)} {h.sum}")
+                lines.append(f"{name}_count{self._labels_str(labels)} {h.count}")
+            return "\n".join(lines) + "\n"
+
+    def export(self, filename: str):
+        """
+        Выгрузка в файл, формат по расширению: .json или Prometheus text для остальных
+        :param filename:
+        :return:
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.to_json() if filename.endswith('.json') else self.to_prometheus())
+
+
+metrics = Metrics()
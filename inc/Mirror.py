@@ -0,0 +1,225 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import select, DateTime
+
+from inc.Db import Db
+from inc.Models import Base, LIVE_DAYS_TO, LIVE_VIEW
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+MIRROR_PATH = os.path.join("_db", "mirror.duckdb")
+
+# что копирую: таблица -> (ключ, колонка времени изменения)
+# строки с временем больше запомненного заменяются по ключу целиком
+MIRRORED = {
+    'bonds': ('id', 'changed'),
+    'cashflows': ('secid', 'updated'),
+}
+# типы колонок копии по типам модели, а не по первой пачке: колонка из одних NULL
+# иначе создается INTEGER и потом обрезает дробные до целых
+DUCKDB_TYPES = {bool: 'BOOLEAN', int: 'BIGINT', float: 'DOUBLE', str: 'VARCHAR', datetime: 'TIMESTAMP'}
+
+
+class Mirror:
+    """
+    Колоночная копия таблиц SQLite в DuckDB для тяжелых агрегаций
+    после каждого обновления докидываются только строки, измененные с прошлой синхронизации,
+    и убираются удаленные из SQLite
+    duckdb - необязательная зависимость: pip install duckdb
+    """
+
+    def __init__(self, db: Db, path=MIRROR_PATH):
+        if duckdb is None:
+            raise ImportError("Для зеркала нужен duckdb: python -m pip install duckdb")
+
+        self.db = db
+        self.con = duckdb.connect(path)
+        self.con.execute("CREATE TABLE IF NOT EXISTS _sync (name VARCHAR PRIMARY KEY, watermark TIMESTAMP)")
+        if 'bonds' in self.tables():
+            self._create_live_view()
+
+    @staticmethod
+    def available() -> bool:
+        return duckdb is not None
+
+    def tables(self) -> set:
+        return {r[0] for r in self.con.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+
+    def columns(self, table: str) -> list:
+        return list(self.column_types(table))
+
+    def column_types(self, table: str) -> dict:
+        return dict(self.con.execute(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = ? "
+            "ORDER BY ordinal_position", [table]).fetchall())
+
+    @staticmethod
+    def schema(table: str) -> dict:
+        """
+        Колонка -> тип DuckDB по модели
+        :param table:
+        :return:
+        """
+        return {c.name: DUCKDB_TYPES[c.type.python_type] for c in Base.metadata.tables[table].columns}
+
+    def _outdated(self, table: str) -> bool:
+        """
+        Копию таблицы надо пересоздать: после миграции появились новые колонки
+        или тип колонки не совпадает с моделью - старые копии брали типы из первой пачки
+        :param table:
+        :return:
+        """
+        return self.column_types(table) != self.schema(table)
+
+    def _watermark(self, table: str):
+        row = self.con.execute("SELECT watermark FROM _sync WHERE name = ?", [table]).fetchone()
+        return row[0] if row else None
+
+    def sync(self, full=False) -> dict:
+        """
+        Докопирование измененных строк
+        :param full: пересоздать копию целиком
+        :return: таблица -> сколько строк скопировано
+        """
+        copied = {table: self._sync_table(table, key, ts, full) for table, (key, ts) in MIRRORED.items()
+                  if table in Base.metadata.tables}
+        if 'bonds' in self.tables():
+            self._create_live_view()
+        return copied
+
+    def _create_live_view(self):
+        """
+        bonds_live как в Db: "дней до/с" от сегодняшней даты, остальные колонки как есть
+        :return:
+        """
+        live = {col: f"date_diff('day', current_date, CAST({date_col} AS DATE))"
+                for col, date_col in LIVE_DAYS_TO.items()}
+        live['days_since_prev_coupon'] = (
+            "CASE WHEN coupondate IS NULL OR coalesce(couponfrequency, 0) = 0 THEN 0 "
+            "ELSE greatest(0, date_diff('day', CAST(coupondate AS DATE), current_date) "
+            "+ CAST(trunc(365.0 / couponfrequency) AS INTEGER)) END"
+        )
+        columns = ", ".join(f"{live[c]} AS {c}" if c in live else c for c in self.columns('bonds'))
+        self.con.execute(f"CREATE OR REPLACE VIEW {LIVE_VIEW} AS SELECT {columns} FROM bonds")
+
+    def _sync_table(self, table: str, key: str, ts: str, full: bool) -> int:
+        source = Base.metadata.tables[table]
+        schema = self.schema(table)
+        watermark = None if full else self._watermark(table)
+        if table not in self.tables() or self._outdated(table):
+            watermark = None
+
+        # через select по модели, чтобы даты пришли datetime, а не строками SQLite
+        query = select(source)
+        if watermark is not None:
+            query = query.where(source.c[ts] > watermark)
+        # даты явно: колонка из одних NULL иначе создалась бы в DuckDB как INTEGER и не приняла бы даты потом
+        batch = pd.read_sql(query, self.db.engine,
+                            parse_dates=[c.name for c in source.columns if isinstance(c.type, DateTime)])
+
+        # ключи, которые есть в SQLite сейчас - строки удаленных там облиг и графиков убираю и из копии
+        keys = None
+        if watermark is not None:
+            keys = pd.read_sql(select(source.c[key]).distinct(), self.db.engine)
+
+        casts = ", ".join(f"CAST({c} AS {t}) AS {c}" for c, t in schema.items())
+        self.con.register('batch', batch)
+        if keys is not None:
+            self.con.register('keys', keys)
+        try:
+            self.con.execute("BEGIN")
+            if watermark is None:
+                columns = ", ".join(f"{c} {t}" for c, t in schema.items())
+                self.con.execute(f"CREATE OR REPLACE TABLE {table} ({columns})")
+            else:
+                self.con.execute(f"DELETE FROM {table} AS t WHERE NOT EXISTS "
+                                 f"(SELECT 1 FROM keys WHERE keys.{key} = t.{key})")
+                if len(batch):
+                    self.con.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM batch)")
+            if len(batch):
+                self.con.execute(f"INSERT INTO {table} SELECT {casts} FROM batch")
+
+            latest = batch[ts].max() if len(batch) else None
+            if pd.notna(latest):
+                self.con.execute("INSERT OR REPLACE INTO _sync VALUES (?, ?)", [table, latest.to_pydatetime()])
+            elif watermark is None:
+                # таблица пустая или времени изменения еще нет - следующий раз опять целиком
+                self.con.execute("DELETE FROM _sync WHERE name = ?", [table])
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        finally:
+            self.con.unregister('batch')
+            if keys is not None:
+                self.con.unregister('keys')
+        return len(batch)
+
+    def sql(self, query: str, params: list = None) -> pd.DataFrame:
+        return self.con.execute(query, params or []).df()
+
+    def get_df(self) -> pd.DataFrame:
+        """
+        Таблица облиг сразу с matdays, как в Analytics, "дней до/с" на сегодня
+        :return:
+        """
+        return self.sql(f"SELECT *, matdate - ?::TIMESTAMP AS matdays FROM {LIVE_VIEW}", [datetime.now()])
+
+    def main_stats(self) -> dict:
+        """
+        То же что Analytics.get_main_stats, но одним агрегирующим запросом в DuckDB
+        :return:
+        """
+        cols = set(self.columns('bonds'))
+        ey = 'effectiveyield' in cols
+        listing = ey and 'listlevel' in cols
+
+        def median(expr, where):
+            return f"round(coalesce(median({expr}) FILTER (WHERE {where}), 0), 2)"
+
+        parts = {
+            'всего облиг': "count(*)",
+            'торгуемых': "count(*) FILTER (WHERE is_traded = 1)",
+            'для квалов': "count(*) FILTER (WHERE isqualifiedinvestors = 1)",
+            'выпущенных в 2021': "count(*) FILTER (WHERE issuedate BETWEEN '2021-01-01' AND '2022-01-01')",
+            'выпущенных в 2020': "count(*) FILTER (WHERE issuedate BETWEEN '2020-01-01' AND '2021-01-01')",
+            'выпущенных в 2019': "count(*) FILTER (WHERE issuedate BETWEEN '2019-01-01' AND '2020-01-01')",
+        }
+        for level in (1, 8, 11):
+            parts[f'с доходностью > {level}%'] = f"count(*) FILTER (WHERE effectiveyield >= {level})" if ey else "0"
+        if listing:
+            for level in (1, 2, 3):
+                parts[f'листинг {level}'] = f"count(*) FILTER (WHERE is_traded = 1 AND listlevel = {level})"
+                parts[f'медианная доходность, листинг {level}, %'] = \
+                    median('effectiveyield', f"is_traded = 1 AND listlevel = {level}")
+        else:
+            parts.update({f'листинг {level}': "0" for level in (1, 2, 3)})
+            parts.update({f'медианная доходность, листинг {level}, %': "0" for level in (1, 2, 3)})
+
+        parts['медианная цена, %'] = "round(avg(price), 2)"
+        if ey:
+            parts['медианная цена, с дох >= 11, %'] = median('price', "effectiveyield >= 11")
+            parts['медианная цена, с дох >= 8 & < 11, %'] = median('price', "effectiveyield >= 8 AND effectiveyield < 11")
+            parts['медианная цена, с дох >= 1 & < 8, %'] = median('price', "effectiveyield >= 1 AND effectiveyield < 8")
+        if 'listlevel' in cols:
+            for level in (1, 2, 3):
+                parts[f'медианная цена, листинг {level}, %'] = median('price', f"is_traded = 1 AND listlevel = {level}")
+        if ey:
+            parts['медианная цена, matday < 365, %'] = median('price', "matdate < ?::TIMESTAMP + INTERVAL 365 DAY")
+            parts['медианная доходность, matday < 365, %'] = \
+                median('effectiveyield', "matdate < ?::TIMESTAMP + INTERVAL 365 DAY")
+
+        query = "SELECT " + ", ".join(f'{expr} AS "{name}"' for name, expr in parts.items()) + " FROM bonds"
+        row = dict(zip(parts, self.con.execute(query, [datetime.now()] * query.count('?')).fetchone()))
+        if row['всего облиг'] == 0:
+            return {
+                'всего облиг': 0,
+                'торгуемых': 0,
+                'сообщение': 'База данных пустая, запустите "python main.py get-bonds"'
+            }
+        return row
@@ -1,10 +1,22 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, Index
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
+# "дней до ..." зависят от текущей даты, в таблице лежит снимок на момент загрузки
+# актуальные значения считаются при чтении в представлении bonds_live: колонка -> дата
+LIVE_DAYS_TO = {
+    'days_to_buyback': 'buybackdate',
+    'days_to_coupondate': 'coupondate',
+    'days_to_finish': 'matdate',
+}
+# плюс days_since_prev_coupon - от coupondate и couponfrequency
+LIVE_VIEW = "bonds_live"
+# полнотекстовый индекс FTS5 (trigram) по облигам: secid, isin, названия и эмитент, rowid = bonds.id
+SEARCH_INDEX = "bonds_search"
+
 
 class Bond(Base):
     """
@@ -18,7 +30,9 @@ class Bond(Base):
     id = Column(Integer, primary_key=True)
     is_traded = Column(Boolean)
     secid = Column(String)
+    isin = Column(String)
     shortname = Column(String)
+    name = Column(String)  # полное название выпуска
     price = Column(Float)  # цена в проц от номинала
     yieldsec = Column(Float)  # расчитанная мосбиржей доходность (неточная)
     calc_yield = Column(Float)  # Ручной расчет доходности
@@ -57,6 +71,10 @@ class Bond(Base):
     _month_percent = Column(Float)
     # Общие проценты до даты офферты или завершения
     _total_percent = Column(Float)
+    ytm = Column(Float)  # доходность к погашению по графику платежей, после налогов и комиссий
+    ytp = Column(Float)  # доходность к оферте (put) по графику платежей
+    # время последнего изменения строки любым путем записи (для инкрементальных копий)
+    changed = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
     def cast(self, val, _type, _key):
         """
@@ -128,3 +146,91 @@ class Bond(Base):
         issuedate = self.get_date_str()
         tradedate = self.get_date_str('tradedate')
         return f"{self.secid} / {self.shortname}, {issuedate} = {self.is_traded} / {tradedate} = {self.yieldsec}"
+
+
+class CashFlow(Base):
+    """
+    График платежей по облигации (купоны, амортизации, погашение)
+    https://iss.moex.com/iss/securities/:secid/bondization
+    """
+    __tablename__ = "cashflows"
+    id = Column(Integer, primary_key=True)
+    secid = Column(String, index=True)
+    date = Column(DateTime)
+    kind = Column(String)  # coupon / amortization (погашение тоже amortization)
+    value = Column(Float)  # в валюте номинала на одну облигу, для будущих плавающих купонов None
+    updated = Column(DateTime)
+
+
+class BondHistory(Base):
+    """
+    Дневной снимок рынка по облиге для бэктеста (Backtest): строка на облигу и дату, повторная запись за ту же дату
+    перезаписывает. Пишется из bonds после обновлений (Db.record_history) и докачивается из истории ISS
+    https://iss.moex.com/iss/history/engines/stock/markets/bonds/securities/:secid
+    итоги дня из ISS снимком из bonds не перезаписываются
+    """
+    __tablename__ = "bond_history"
+    __table_args__ = (Index("ix_bond_history_date_secid", "date", "secid", unique=True),)
+    id = Column(Integer, primary_key=True)
+    date = Column(DateTime)
+    secid = Column(String)
+    price = Column(Float)  # цена закрытия в проц от номинала
+    accruedint = Column(Float)  # НКД
+    yieldsec = Column(Float)  # доходность по цене закрытия от мосбиржи
+    volume = Column(Integer)
+    facevalue = Column(Float)  # номинал на дату (у амортизируемых уменьшается)
+    source = Column(String)  # iss - итоги дня из истории ISS, snapshot - снимок bonds (Db.record_history)
+
+
+class Issuer(Base):
+    """
+    Эмитент - общее для всех его выпусков, id = Bond.emitent_id
+    заполняется из списка облиг один раз на эмитента и перезаписывается не чаще ISSUER_TTL_SECONDS
+    """
+    __tablename__ = "issuers"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String)
+    inn = Column(String)
+    okpo = Column(String)
+    updated = Column(DateTime)
+
+
+class AlertRule(Base):
+    """
+    Правило оповещения: field op value, напр. price < 100 (ниже номинала), calc_yield > 20, days_to_buyback <= 30
+    срабатывает, когда условие становится истинным (переход через порог), а не на каждом обновлении
+    """
+    __tablename__ = "alert_rules"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    secid = Column(String)  # None - по всем облигам
+    field = Column(String)  # см. Alerts.FIELDS
+    op = Column(String)  # <, <=, >, >=
+    value = Column(Float)
+    created = Column(DateTime, default=datetime.now)
+
+
+class Meta(Base):
+    """
+    Служебные значения базы
+    data_version растет на каждом коммите записи (Db.commit) - по нему кеши понимают, что данные поменялись
+    """
+    __tablename__ = "meta"
+    key = Column(String, primary_key=True)
+    value = Column(Integer)
+
+
+class Quarantine(Base):
+    """
+    Облиги, по которым ISS не ответил после всех попыток
+    до next_retry облига в обновление не берется, интервал растет экспоненциально
+    """
+    __tablename__ = "quarantine"
+    id = Column(Integer, primary_key=True)
+    secid = Column(String, index=True)
+    endpoint = Column(String)  # семейство метода, см. Moex.endpoint_family
+    attempts = Column(Integer)  # сколько обновлений подряд не прошло
+    last_error = Column(String)
+    first_failed = Column(DateTime)
+    last_failed = Column(DateTime)
+    next_retry = Column(DateTime)
@@ -1,31 +1,100 @@
 import datetime
+import re
 import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from urllib import parse
 import requests
 from bs4 import BeautifulSoup
 
+from inc.Metrics import metrics
+
+ISS_URL = "https://iss.moex.com/iss"
+SMARTLAB_URL = "https://smart-lab.ru"
+# тип купона со Smart-Lab есть только у рублевых облиг
+SMARTLAB_FACEUNITS = ('SUR', 'RUB')
+
+# неудачные запросы внутри collect_failures: у каждого потока и задачи asyncio - свой список
+_failures = ContextVar('failures', default=None)
+
 
 class Moex:
+    def __init__(self, iss_url=ISS_URL, smartlab_url=SMARTLAB_URL):
+        """
+        :param iss_url: можно направить на заглушку ISS (см. Synthetic.IssStub)
+        :param smartlab_url:
+        """
+        self.iss_url = iss_url
+        self.smartlab_url = smartlab_url
+
+    @staticmethod
+    @contextmanager
+    def collect_failures():
+        """
+        Неудачные запросы внутри блока, только своего потока / задачи asyncio
+        (клиент общий - запросы других потоков сюда не попадают)
+            with moex.collect_failures() as failures:
+                specs = moex.get_specs(secid)
+        :return: список (endpoint, текст ошибки)
+        """
+        failures = []
+        token = _failures.set(failures)
+        try:
+            yield failures
+        finally:
+            _failures.reset(token)
+
+    @staticmethod
+    def _fail(endpoint: str, error):
+        failures = _failures.get()
+        if failures is not None:
+            failures.append((endpoint, str(error)))
+
+    @staticmethod
+    def endpoint_family(method: str) -> str:
+        """
+        Метод без конкретной бумаги, для метрик:
+        securities/RU000A1047S3/bondization -> securities/:secid/bondization
+        :param method:
+        :return:
+        """
+        return "/".join(":secid" if re.fullmatch(r"(?=.*\d)(?=.*[A-Z])[A-Z0-9-]+", part) else part
+                        for part in method.split("/"))
+
     def query(self, method: str, **kwargs):
         """
         Отправка запроса к ISS MOEX
         """
+        endpoint = self.endpoint_family(method)
+        error = None
         for attempt in range(3):
+            if attempt:
+                metrics.inc("iss_retries_total", endpoint=endpoint)
+            start = time.perf_counter()
             try:
                 # Формируем URL
-                url = f"https://iss.moex.com/iss/{method}.json"
+                url = f"{self.iss_url}/{method}.json"
                 # if kwargs:
                 #    url += "?" + parse.urlencode(kwargs)
 
                 # Выполняем запрос
                 response = requests.get(url, params=kwargs, timeout=1)
+                metrics.inc("iss_bytes_total", len(response.content), endpoint=endpoint)
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                metrics.observe("iss_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+                metrics.inc("iss_requests_total", endpoint=endpoint, status="ok")
+                return result
 
             except Exception as e:
+                error = e
+                metrics.observe("iss_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+                metrics.inc("iss_requests_total", endpoint=endpoint, status="error")
                 print(f"Попытка {attempt + 1}/3 ошибка: {e}")
                 if attempt >= 2:
                     time.sleep(10)
+        metrics.inc("iss_failures_total", endpoint=endpoint)
+        self._fail(endpoint, error)
         return None
 
     def flatten_old(self, data: dict, blockname: str):
@@ -131,6 +200,119 @@ class Moex:
         print(f"📊 Страница {page}: получено {len(flattened_data)} облигаций")
         return flattened_data
 
+    def get_marketdata(self):
+        """
+        Текущие (внутридневные) рыночные данные сразу по всем облигациям рынка
+        одним запросом, в отличие от get_yield, где итоги пред. сессии по одной бумаге
+        Строки по всем режимам торгов (board), фильтровать нужно на стороне вызова
+        :return:
+        """
+        params = {
+            "iss.only": "marketdata",
+            "iss.meta": "off",
+            "marketdata.columns": "SECID,BOARDID,LAST,YIELD,VOLTODAY,SYSTIME"
+        }
+        data_dict = self.query("engines/stock/markets/bonds/securities", **params)
+        if data_dict is None:
+            print("Не удалось получить marketdata")
+            return []
+
+        return self.flatten(data_dict, 'marketdata')
+
+    def get_bondization(self, secid: str):
+        """
+        График платежей облигации: купоны и амортизации (погашение - последняя амортизация)
+        :param secid:
+        :return: список {'date', 'kind', 'value'}, для плавающих купонов будущие value = None
+        """
+        params = {
+            "iss.only": "coupons,amortizations",
+            "iss.meta": "off",
+            "limit": "unlimited"
+        }
+        data_dict = self.query(f"securities/{secid}/bondization", **params)
+        if data_dict is None:
+            print(f"Не удалось получить график платежей для {secid}")
+            return []
+
+        return self._parse_bondization(data_dict)
+
+    def _parse_bondization(self, data_dict: dict):
+        flows = [{'date': c.get('coupondate'), 'kind': 'coupon', 'value': c.get('value')}
+                 for c in self.flatten(data_dict, 'coupons')]
+        flows += [{'date': a.get('amortdate'), 'kind': 'amortization', 'value': a.get('value')}
+                  for a in self.flatten(data_dict, 'amortizations')]
+        return [f for f in flows if f['date']]
+
+    def get_candles(self, secid: str, interval: int, since: str, page_size=500):
+        """
+        Свечи OHLCV с даты since, ISS отдает их страницами по 500
+        :param secid:
+        :param interval: 1, 10, 60 - минуты, 24 - день, 7 - неделя, 31 - месяц
+        :param since: "YYYY-MM-DD HH:MM:SS", свеча с началом в since тоже придет
+        :param page_size:
+        :return: список {'open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end'}, None если запрос не удался
+        """
+        params = {
+            "from": since,
+            "interval": interval,
+            "iss.only": "candles",
+            "iss.meta": "off",
+        }
+        candles = []
+        while True:
+            data_dict = self.query(f"engines/stock/markets/bonds/securities/{secid}/candles",
+                                   start=len(candles), **params)
+            if data_dict is None:
+                print(f"Не удалось получить свечи для {secid}")
+                return None
+
+            page = self.flatten(data_dict, 'candles')
+            candles += page
+            if len(page) < page_size:
+                return candles
+
+    def get_history(self, secid: str, since: str, page_size=100):
+        """
+        Дневные итоги торгов с даты since в осн. режиме (marketprice_board), ISS отдает их страницами по 100
+        :param secid:
+        :param since: "YYYY-MM-DD"
+        :param page_size:
+        :return: строки для Db.add_history, None если запрос не удался
+        """
+        params = {
+            "from": since,
+            "marketprice_board": 1,
+            "iss.only": "history",
+            "iss.meta": "off",
+            "history.columns": "TRADEDATE,CLOSE,ACCINT,YIELDCLOSE,VOLUME,FACEVALUE",
+        }
+        rows = []
+        while True:
+            data_dict = self.query(f"history/engines/stock/markets/bonds/securities/{secid}",
+                                   start=len(rows), **params)
+            if data_dict is None:
+                print(f"Не удалось получить историю для {secid}")
+                return None
+
+            page = self.flatten(data_dict, 'history')
+            rows += page
+            if len(page) < page_size:
+                return self._history_rows(secid, rows)
+
+    @staticmethod
+    def _history_rows(secid: str, rows: list) -> list:
+        # дни без сделок (нет цены закрытия) не пишу, объем - как в _parse_yield
+        return [{
+            'date': datetime.datetime.strptime(r['tradedate'], "%Y-%m-%d"),
+            'secid': secid,
+            'price': r['close'],
+            'accruedint': r.get('accint'),
+            'yieldsec': r.get('yieldclose'),
+            'volume': (r.get('volume') or 0) * 1000,
+            'facevalue': r.get('facevalue'),
+        } for r in rows if r.get('close')]
+
     def get_bond_type_from_smartlab(self, secid):
         """
         Получает тип облигации с сайта Smart-Lab по ISIN
@@ -138,12 +320,16 @@ class Moex:
         """
         for attempt in range(3):
             try:
-                url = f"https://smart-lab.ru/q/bonds/{secid}/"
+                url = f"{self.smartlab_url}/q/bonds/{secid}/"
                 # headers = {
                 #    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 # }
 
+                start = time.perf_counter()
                 response = requests.get(url, timeout=30)
+                metrics.observe("smartlab_request_seconds", time.perf_counter() - start)
+                metrics.inc("smartlab_bytes_total", len(response.content))
+                metrics.inc("smartlab_requests_total", status=str(response.status_code))
                 # response.raise_for_status()
                 if response.status_code != 200:
                     return None
@@ -154,33 +340,53 @@ class Moex:
                 title_tag = soup.find('h1', class_='qn-menu__title')
 
                 if title_tag:
-                    title_text = title_tag.get_text().lower()
-
-                    if 'плавающим' in title_text:
-                        return 'Плавающий купон'
-                    elif 'переменным' in title_text:
-                        return 'Переменный купон'
-                    elif 'фиксированным' in title_text:
-                        return 'Фиксированный купон'
-                    elif 'амортизацией' in title_text:
-                        return 'Амортизирующий долг'
-                    elif 'индексируемым' in title_text:
-                        return 'Индексируемый номинал'
-                    return None
+                    return self._bond_type_from_title(title_tag.get_text())
 
             except Exception as e:
+                metrics.inc("smartlab_requests_total", status="error")
                 print(f"Попытка {attempt + 1}/3 ошибка: {e}")
                 if attempt < 2:
                     time.sleep(2)
         return None
 
+    @staticmethod
+    def _bond_type_from_title(title: str):
+        title_text = title.lower()
+
+        if 'плавающим' in title_text:
+            return 'Плавающий купон'
+        elif 'переменным' in title_text:
+            return 'Переменный купон'
+        elif 'фиксированным' in title_text:
+            return 'Фиксированный купон'
+        elif 'амортизацией' in title_text:
+            return 'Амортизирующий долг'
+        elif 'индексируемым' in title_text:
+            return 'Индексируемый номинал'
+        return None
+
     def get_specs(self, secid: str):
         data_dict = self.query(f"securities/{secid}")
         if data_dict is None:
             print(f"Не удалось получить спецификации для {secid}")
             return {}
         specs = self.rows_to_dict(data_dict, 'description')
-        specs["accruedint"] = self.get_nkd(secid)
+        nkd = self.get_nkd(secid)
+        yield_dict = self.get_yield(secid)
+        bondtype = self.get_bond_type_from_smartlab(secid) if specs.get("faceunit") in SMARTLAB_FACEUNITS else None
+        return self._build_specs(specs, nkd, yield_dict, bondtype)
+
+    def _build_specs(self, specs: dict, nkd, yield_dict: dict, bondtype) -> dict:
+        """
+        Спеки облиги из ответов ISS и Smart-Lab плюс расчетные поля
+        (общее для синхронного и асинхронного клиента - отличаются только запросы)
+        :param specs: описание бумаги (rows_to_dict description)
+        :param nkd: get_nkd
+        :param yield_dict: get_yield
+        :param bondtype: get_bond_type_from_smartlab, None для нерублевых
+        :return:
+        """
+        specs["accruedint"] = nkd
         specs["remaining_coupons"] = self._get_remaining_coupons(specs)
         specs["days_to_buyback"] = (datetime.datetime.strptime(specs.get(
             "buybackdate"), "%Y-%m-%d").date() - datetime.datetime.now().date()).days if specs.get("buybackdate") else None
@@ -188,7 +394,6 @@ class Moex:
             "coupondate"), "%Y-%m-%d").date() - datetime.datetime.now().date()).days if specs.get("coupondate") else None
         specs["days_to_finish"] = (datetime.datetime.strptime(specs.get(
             "matdate"), "%Y-%m-%d").date() - datetime.datetime.now().date()).days if specs.get("matdate") else None
-        yield_dict = self.get_yield(secid)
         specs["price"] = yield_dict.get("price")
         specs["yieldsec"] = yield_dict.get("yieldsec")
         specs["volume"] = yield_dict.get("volume")
@@ -201,10 +406,7 @@ class Moex:
         calc_yield_dict_ = self._get_calc_yield_params_(specs)
         specs["_total_percent"] = calc_yield_dict_.get("_total_percent")
         specs["_month_percent"] = calc_yield_dict_.get("_month_percent")
-        if specs.get("faceunit") in ['SUR', 'RUB']:
-            specs["bondtype"] = self.get_bond_type_from_smartlab(secid)
-        else:
-            specs["bondtype"] = None
+        specs["bondtype"] = bondtype
         return specs
 
     def _get_calc_yield_params_(self, specs):
@@ -272,7 +474,10 @@ class Moex:
             f"engines/stock/markets/bonds/securities/{secid}",
             **params
         )
+        return self._parse_nkd(data)
 
+    @staticmethod
+    def _parse_nkd(data):
         # Безопасное извлечение данных
         if not data or 'securities' not in data:
             return None
@@ -408,6 +613,9 @@ class Moex:
                      datetime.timedelta(days=7)).strftime("%Y-%m-%d")
 
         data_dict = self.query(path, **{"from": from_date})
+        return self._parse_yield(secid, data_dict)
+
+    def _parse_yield(self, secid: str, data_dict):
         if data_dict is None:
             print(f"Не удалось получить доходность для {secid}")
             return self._get_empty_yield_data()
@@ -0,0 +1,134 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inc.CashFlows import CashFlows
+from inc.Db import Db
+
+# без этих колонок файл позиций не читаю
+POSITION_COLUMNS = ('secid', 'quantity')
+
+
+class Portfolio:
+    """
+    Календарь будущих выплат по портфелю: купоны, амортизации и погашения, налог и сумма после налога
+    график каждой облиги строится один раз (CashFlows) сразу по всем облигам портфеля,
+    позиции - это умножение строк графика на количество, группировка - один groupby
+    Пример:
+        p = Portfolio.from_file(db, "positions.csv")
+        p.project(horizon=365, by='month')
+    """
+    GROUPS = ('day', 'month', 'issuer', 'secid')
+    AMOUNTS = ('coupon', 'amortization', 'redemption', 'tax', 'net')
+
+    def __init__(self, positions: pd.DataFrame, bonds: pd.DataFrame, flows: pd.DataFrame = None,
+                 tax_rate=0.13, today: datetime = None):
+        """
+        :param positions: колонки secid, quantity (шт), необязательно price (цена покупки, % от номинала)
+                          одна облига может быть в нескольких строках
+        :param bonds: как в Db.get_df
+        :param flows: Db.get_cashflows_df
+        :param tax_rate: НДФЛ с купонов и с дохода от погашения выше цены покупки
+        :param today:
+        """
+        self.tax_rate = tax_rate
+        positions = positions[positions['quantity'] > 0]
+        price = positions['price'] if 'price' in positions.columns else pd.Series(np.nan, index=positions.index)
+
+        held = bonds[bonds['secid'].isin(positions['secid'])].drop_duplicates('secid').reset_index(drop=True)
+        self.bonds = held
+        self.missing = sorted(set(positions['secid']) - set(held['secid']))
+        self.cf = CashFlows(held, flows, today=today)
+
+        rows = pd.Series(held.index, index=held['secid'])
+        known = positions['secid'].isin(rows.index).to_numpy()
+        pos_rows = rows.loc[positions['secid'][known]].to_numpy()
+        qty = positions['quantity'].to_numpy(dtype=float)[known]
+        n = len(held)
+        self.quantity = np.bincount(pos_rows, weights=qty, minlength=n)
+
+        # налог с погашения выше цены покупки - у каждой позиции своя цена, без цены налога нет
+        face = held['facevalue'].fillna(0).to_numpy(dtype=float)
+        gain = self.cf.principal.sum(axis=1)[pos_rows] - face[pos_rows] * price.to_numpy(dtype=float)[known] / 100
+        gain = np.nan_to_num(np.maximum(gain, 0))
+        self.gain_tax = np.bincount(pos_rows, weights=qty * gain, minlength=n) * tax_rate
+
+    @classmethod
+    def from_file(cls, db: Db, filename: str, tax_rate=0.13):
+        return cls(cls.read_positions(filename), db.get_df(), db.get_cashflows_df(), tax_rate)
+
+    @staticmethod
+    def read_positions(filename: str) -> pd.DataFrame:
+        """
+        Позиции из csv (разделитель , или ;) или xlsx
+        :param filename:
+        :return:
+        """
+        if filename.endswith(('.xlsx', '.xls')):
+            positions = pd.read_excel(filename)
+        else:
+            positions = pd.read_csv(filename, sep=None, engine='python')
+        positions.columns = [str(c).strip().lower() for c in positions.columns]
+
+        missing = [c for c in POSITION_COLUMNS if c not in positions.columns]
+        if missing:
+            raise ValueError(f"В файле позиций нет колонок: {', '.join(missing)}")
+        positions['secid'] = positions['secid'].astype(str).str.strip()
+        positions['quantity'] = pd.to_numeric(positions['quantity'], errors='coerce').fillna(0)
+        return positions
+
+    def flows(self, horizon=365) -> pd.DataFrame:
+        """
+        Все выплаты по портфелю на horizon дней вперед, строка - облига и дата
+        :param horizon: дней
+        :return: колонки date, secid, emitent_id, faceunit, coupon, amortization, redemption, tax, net
+        """
+        cf = self.cf
+        until = np.datetime64(cf.today.date(), 'D') + np.timedelta64(horizon, 'D')
+        mask = ~np.isnat(cf.dates) & (cf.dates <= until) & (self.quantity > 0)[:, None]
+        r, c = np.nonzero(mask)
+
+        qty = self.quantity[r]
+        principal = cf.principal[r, c] * qty
+        # последний платеж по графику - погашение, остальное тело - амортизация
+        last = c == cf.counts[r] - 1
+        coupon = cf.coupons[r, c] * qty
+        tax = coupon * self.tax_rate + np.where(last, self.gain_tax[r], 0.0)
+
+        return pd.DataFrame({
+            'date': cf.dates[r, c],
+            'secid': cf.secids[r],
+            'emitent_id': self.bonds['emitent_id'].to_numpy()[r],
+            'faceunit': self.bonds['faceunit'].to_numpy()[r],
+            'coupon': coupon,
+            'amortization': np.where(last, 0.0, principal),
+            'redemption': np.where(last, principal, 0.0),
+            'tax': tax,
+            'net': coupon + principal - tax,
+        })
+
+    def project(self, horizon=365, by='month') -> pd.DataFrame:
+        """
+        Выплаты, сложенные по дням, месяцам, эмитентам или облигам, отдельно по валютам номинала
+        :param horizon: дней
+        :param by: одно из GROUPS
+        :return:
+        """
+        if by not in self.GROUPS:
+            raise ValueError(f"Группировка {by} не из {', '.join(self.GROUPS)}")
+
+        flows = self.flows(horizon)
+        if by == 'day':
+            key = flows['date']
+        elif by == 'month':
+            key = flows['date'].to_numpy(dtype='datetime64[M]')
+        else:
+            key = flows['emitent_id' if by == 'issuer' else 'secid']
+        flows[by] = key
+
+        result = flows.groupby([by, 'faceunit'], dropna=False)[list(self.AMOUNTS)].sum().reset_index()
+        if by == 'month':
+            result['month'] = result['month'].dt.strftime('%Y-%m')
+        result[list(self.AMOUNTS)] = result[list(self.AMOUNTS)].round(2)
+        return result
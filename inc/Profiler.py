@@ -0,0 +1,69 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+
+
+class Profiler:
+    """
+    Профилирование любой команды:
+    - cProfile -> prefix.pstats (python -m pstats, snakeviz и т.п.)
+    - сэмплы стека основного потока -> prefix.collapsed,
+      формат "func;func;func count" для flamegraph.pl / speedscope / inferno
+    """
+
+    def __init__(self, prefix: str, interval=0.005):
+        """
+        :param prefix: путь к файлам без расширения
+        :param interval: период сэмплирования стека, сек
+        """
+        self.prefix = prefix
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = threading.get_ident()
+
+    def start(self):
+        folder = os.path.dirname(self.prefix)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self.profile.enable()
+
+    def stop(self) -> list:
+        """
+        Остановка и запись файлов
+        :return: список созданных файлов
+        """
+        self.profile.disable()
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+        pstats_file = self.prefix + ".pstats"
+        self.profile.dump_stats(pstats_file)
+
+        collapsed_file = self.prefix + ".collapsed"
+        with open(collapsed_file, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return [pstats_file, collapsed_file]
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            # корень стека первым, как ожидает flamegraph
+            self.stacks[";".join(reversed(stack))] += 1
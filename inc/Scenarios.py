@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+from inc.CashFlows import CashFlows
+from inc.Db import Db
+from inc.Yields import YieldEngine
+
+# узлы кривой для сдвигов по срокам, лет; между узлами сдвиг интерполируется линейно, за краями - как у крайнего
+KEY_TENORS = (0.25, 0.5, 1, 2, 3, 5, 7, 10, 15, 20)
+# сколько ячеек облига x платеж x сценарий считать за раз, чтобы не раздувать память на больших сетках
+_CHUNK_CELLS = 5_000_000
+
+
+class ScenarioEngine:
+    """
+    Чувствительность цен облиг к ставкам по графикам платежей (CashFlows):
+    - модифицированная дюрация, выпуклость и DV01 по всей выборке сразу
+    - переоценка под сдвиги доходности: параллельные и по срокам (KEY_TENORS),
+      все сценарии сетки считаются одной операцией numpy над облига x платеж x сценарий
+    Доходность до шока - годовая эффективная ставка до налогов, при которой график стоит текущую цену с НКД
+    Пример:
+        se = ScenarioEngine.from_db(db)
+        se.risk()
+        se.reprice(ScenarioEngine.parallel(range(-300, 301, 100)))
+    """
+
+    def __init__(self, bonds: pd.DataFrame, flows: pd.DataFrame = None, quantity: np.ndarray = None,
+                 to_put=False, today=None):
+        """
+        :param bonds: как в Db.get_df, облиги без цены получат NaN
+        :param flows: Db.get_cashflows_df
+        :param quantity: кол-во по каждой облиге из bonds для оценки портфеля, по умолчанию по 1 шт
+        :param to_put: платежи до оферты
+        :param today:
+        """
+        self.bonds = bonds.reset_index(drop=True)
+        self.quantity = np.ones(len(self.bonds)) if quantity is None else np.asarray(quantity, dtype=float)
+        self.cf = CashFlows(self.bonds, flows, to_put=to_put, today=today)
+
+        pricer = YieldEngine(tax_rate=0.0)
+        self.price = pricer.cost(self.bonds)
+        guess = self.bonds['yieldsec'].to_numpy(dtype=float) / 100 if 'yieldsec' in self.bonds.columns else None
+        self.base_yield = pricer.solve(self.cf.times, self.cf.amounts, self.price, guess)
+
+        # веса узлов кривой для каждого платежа: n x m x узлы
+        times = self.cf.times
+        eye = np.eye(len(KEY_TENORS))
+        self.weights = np.stack([np.interp(times, KEY_TENORS, eye[k]) for k in range(len(KEY_TENORS))], axis=-1)
+
+    @classmethod
+    def from_db(cls, db: Db, to_put=False):
+        bonds = db.get_df()
+        return cls(bonds[bonds['price'] > 0], db.get_cashflows_df(), to_put=to_put)
+
+    @staticmethod
+    def parallel(shifts) -> pd.DataFrame:
+        """
+        Сетка параллельных сдвигов
+        :param shifts: б.п.
+        :return: сценарий x узел кривой, б.п.
+        """
+        shifts = np.asarray(list(shifts), dtype=float)
+        return pd.DataFrame(np.repeat(shifts[:, None], len(KEY_TENORS), axis=1),
+                            index=[f"{s:+g}bp" for s in shifts], columns=KEY_TENORS)
+
+    @staticmethod
+    def bucketed(name: str, shifts: dict) -> pd.DataFrame:
+        """
+        Сценарий сдвигов по срокам, узлы без сдвига интерполируются между заданными
+        :param name:
+        :param shifts: срок, лет -> б.п., напр {1: 50, 5: 0, 10: -25}
+        :return: сценарий x узел кривой, б.п.
+        """
+        tenors = sorted(shifts)
+        curve = np.interp(KEY_TENORS, tenors, [shifts[t] for t in tenors])
+        return pd.DataFrame([curve], index=[name], columns=KEY_TENORS)
+
+    def _discounted(self, yields: np.ndarray) -> np.ndarray:
+        """
+        Дисконтированные платежи
+        :param yields: ставка по каждому платежу, n x m (x сценарии)
+        :return:
+        """
+        times = self.cf.times if yields.ndim == 2 else self.cf.times[..., None]
+        amounts = self.cf.amounts if yields.ndim == 2 else self.cf.amounts[..., None]
+        with np.errstate(invalid='ignore'):
+            return amounts * np.exp(-times * np.log1p(yields))
+
+    def risk(self) -> pd.DataFrame:
+        """
+        Цена, доходность и чувствительность к ставке по каждой облиге
+        :return: колонки secid, price (грязная, в валюте), yield (%), duration (модифицированная, лет),
+                 convexity, dv01 (изменение цены на +1 б.п., в валюте)
+        """
+        y = self.base_yield
+        pv = self._discounted(np.broadcast_to(y[:, None], self.cf.times.shape))
+        t = self.cf.times
+        with np.errstate(invalid='ignore', divide='ignore'):
+            duration = (t * pv).sum(axis=1) / self.price / (1 + y)
+            convexity = (t * (t + 1) * pv).sum(axis=1) / self.price / (1 + y) ** 2
+
+        return pd.DataFrame({
+            'secid': self.bonds['secid'],
+            'price': np.round(self.price, 2),
+            'yield': np.round(y * 100, 2),
+            'duration': np.round(duration, 3),
+            'convexity': np.round(convexity, 3),
+            'dv01': np.round(-duration * self.price / 10_000, 4),
+        })
+
+    def reprice(self, scenarios: pd.DataFrame) -> pd.DataFrame:
+        """
+        Цены под каждым сценарием
+        :param scenarios: сценарий x узел кривой (KEY_TENORS), б.п. - parallel / bucketed, можно склеить pd.concat
+        :return: облига (secid) x сценарий, грязная цена в валюте
+        """
+        shifts = scenarios.reindex(columns=KEY_TENORS).to_numpy(dtype=float) / 10_000
+        n, m = self.cf.times.shape
+        step = max(1, _CHUNK_CELLS // max(n * m, 1))
+
+        prices = np.empty((n, len(shifts)))
+        for start in range(0, len(shifts), step):
+            chunk = shifts[start:start + step]
+            # сдвиг ставки для каждого платежа в каждом сценарии: n x m x сценарии
+            yields = self.base_yield[:, None, None] + self.weights @ chunk.T
+            prices[:, start:start + len(chunk)] = self._discounted(yields).sum(axis=1)
+        prices[np.isnan(self.base_yield)] = np.nan
+        return pd.DataFrame(prices, index=self.bonds['secid'], columns=scenarios.index)
+
+    def pnl(self, scenarios: pd.DataFrame) -> pd.DataFrame:
+        """
+        Итог по всей выборке (портфелю с quantity) под каждым сценарием, отдельно по валютам номинала
+        :param scenarios: как в reprice
+        :return: индекс сценарий, faceunit; колонки value (стоимость в валюте), change, change_pct
+        """
+        prices = self.reprice(scenarios).to_numpy()
+        valid = ~np.isnan(self.base_yield)
+        units = self.bonds['faceunit'].fillna('').to_numpy()
+
+        parts = []
+        for unit in pd.unique(units[valid]):
+            rows = valid & (units == unit)
+            base = (self.price * self.quantity)[rows].sum()
+            value = (prices[rows] * self.quantity[rows, None]).sum(axis=0)
+            parts.append(pd.DataFrame({
+                'scenario': scenarios.index,
+                'faceunit': unit,
+                'value': np.round(value, 2),
+                'change': np.round(value - base, 2),
+                'change_pct': np.round((value / base - 1) * 100, 3),
+            }))
+        if not parts:
+            return pd.DataFrame(columns=['scenario', 'faceunit', 'value', 'change', 'change_pct'])
+        return pd.concat(parts, ignore_index=True).set_index(['scenario', 'faceunit'])
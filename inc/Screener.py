@@ -0,0 +1,143 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inc.Db import Db
+
+
+class Screener:
+    """
+    Индекс облиг в памяти для интерактивного отбора
+    строится один раз, дальше каждый запрос - это пара операций numpy без pandas и SQL:
+    - по числовым колонкам отсортированные значения, диапазон = searchsorted
+    - по категориям (листинг, валюта, тип, торгуется) и по корзинам срока / доходности - битовые маски
+    Пример:
+        sc = Screener.from_db(db)
+        sc.screen(listlevel=[1, 2], faceunit='SUR', price=(None, 100), ytm=(12, None), limit=10)
+    """
+    RANGE_COLUMNS = ('price', 'calc_yield', 'ytm', 'ytp', 'yieldsec', 'couponpercent',
+                     'volume', 'accruedint', 'issuesize', 'matdays')
+    BITMAP_COLUMNS = ('listlevel', 'faceunit', 'bondtype', 'is_traded')
+    # корзины срока до погашения, дни: [0, 90), [90, 180) ...
+    MATURITY_BUCKETS = (0, 90, 180, 365, 730, 1095, 1825, 3650)
+    # полосы доходности, %
+    YIELD_BANDS = (0, 5, 8, 11, 15, 20, 30)
+
+    def __init__(self, df: pd.DataFrame, yield_column='ytm'):
+        self.df = df.reset_index(drop=True)
+        self.n = len(self.df)
+        self.yield_column = yield_column
+
+        if 'matdate' in self.df.columns:
+            matdate = pd.to_datetime(self.df['matdate'])
+            self.df['matdays'] = (matdate - pd.Timestamp(datetime.now())).dt.days
+
+        self.values = {}
+        self.order = {}
+        self.order_desc = {}
+        self.sorted = {}
+        for col in self.RANGE_COLUMNS:
+            if col not in self.df.columns:
+                continue
+            values = pd.to_numeric(self.df[col], errors='coerce').to_numpy(dtype=float)
+            # NaN уходят в конец сортировки и в диапазоны не попадают
+            order = np.argsort(values, kind='stable')
+            self.values[col] = values
+            self.order[col] = order
+            self.sorted[col] = values[order]
+            # для обратного порядка NaN тоже остаются в конце
+            valid = np.count_nonzero(~np.isnan(values))
+            self.order_desc[col] = np.concatenate((order[:valid][::-1], order[valid:]))
+
+        self.bitmaps = {}
+        for col in self.BITMAP_COLUMNS:
+            if col in self.df.columns:
+                self.bitmaps[col] = self._bitmaps(self.df[col].to_numpy())
+
+        if 'matdays' in self.values:
+            self.bitmaps['maturity'] = self._bucket_bitmaps(self.values['matdays'], self.MATURITY_BUCKETS)
+        if yield_column in self.values:
+            self.bitmaps['yield_band'] = self._bucket_bitmaps(self.values[yield_column], self.YIELD_BANDS)
+
+    @classmethod
+    def from_db(cls, db: Db, yield_column='ytm'):
+        # из колоночного снимка, как Analytics: SQLite читается только после изменения данных
+        return cls(db.get_snapshot_df(), yield_column)
+
+    def _bitmaps(self, values: np.ndarray) -> dict:
+        """
+        Значение -> маска строк с этим значением
+        :param values:
+        :return:
+        """
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        return {u: codes == i for i, u in enumerate(uniques)}
+
+    def _bucket_bitmaps(self, values: np.ndarray, edges: tuple) -> dict:
+        """
+        Маски по корзинам, ключ - нижняя граница корзины
+        :param values:
+        :param edges:
+        :return:
+        """
+        buckets = np.digitize(values, edges) - 1
+        buckets[np.isnan(values)] = -2
+        return {edges[i]: buckets == i for i in range(len(edges))}
+
+    def _match_bitmap(self, col: str, wanted) -> np.ndarray:
+        bitmaps = self.bitmaps.get(col)
+        if bitmaps is None:
+            raise KeyError(f"Нет индекса по {col}")
+        if not isinstance(wanted, (list, tuple, set)):
+            wanted = [wanted]
+
+        mask = np.zeros(self.n, dtype=bool)
+        for value in wanted:
+            # True / 1 для is_traded, 1 / 1.0 для listlevel - ключи dict совпадают
+            if value in bitmaps:
+                mask |= bitmaps[value]
+        return mask
+
+    def _match_range(self, col: str, bounds: tuple) -> np.ndarray:
+        if col not in self.sorted:
+            raise KeyError(f"Нет индекса по {col}")
+        lo, hi = bounds
+        values = self.sorted[col]
+        left = 0 if lo is None else np.searchsorted(values, lo, side='left')
+        # NaN в конце, правая граница без них
+        right = np.searchsorted(values, np.inf if hi is None else hi, side='right')
+
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.order[col][left:right]] = True
+        return mask
+
+    def query(self, order_by=None, ascending=False, limit=20, **criteria) -> np.ndarray:
+        """
+        Номера строк, подходящих под все критерии, в порядке order_by
+        :param order_by: колонка из RANGE_COLUMNS, по умолчанию yield_column
+        :param ascending:
+        :param limit: None - все
+        :param criteria: колонка=значение / список значений для категорий и корзин (maturity, yield_band),
+                         колонка=(от, до) для числовых, None - без границы
+        :return:
+        """
+        mask = np.ones(self.n, dtype=bool)
+        for col, wanted in criteria.items():
+            if wanted is None or wanted == (None, None):
+                continue
+            if col in self.sorted and isinstance(wanted, tuple):
+                mask &= self._match_range(col, wanted)
+            else:
+                mask &= self._match_bitmap(col, wanted)
+
+        order_by = order_by or self.yield_column
+        order = self.order[order_by] if ascending else self.order_desc[order_by]
+        rows = order[mask[order]]
+        return rows if limit is None else rows[:limit]
+
+    def screen(self, order_by=None, ascending=False, limit=20, **criteria) -> pd.DataFrame:
+        """
+        То же что query, но сразу строки DataFrame
+        """
+        return self.df.iloc[self.query(order_by, ascending, limit, **criteria)]
@@ -0,0 +1,603 @@
+import json
+import random
+import re
+import time
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete
+
+from inc.Db import Db
+from inc.Metrics import metrics
+from inc.Models import Bond, BondHistory, CashFlow, Issuer
+
+# синтетические облиги и эмитенты не пересекаются с настоящими: свой префикс secid и диапазон id
+SECID_PREFIX = "SYN"
+ISSUER_ID_BASE = 10_000_000
+# частота купона -> доля облиг
+FREQUENCIES = {1: 0.05, 2: 0.4, 4: 0.4, 12: 0.15}
+FACEUNITS = {'SUR': 0.92, 'USD': 0.04, 'CNY': 0.04}
+# тип облиги ISS -> (доля, typename, режим торгов)
+TYPES = {
+    'corporate_bond': (0.75, 'Корпоративная облигация', 'TQCB'),
+    'exchange_bond': (0.12, 'Биржевая облигация', 'TQCB'),
+    'subfederal_bond': (0.08, 'Региональная облигация', 'TQCB'),
+    'ofz_bond': (0.05, 'ОФЗ', 'TQOB'),
+}
+# спред к ключевой ставке по уровню листинга, п.п.
+KEY_RATE = 16.0
+LISTLEVEL_SPREAD = {1: 1.0, 2: 3.0, 3: 6.0}
+# амортизация - равными частями в последние AMORTIZATION_PAYMENTS купонов
+AMORTIZATION_PAYMENTS = 4
+# заголовок страницы Smart-Lab по типу купона (см. Moex.get_bond_type_from_smartlab)
+SMARTLAB_TITLES = {
+    'Фиксированный купон': 'с фиксированным купоном',
+    'Плавающий купон': 'с плавающим купоном',
+    'Амортизирующий долг': 'с амортизацией долга',
+}
+_NAME_PARTS = (('Газ', 'Нефть', 'Энерго', 'Транс', 'Агро', 'Строй', 'Фин', 'Телеком', 'Металл', 'Лизинг'),
+               ('пром', 'инвест', 'холдинг', 'капитал', 'сервис', 'групп'))
+_CANDLE_FREQ = {1: '1min', 10: '10min', 60: '60min', 24: 'B', 7: 'W-MON', 31: 'MS'}
+_CANDLE_PAGE = 500
+_HISTORY_PAGE = 100
+# строк истории в одной пачке записи
+_HISTORY_CHUNK_ROWS = 1_000_000
+
+
+class SyntheticMarket:
+    """
+    Синтетический рынок облигаций для проверки на масштабе без ISS:
+    облиги, эмитенты и графики платежей генерируются векторно numpy с заданными долями
+    (частоты купонов, оферты, амортизация, неликвид) и одинаково при одном seed
+    из них же собираются ответы в формате ISS (для IssStub) и строки базы (seed)
+    цены во времени (история, свечи) - детерминированная функция от облиги и времени,
+    поэтому повторные и инкрементальные запросы согласованы между собой
+    """
+
+    def __init__(self, n=100_000, seed=0, frequencies: dict = None, offer_share=0.15, amortization_share=0.1,
+                 floating_share=0.15, untraded_share=0.6, illiquid_share=0.3, qualified_share=0.1,
+                 issuers: int = None, today: date = None):
+        """
+        :param n: облиг
+        :param seed:
+        :param frequencies: частота купона -> доля, по умолчанию FREQUENCIES
+        :param offer_share: доля облиг с офертой
+        :param amortization_share: доля амортизируемых
+        :param floating_share: доля с плавающим купоном (будущие купоны неизвестны)
+        :param untraded_share: доля неторгуемых (is_traded = False), на настоящем рынке ~2/3
+        :param illiquid_share: доля торгуемых, но без сделок (цена и объем 0)
+        :param qualified_share: доля только для квалов
+        :param issuers: эмитентов, по умолчанию n / 8
+        :param today:
+        """
+        self.n = n
+        self.today = np.datetime64(today or date.today(), 'D')
+        self.rng = np.random.default_rng(seed)
+        self.frequencies = frequencies or FREQUENCIES
+        self.offer_share = offer_share
+        self.amortization_share = amortization_share
+        self.floating_share = floating_share
+        self.untraded_share = untraded_share
+        self.illiquid_share = illiquid_share
+        self.qualified_share = qualified_share
+        self.issuers = self._issuers(issuers or max(1, n // 8))
+        self.bonds = self._bonds()
+
+    def _choice(self, weights: dict, size: int) -> np.ndarray:
+        keys = list(weights)
+        p = np.array([weights[k] for k in keys], dtype=float)
+        return np.array(keys)[self.rng.choice(len(keys), size=size, p=p / p.sum())]
+
+    def _issuers(self, count: int) -> pd.DataFrame:
+        first, second = _NAME_PARTS
+        i = np.arange(count)
+        names = [f'ПАО "{first[k % len(first)]}{second[k // len(first) % len(second)]}-{k + 1}"' for k in i]
+        return pd.DataFrame({
+            'id': ISSUER_ID_BASE + i,
+            'title': names,
+            'inn': [f"77{k:08d}" for k in i],
+            'okpo': [f"{k:08d}" for k in i],
+        })
+
+    def _bonds(self) -> pd.DataFrame:
+        n, rng, today = self.n, self.rng, self.today
+        i = np.arange(n)
+
+        frequency = self._choice(self.frequencies, n).astype(int)
+        period = np.round(365 / frequency).astype(int)
+        # погашение - от месяца до 30 лет, основная масса в ближайшие 2-5 лет
+        days_left = np.minimum(30 + rng.exponential(3 * 365, n), 30 * 365).astype(int)
+        matdate = today + days_left
+        issuedate = today - rng.integers(1, 5 * 365, n)
+        coupondate = np.minimum(today + rng.integers(1, period + 1), matdate)
+
+        offer = (rng.random(n) < self.offer_share) & (days_left > 60)
+        buybackdate = np.where(offer, today + rng.integers(30, np.maximum(days_left, 31)), np.datetime64('NaT'))
+
+        kind = rng.random(n)
+        floating = kind < self.floating_share
+        amortization = ~floating & (kind < self.floating_share + self.amortization_share)
+        faceunit = self._choice(FACEUNITS, n)
+        bondtype = np.where(floating, 'Плавающий купон',
+                            np.where(amortization, 'Амортизирующий долг', 'Фиксированный купон')).astype(object)
+        # тип со Smart-Lab есть только по рублевым (см. Moex.get_specs)
+        bondtype[faceunit != 'SUR'] = None
+
+        bond_type = self._choice({k: v[0] for k, v in TYPES.items()}, n)
+        listlevel = rng.choice([1, 2, 3], n, p=[0.2, 0.2, 0.6])
+        listlevel[bond_type == 'ofz_bond'] = 1
+
+        market_yield = KEY_RATE + np.vectorize(LISTLEVEL_SPREAD.get)(listlevel) + rng.lognormal(0, 0.6, n)
+        couponpercent = np.round(np.clip(market_yield + rng.normal(0, 2.5, n), 0.1, 40), 2)
+        facevalue = np.full(n, 1000.0)
+        couponvalue = np.round(facevalue * couponpercent / 100 / frequency, 2)
+        # цена от разницы купона и рынка на дюрацию, с шумом, шаг 0.01%
+        duration = np.minimum(days_left / 365, 5) * 0.85
+        price = np.round(np.clip(100 + (couponpercent - market_yield) * duration + rng.normal(0, 1.5, n), 40, 140), 2)
+
+        is_traded = rng.random(n) >= self.untraded_share
+        liquid = is_traded & (rng.random(n) >= self.illiquid_share)
+        volume = np.where(liquid, rng.lognormal(9, 2, n), 0).astype(np.int64)
+        days_to_coupon = (coupondate - today).astype(int)
+        accruedint = np.round(couponvalue * np.clip(period - days_to_coupon, 0, period) / period, 2)
+
+        finish = np.where(offer, buybackdate, matdate)
+        remaining = np.maximum(np.ceil((finish - coupondate).astype(int) / period).astype(int) + 1, 0)
+        yieldsec = np.where(liquid, np.round(market_yield, 2), 0.0)
+        emitent = ISSUER_ID_BASE + (len(self.issuers) * rng.random(n) ** 1.5).astype(int)
+
+        secid = np.char.add(SECID_PREFIX, np.char.zfill(i.astype(str), 7))
+        now = datetime.now()
+        df = pd.DataFrame({
+            'secid': secid,
+            'isin': np.char.add('RU000S', np.char.zfill(i.astype(str), 6)),
+            'shortname': [f"Синт {e - ISSUER_ID_BASE + 1}-{k}" for e, k in zip(emitent, i)],
+            'is_traded': is_traded,
+            'price': np.where(liquid, price, 0.0),
+            'yieldsec': yieldsec,
+            'calc_yield': np.where(liquid, np.round(yieldsec * 0.87, 2), np.nan),
+            'volume': volume,
+            'remaining_coupons': remaining,
+            'days_to_buyback': np.where(offer, (buybackdate - today).astype('timedelta64[D]').astype(float), np.nan),
+            'days_to_coupondate': days_to_coupon.astype(float),
+            'days_since_prev_coupon': np.maximum(period - days_to_coupon, 0).astype(float),
+            'days_to_finish': days_left.astype(float),
+            'couponvalue': couponvalue,
+            'couponpercent': couponpercent,
+            'accruedint': accruedint,
+            'listlevel': listlevel,
+            'bondtype': bondtype,
+            'buybackdate': buybackdate.astype('datetime64[s]'),
+            'matdate': matdate.astype('datetime64[s]'),
+            'tradedate': np.full(n, today - 1).astype('datetime64[s]'),
+            'couponfrequency': frequency,
+            'coupondate': coupondate.astype('datetime64[s]'),
+            'updated': now,
+            'emitent_id': emitent,
+            'type': bond_type,
+            'typename': [TYPES[t][1] for t in bond_type],
+            'primary_boardid': [TYPES[t][2] for t in bond_type],
+            'issuedate': issuedate.astype('datetime64[s]'),
+            'initialfacevalue': facevalue,
+            'faceunit': faceunit,
+            'issuesize': rng.choice([100_000, 500_000, 1_000_000, 3_000_000, 5_000_000, 10_000_000], n),
+            'facevalue': facevalue,
+            'isqualifiedinvestors': rng.random(n) < self.qualified_share,
+            'earlyrepayment': offer,
+        })
+        df['name'] = "Облигация " + df['shortname']
+        self._amortization = amortization
+        self._floating = floating
+        self._period = period
+        self._liquid = liquid
+        return df
+
+    def index(self, secid: str):
+        """
+        Номер облиги по secid, None если такой нет
+        """
+        if not secid.startswith(SECID_PREFIX) or not secid[len(SECID_PREFIX):].isdigit():
+            return None
+        i = int(secid[len(SECID_PREFIX):])
+        return i if i < self.n else None
+
+    def cashflows(self, start=0, stop=None, since: date = None) -> pd.DataFrame:
+        """
+        Графики платежей облиг [start, stop): купоны от ближайшего до погашения и амортизации
+        у амортизируемых номинал гасится в последние AMORTIZATION_PAYMENTS будущих купонов, купон - от остатка
+        у плавающих известен только ближайший купон
+        :param since: и прошлые купоны с этой даты (не раньше выпуска) - для бэктеста по истории
+        :return: колонки secid, date, kind, value
+        """
+        b = self.bonds.iloc[start:stop]
+        first = b['coupondate'].to_numpy().astype('datetime64[D]')
+        mat = b['matdate'].to_numpy().astype('datetime64[D]')
+        period = self._period[start:stop]
+        # прошлых купонов: сколько периодов назад от ближайшего до since и до выпуска
+        back = np.zeros(len(b), dtype=int)
+        if since is not None:
+            issued = b['issuedate'].to_numpy().astype('datetime64[D]')
+            since = np.maximum(np.datetime64(since, 'D'), issued)
+            back = np.clip((first - since).astype(int) // period, 0, None)
+        first = first - back * period
+        # купоны в даты first + k * period раньше погашения и последний - в дату погашения
+        count = np.ceil((mat - first).astype(int) / period).astype(int) + 1
+        bond = np.repeat(np.arange(len(b)), count)
+        k = np.arange(len(bond)) - np.repeat(np.cumsum(count) - count, count)
+        last = k == count[bond] - 1
+        dates = np.where(last, mat[bond], first[bond] + k * period[bond])
+
+        face = b['facevalue'].to_numpy()[bond]
+        amortizing = self._amortization[start:stop][bond]
+        payments = np.where(amortizing, np.minimum(AMORTIZATION_PAYMENTS, (count - back)[bond]), 1)
+        # сколько частей номинала уже погашено до купона k
+        paid = np.clip(k - (count[bond] - payments), 0, None)
+        coupon = b['couponvalue'].to_numpy()[bond] * (1 - paid / payments)
+        coupon = np.where(self._floating[start:stop][bond] & (k > back[bond]), np.nan, np.round(coupon, 2))
+        amortizes = k >= count[bond] - payments
+
+        secid = b['secid'].to_numpy()
+        coupons = pd.DataFrame({'secid': secid[bond], 'date': dates, 'kind': 'coupon', 'value': coupon})
+        amortizations = pd.DataFrame({'secid': secid[bond][amortizes], 'date': dates[amortizes],
+                                      'kind': 'amortization',
+                                      'value': np.round(face[amortizes] / payments[amortizes], 2)})
+        df = pd.concat([coupons, amortizations], ignore_index=True)
+        df['date'] = df['date'].astype('datetime64[s]')
+        return df.sort_values(['secid', 'date', 'kind'], kind='stable', ignore_index=True)
+
+    def seed(self, db: Db, chunk=50_000, cashflows=True, replace=True, history_days=0) -> dict:
+        """
+        Запись рынка в базу пачками через insert без моделей, коммит на пачку
+        :param db:
+        :param chunk: облиг в пачке
+        :param cashflows: писать и графики платежей (~10 строк на облигу)
+        :param replace: сначала удалить прежние синтетические облиги, графики, историю и эмитентов
+        :param history_days: писать дневную историю ликвидных облиг (bond_history) за столько дней,
+                             графики платежей - тоже с этой даты
+        :return: таблица -> сколько строк записано
+        """
+        written = {'bonds': 0, 'cashflows': 0, 'issuers': 0, 'bond_history': 0}
+        columns = [c.key for c in Bond.__table__.columns if c.key in self.bonds.columns]
+        since = self.today - history_days if history_days else None
+        now = datetime.now()
+        with db.batch_session() as session:
+            if replace:
+                session.execute(delete(BondHistory).where(BondHistory.secid.like(f"{SECID_PREFIX}%")))
+                db.history_changed(session)
+                session.execute(delete(CashFlow).where(CashFlow.secid.like(f"{SECID_PREFIX}%")))
+                session.execute(delete(Bond).where(Bond.secid.like(f"{SECID_PREFIX}%")))
+                session.execute(delete(Issuer).where(Issuer.id >= ISSUER_ID_BASE))
+
+            written['issuers'] = _insert(session, Issuer.__table__, self.issuers.assign(updated=now))
+            db.commit()
+
+            for start in range(0, self.n, chunk):
+                with metrics.timer("stage_seconds", stage="synthetic_seed"):
+                    bonds = self.bonds.iloc[start:start + chunk][columns].assign(changed=now)
+                    written['bonds'] += _insert(session, Bond.__table__, bonds)
+                    if cashflows:
+                        flows = self.cashflows(start, start + chunk, since).assign(updated=now)
+                        written['cashflows'] += _insert(session, CashFlow.__table__, flows)
+                    db.commit()
+                print(f"🧪 {min(start + chunk, self.n)}/{self.n} облиг")
+
+            if since is not None:
+                step = max(1, _HISTORY_CHUNK_ROWS // max(history_days, 1))
+                for start in range(0, self.n, step):
+                    with metrics.timer("stage_seconds", stage="synthetic_seed"):
+                        written['bond_history'] += _insert(session, BondHistory.__table__,
+                                                           self.history_frame(since, start, start + step))
+                        db.history_changed(session)
+                        db.commit()
+                print(f"🧪 история за {history_days} дн.: {written['bond_history']} строк")
+
+        for table, count in written.items():
+            metrics.inc("db_rows_written_total", count, table=table)
+        return written
+
+    def _closes(self, i, seconds: np.ndarray) -> np.ndarray:
+        """
+        Цена закрытия облиги i в моменты seconds (unix), i - номер или массив номеров той же формы, что seconds:
+        колебания вокруг текущей цены, одинаковые при любом разбиении запросов
+        """
+        t = np.asarray(seconds, dtype=float) / 86400
+        i = np.asarray(i)
+        phase = i * 0.618
+        base = self.bonds['price'].to_numpy()[i]
+        base = np.where(base > 0, base, 100.0)
+        wave = 0.03 * np.sin(t / (20 + i % 60) + phase) + 0.008 * np.sin(t * 1.7 + phase * 3)
+        return np.round(base * (1 + wave), 2)
+
+    def _day_totals(self, i: np.ndarray, days: np.ndarray) -> tuple:
+        """
+        Итоги дня облиг i в дни days (datetime64[D], та же форма), дни - до ближайшего купона
+        :return: (цена закрытия, НКД, доходность, объем в лотах)
+        """
+        b = self.bonds
+        closes = self._closes(i, days.astype('datetime64[s]').astype(np.int64))
+        # доходность против цены: дешевле - выше, грубо через дюрацию
+        duration = np.maximum(b['days_to_finish'].to_numpy()[i] / 365, 0.5)
+        yields = np.round(b['yieldsec'].to_numpy()[i] + (b['price'].to_numpy()[i] - closes) / duration, 2)
+        # НКД от пред. купона, в день купона - 0
+        period = self._period[i]
+        to_coupon = (b['coupondate'].to_numpy().astype('datetime64[D]')[i] - days).astype(int) % period
+        to_coupon = np.where(to_coupon, to_coupon, period)
+        accruedint = np.round(b['couponvalue'].to_numpy()[i] * (period - to_coupon) / period, 2)
+        return closes, accruedint, yields, b['volume'].to_numpy()[i] // 1000
+
+    def history_frame(self, since: date, start=0, stop=None) -> pd.DataFrame:
+        """
+        Дневная история ликвидных облиг [start, stop) по рабочим дням с since (не раньше выпуска) по вчера
+        :return: строки bond_history: date, secid, price, accruedint, yieldsec, volume, facevalue, source (iss)
+        """
+        days = pd.bdate_range(pd.Timestamp(since), pd.Timestamp(self.today) - pd.Timedelta(days=1))
+        days = days.to_numpy().astype('datetime64[D]')
+        idx = np.arange(start, min(stop or self.n, self.n))
+        idx = idx[self._liquid[idx]]
+        i = np.repeat(idx, len(days))
+        d = np.tile(days, len(idx))
+        issued = d >= self.bonds['issuedate'].to_numpy().astype('datetime64[D]')[i]
+        i, d = i[issued], d[issued]
+
+        closes, accruedint, yields, lots = self._day_totals(i, d)
+        return pd.DataFrame({
+            'date': d.astype('datetime64[s]'),
+            'secid': self.bonds['secid'].to_numpy()[i],
+            'price': closes,
+            'accruedint': accruedint,
+            'yieldsec': yields,
+            'volume': lots * 1000,
+            'facevalue': self.bonds['facevalue'].to_numpy()[i],
+            'source': 'iss',
+        })
+
+    # ответы ISS в том же виде, что отдает iss.moex.com (блоки columns + data)
+
+    def securities_page(self, start=0, limit=100) -> dict:
+        b = self.bonds.iloc[start:start + limit]
+        issuers = self.issuers.set_index('id').reindex(b['emitent_id'])
+        columns = ['secid', 'shortname', 'regnumber', 'name', 'isin', 'is_traded', 'emitent_id',
+                   'emitent_title', 'emitent_inn', 'emitent_okpo', 'type', 'group', 'primary_boardid']
+        data = [[secid, shortname, None, name, isin, int(traded), int(emitent), title, inn, okpo, bond_type,
+                 'stock_bonds', board]
+                for secid, shortname, name, isin, traded, emitent, title, inn, okpo, bond_type, board in zip(
+                    b['secid'], b['shortname'], b['name'], b['isin'], b['is_traded'], b['emitent_id'],
+                    issuers['title'], issuers['inn'], issuers['okpo'], b['type'], b['primary_boardid'])]
+        return {'securities': {'columns': columns, 'data': data}}
+
+    def description(self, secid: str) -> dict:
+        columns = ['name', 'title', 'value', 'type', 'sort_order', 'is_hidden', 'precision']
+        i = self.index(secid)
+        if i is None:
+            return {'description': {'columns': columns, 'data': []}}
+        row = self.bonds.iloc[i]
+        values = {
+            'SECID': row['secid'], 'NAME': row['name'], 'SHORTNAME': row['shortname'], 'ISIN': row['isin'],
+            'ISSUEDATE': row['issuedate'], 'MATDATE': row['matdate'], 'BUYBACKDATE': row['buybackdate'],
+            'INITIALFACEVALUE': row['initialfacevalue'], 'FACEVALUE': row['facevalue'],
+            'FACEUNIT': row['faceunit'], 'ISSUESIZE': row['issuesize'],
+            'COUPONFREQUENCY': row['couponfrequency'], 'COUPONDATE': row['coupondate'],
+            'COUPONPERCENT': row['couponpercent'], 'COUPONVALUE': row['couponvalue'],
+            'LISTLEVEL': row['listlevel'], 'ISQUALIFIEDINVESTORS': int(row['isqualifiedinvestors']),
+            'EARLYREPAYMENT': int(row['earlyrepayment']),
+            'TYPENAME': row['typename'], 'TYPE': row['type'], 'GROUP': 'stock_bonds',
+            'EMITTER_ID': row['emitent_id'],
+        }
+        data = []
+        for k, (name, value) in enumerate(values.items()):
+            if pd.isna(value):
+                continue
+            # ISS отдает значения спецификации строками
+            value = value.strftime("%Y-%m-%d") if isinstance(value, pd.Timestamp) else str(value)
+            data.append([name, name.lower(), value, 'string', k, 0, None])
+        return {'description': {'columns': columns, 'data': data}}
+
+    def accruedint(self, secid: str) -> dict:
+        i = self.index(secid)
+        data = [] if i is None else [[float(self.bonds['accruedint'].iat[i])]]
+        return {'securities': {'columns': ['ACCRUEDINT'], 'data': data}}
+
+    def history(self, secid: str, since: str = None, start=0) -> dict:
+        columns = ['BOARDID', 'TRADEDATE', 'SHORTNAME', 'SECID', 'CLOSE', 'ACCINT', 'YIELDCLOSE', 'VOLUME', 'FACEVALUE']
+        i = self.index(secid)
+        if i is None or not self._liquid[i]:
+            return {'history': {'columns': columns, 'data': []}}
+        row = self.bonds.iloc[i]
+        since = pd.Timestamp(since) if since else pd.Timestamp(self.today) - pd.Timedelta(days=7)
+        days = pd.bdate_range(max(since, row['issuedate']), pd.Timestamp(self.today) - pd.Timedelta(days=1))
+        # страницами, как ISS
+        days = days[start:start + _HISTORY_PAGE]
+        closes, accruedint, yields, lots = self._day_totals(np.full(len(days), i),
+                                                            days.to_numpy().astype('datetime64[D]'))
+        data = [[row['primary_boardid'], d.strftime("%Y-%m-%d"), row['shortname'], secid, c, a, y, v, row['facevalue']]
+                for d, c, a, y, v in zip(days, closes.tolist(), accruedint.tolist(), yields.tolist(), lots.tolist())]
+        return {'history': {'columns': columns, 'data': data}}
+
+    def bondization(self, secid: str) -> dict:
+        coupons = {'columns': ['isin', 'name', 'coupondate', 'value', 'valueprc', 'faceunit', 'secid'], 'data': []}
+        amortizations = {'columns': ['isin', 'name', 'amortdate', 'value', 'valueprc', 'faceunit', 'secid'],
+                         'data': []}
+        i = self.index(secid)
+        if i is not None:
+            row = self.bonds.iloc[i]
+            for f in self.cashflows(i, i + 1).itertuples():
+                value = None if pd.isna(f.value) else f.value
+                prc = None if value is None else round(value / row['facevalue'] * 100, 4)
+                block = coupons if f.kind == 'coupon' else amortizations
+                block['data'].append([row['isin'], row['name'], f.date.strftime("%Y-%m-%d"), value, prc,
+                                      row['faceunit'], secid])
+        return {'coupons': coupons, 'amortizations': amortizations}
+
+    def marketdata(self, moved_share=0.05) -> dict:
+        """
+        Текущие данные по всем торгуемым облигам, при каждом вызове у moved_share из них
+        меняется цена - чтобы watch видел дельты
+        """
+        b = self.bonds
+        traded = np.flatnonzero(self._liquid)
+        moved = traded[self.rng.random(len(traded)) < moved_share]
+        b.loc[b.index[moved], 'price'] = np.round(
+            b['price'].to_numpy()[moved] + self.rng.normal(0, 0.2, len(moved)), 2)
+        systime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        data = [[secid, board, price, y, volume, systime] for secid, board, price, y, volume in zip(
+            *(b[col].to_numpy()[traded].tolist() for col in ('secid', 'primary_boardid', 'price', 'yieldsec', 'volume')))]
+        return {'marketdata': {'columns': ['SECID', 'BOARDID', 'LAST', 'YIELD', 'VOLTODAY', 'SYSTIME'],
+                               'data': data}}
+
+    def candles(self, secid: str, interval=24, since: str = None, start=0) -> dict:
+        """
+        Свечи страницами по 500 как в ISS, внутридневные - только в основную сессию 10:00 - 18:40
+        """
+        columns = ['open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end']
+        i = self.index(secid)
+        if i is None or not self._liquid[i] or interval not in _CANDLE_FREQ:
+            return {'candles': {'columns': columns, 'data': []}}
+        now = pd.Timestamp.now().floor('min')
+        since = pd.Timestamp(since) if since else now - pd.Timedelta(days=7)
+        begins = pd.date_range(since.ceil(_CANDLE_FREQ[interval]) if interval in (1, 10, 60) else since.normalize(),
+                               now, freq=_CANDLE_FREQ[interval])
+        if interval in (1, 10, 60):
+            minutes = begins.hour * 60 + begins.minute
+            begins = begins[(begins.dayofweek < 5) & (minutes >= 600) & (minutes < 1120)]
+        begins = begins[begins >= since][start:start + _CANDLE_PAGE]
+        if interval in (1, 10, 60):
+            ends = begins + pd.Timedelta(minutes=interval) - pd.Timedelta(seconds=1)
+        else:
+            ends = begins.normalize() + pd.Timedelta(hours=18, minutes=39, seconds=59)
+            if interval != 24:
+                ends += pd.Timedelta(days=6 if interval == 7 else 27)
+
+        seconds = begins.asi8 // 10 ** 9
+        opens = self._closes(i, seconds - 1)
+        closes = self._closes(i, seconds + interval * 60)
+        spread = np.round(np.abs(closes - opens) * 0.5 + 0.05, 2)
+        volume = max(int(self.bonds['volume'].iat[i]) // 50, 1)
+        data = [[o, c, round(max(o, c) + s, 2), round(min(o, c) - s, 2), round(c * 10 * volume, 2), volume,
+                 b.strftime("%Y-%m-%d %H:%M:%S"), e.strftime("%Y-%m-%d %H:%M:%S")]
+                for o, c, s, b, e in zip(opens, closes, spread, begins, ends)]
+        return {'candles': {'columns': columns, 'data': data}}
+
+    def smartlab_page(self, secid: str):
+        i = self.index(secid)
+        if i is None:
+            return None
+        row = self.bonds.iloc[i]
+        kind = SMARTLAB_TITLES.get(row['bondtype'], '')
+        return (f'<html><head><title>{row["shortname"]}</title></head><body>'
+                f'<h1 class="qn-menu__title">Облигация {row["shortname"]} {kind}</h1></body></html>')
+
+
+# путь ISS -> метод SyntheticMarket
+_ISS_ROUTES = [
+    (re.compile(r"/iss/securities\.json"), 'securities'),
+    (re.compile(r"/iss/securities/(?P<secid>[^/]+)\.json"), 'description'),
+    (re.compile(r"/iss/securities/(?P<secid>[^/]+)/bondization\.json"), 'bondization'),
+    (re.compile(r"/iss/engines/stock/markets/bonds/securities\.json"), 'marketdata'),
+    (re.compile(r"/iss/engines/stock/markets/bonds/securities/(?P<secid>[^/]+)\.json"), 'accruedint'),
+    (re.compile(r"/iss/engines/stock/markets/bonds/securities/(?P<secid>[^/]+)/candles\.json"), 'candles'),
+    (re.compile(r"/iss/history/engines/stock/markets/bonds/sessions/3/securities/(?P<secid>[^/]+)\.json"),
+     'history'),
+    (re.compile(r"/iss/history/engines/stock/markets/bonds/securities/(?P<secid>[^/]+)\.json"), 'history'),
+    (re.compile(r"/q/bonds/(?P<secid>[^/]+)/?"), 'smartlab'),
+]
+
+
+class IssStubHandler(BaseHTTPRequestHandler):
+    """
+    Заглушка ISS MOEX и Smart-Lab на синтетическом рынке: те пути и параметры, которые использует Moex
+    latency - задержка каждого ответа, error_rate - доля ответов 500 (проверка повторов и карантина)
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    market: SyntheticMarket = None
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        try:
+            self._get()
+        except Exception as e:
+            self._send(500, json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8'))
+
+    def _get(self):
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return self._send(500, b'{"error": "synthetic failure"}')
+
+        for pattern, route in _ISS_ROUTES:
+            match = pattern.fullmatch(parts.path)
+            if match:
+                break
+        else:
+            return self._send(404, b'{"error": "not found"}')
+
+        secid = match.groupdict().get('secid')
+        m = self.market
+        if route == 'smartlab':
+            page = m.smartlab_page(secid)
+            if page is None:
+                return self._send(404, b'')
+            return self._send(200, page.encode('utf-8'), "text/html; charset=utf-8")
+        if route == 'securities':
+            body = m.securities_page(int(params.get('start', 0)), int(params.get('limit', 100)))
+        elif route == 'history':
+            body = m.history(secid, params.get('from'), int(params.get('start', 0)))
+        elif route == 'candles':
+            body = m.candles(secid, int(params.get('interval', 24)), params.get('from'), int(params.get('start', 0)))
+        elif route == 'marketdata':
+            body = m.marketdata()
+        else:
+            body = getattr(m, route)(secid)
+        self._send(200, json.dumps(body, ensure_ascii=False).encode('utf-8'))
+
+    def _send(self, status: int, body: bytes, content_type="application/json; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        metrics.inc("iss_stub_requests_total", status=str(status))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(market: SyntheticMarket, host='127.0.0.1', port=8081, latency=0.0,
+               error_rate=0.0) -> ThreadingHTTPServer:
+    """
+    Заглушка ISS, запуск - serve_forever()
+    Moex направляется на нее через Moex(iss_url=f"http://{host}:{port}/iss", smartlab_url=f"http://{host}:{port}")
+    :param market:
+    :param host:
+    :param port:
+    :param latency: сек на ответ
+    :param error_rate: доля ответов с ошибкой
+    :return:
+    """
+    handler = type("BoundIssStubHandler", (IssStubHandler,),
+                   {'market': market, 'latency': latency, 'error_rate': error_rate})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def _insert(session, table, df: pd.DataFrame) -> int:
+    """
+    Вставка DataFrame одним executemany драйвера, мимо обработки типов sqlalchemy (в разы быстрее на миллионах строк)
+    даты - строкой в том же формате, в каком их пишет sqlalchemy DateTime для sqlite
+    :return: сколько строк
+    """
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        elif pd.api.types.is_bool_dtype(df[col]):
+            df[col] = df[col].astype(int)
+    df = df.astype(object).where(df.notna(), None)
+    sql = f"INSERT INTO {table.name} ({', '.join(df.columns)}) VALUES ({', '.join('?' * len(df.columns))})"
+    session.connection().exec_driver_sql(sql, list(df.itertuples(index=False, name=None)))
+    return len(df)
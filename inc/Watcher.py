@@ -0,0 +1,93 @@
+import time
+
+from inc.Db import Db
+from inc.Moex import Moex
+
+
+class Watcher:
+    """
+    Режим демона: держит состояние рынка в памяти и периодически
+    опрашивает marketdata сразу по всем облигациям одним запросом.
+    В базу пишутся только изменившиеся бумаги (дельты),
+    а медленное обновление спеков идет порциями между опросами
+    """
+
+    def __init__(self, moex: Moex, db: Db, specs_max_age=60*60*24):
+        self.moex = moex
+        self.db = db
+        self.specs_max_age = specs_max_age
+        # secid -> (price, yieldsec, volume) последнее известное значение
+        self.state = {}
+        # secid -> primary_boardid, marketdata приходит по всем режимам торгов
+        self.boards = {}
+        self.load_state()
+
+    def load_state(self):
+        """
+        Прогрев состояния из базы, чтобы первый опрос не писал весь рынок заново
+        :return:
+        """
+        self.state = {}
+        self.boards = {}
+        # get_market_state отдает кортежи, а не модели - в identity map ничего не остается
+        for secid, boardid, price, yieldsec, volume in self.db.get_market_state():
+            self.boards[secid] = boardid
+            self.state[secid] = (price, yieldsec, volume)
+
+    def poll(self) -> dict:
+        """
+        Один опрос marketdata, возвращает только изменившиеся бумаги
+        и сразу применяет их в базе
+        :return: secid -> json для Bond.from_json
+        """
+        deltas = {}
+        for row in self.moex.get_marketdata():
+            secid = row.get('secid')
+            # только осн. режим торгов и только если сегодня были сделки
+            if row.get('boardid') != self.boards.get(secid) or row.get('last') is None:
+                continue
+
+            # объем в тех же единицах, что и в get_yield
+            volume = (row.get('voltoday') or 0) * 1000
+            current = (row.get('last'), row.get('yield'), volume)
+            if self.state.get(secid) == current:
+                continue
+
+            self.state[secid] = current
+            deltas[secid] = {
+                'price': row.get('last'),
+                'yieldsec': row.get('yield'),
+                'volume': volume,
+                'tradedate': row['systime'][:10] if row.get('systime') else None,
+            }
+
+        if deltas:
+            # своя сессия на цикл - у демона память не должна расти со временем
+            with self.db.batch_session():
+                self.db.apply_deltas(deltas)
+        return deltas
+
+    def refresh_specs(self, deadline: float, limit=10) -> int:
+        """
+        Обновление спеков устаревших облиг в пределах бюджета:
+        не больше limit бумаг и не позже deadline (time.monotonic)
+        :param deadline:
+        :param limit:
+        :return: кол-во обновленных облиг (не попавших в карантин)
+        """
+        refreshed = 0
+        with self.db.batch_session():
+            for bond in self.db.get_next_bonds(self.specs_max_age, limit):
+                if time.monotonic() >= deadline:
+                    break
+
+                with self.moex.collect_failures() as failures:
+                    specs = self.moex.get_specs(bond.secid)
+                    flows = self.moex.get_bondization(bond.secid)
+                saved = self.db.apply_refresh(bond, specs, flows, failures)
+                self.db.commit()
+                if saved:
+                    self.boards[bond.secid] = bond.primary_boardid
+                    self.state[bond.secid] = (bond.price, bond.yieldsec, bond.volume)
+                    refreshed += 1
+        return refreshed
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from inc.CashFlows import CashFlows
+
+# границы поиска годовой доходности, в долях
+_Y_MIN = -0.99
+_Y_MAX = 10.0
+
+
+class YieldEngine:
+    """
+    Доходность к погашению (ytm) и к оферте (ytp) по графику платежей:
+    ставка, при которой дисконтированные платежи после налогов
+    равны цене покупки с НКД и комиссией. Считается сразу по всем облигам
+    пакетным Ньютоном, шаги за пределы вилки заменяются делением пополам
+    """
+
+    def __init__(self, tax_rate=0.13, fee_rate=0.0, fee_fixed=0.0):
+        """
+        :param tax_rate: НДФЛ с купонов и с положительной разницы погашение - цена покупки
+        :param fee_rate: комиссия брокера/биржи от суммы покупки, в долях
+        :param fee_fixed: фиксированная комиссия на одну облигу, в валюте номинала
+        """
+        self.tax_rate = tax_rate
+        self.fee_rate = fee_rate
+        self.fee_fixed = fee_fixed
+
+    def cost(self, bonds: pd.DataFrame) -> np.ndarray:
+        """
+        Цена покупки одной облиги: цена % от номинала + НКД + комиссия
+        без сделок (price = 0) - NaN
+        :param bonds:
+        :return:
+        """
+        price = bonds['price'].to_numpy(dtype=float)
+        clean = bonds['facevalue'].to_numpy(dtype=float) * np.where(price > 0, price, np.nan) / 100
+        dirty = clean + bonds['accruedint'].fillna(0).to_numpy(dtype=float)
+        return dirty * (1 + self.fee_rate) + self.fee_fixed
+
+    def after_tax(self, cf: CashFlows, bonds: pd.DataFrame) -> np.ndarray:
+        """
+        Платежи после налога: купоны минус НДФЛ,
+        налог с дохода от погашения выше цены покупки - в последний платеж
+        :param cf:
+        :param bonds:
+        :return:
+        """
+        amounts = cf.coupons * (1 - self.tax_rate) + cf.principal
+        clean = bonds['facevalue'].to_numpy(dtype=float) * bonds['price'].to_numpy(dtype=float) / 100
+        gain = np.nan_to_num(cf.principal.sum(axis=1) - clean)
+        has_flows = cf.counts > 0
+        rows = np.flatnonzero(has_flows)
+        amounts[rows, cf.counts[rows] - 1] -= self.tax_rate * np.maximum(gain[rows], 0)
+        return amounts
+
+    def solve(self, times: np.ndarray, amounts: np.ndarray, cost: np.ndarray,
+              guess: np.ndarray = None, tol=1e-9, max_iter=100) -> np.ndarray:
+        """
+        Годовая эффективная ставка y: sum(amounts / (1 + y) ** times) = cost
+        :param times: годы до платежей, n x m
+        :param amounts: суммы платежей, n x m
+        :param cost: цена покупки, n
+        :param guess: начальное приближение, n (напр. yieldsec / 100)
+        :return: доли, NaN если решения нет
+        """
+        n = len(cost)
+        result = np.full(n, np.nan)
+        valid = np.isfinite(cost) & (cost > 0) & (amounts.sum(axis=1) > 0)
+        idx = np.flatnonzero(valid)
+        if idx.size == 0:
+            return result
+
+        t, a, p = times[idx], amounts[idx], cost[idx]
+        lo = np.full(idx.size, _Y_MIN)
+        hi = np.full(idx.size, _Y_MAX)
+        x = np.full(idx.size, 0.1) if guess is None else np.nan_to_num(guess[idx], nan=0.1)
+        x = np.clip(x, _Y_MIN + 1e-6, _Y_MAX - 1e-6)
+        converged = np.zeros(idx.size, dtype=bool)
+
+        active = np.arange(idx.size)
+        for _ in range(max_iter):
+            if active.size == 0:
+                break
+
+            ta, aa, xa = t[active], a[active], x[active]
+            discounted = aa * np.exp(-ta * np.log1p(xa)[:, None])
+            f = discounted.sum(axis=1) - p[active]
+            df = -(ta * discounted).sum(axis=1) / (1 + xa)
+
+            # f убывает по y: f > 0 - ставка мала, f < 0 - велика
+            lo[active] = np.where(f > 0, xa, lo[active])
+            hi[active] = np.where(f < 0, xa, hi[active])
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = xa - f / df
+            bisect = ~np.isfinite(step) | (step <= lo[active]) | (step >= hi[active])
+            step = np.where(bisect, (lo[active] + hi[active]) / 2, step)
+
+            x[active] = step
+            done = np.abs(step - xa) < tol
+            converged[active[done]] = True
+            active = active[~done]
+
+        # уперлись в границы вилки - решения в разумных пределах нет
+        converged &= (x > _Y_MIN + 1e-6) & (x < _Y_MAX - 1e-6)
+        result[idx] = np.where(converged, x, np.nan)
+        return result
+
+    def calc(self, bonds: pd.DataFrame, flows: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        ytm и ytp (в процентах) по всем облигам из bonds
+        :param bonds: как в Db.get_df
+        :param flows: Db.get_cashflows_df
+        :return: колонки id, secid, ytm, ytp
+        """
+        bonds = bonds.reset_index(drop=True)
+        cost = self.cost(bonds)
+        guess = bonds['yieldsec'].to_numpy(dtype=float) / 100 if 'yieldsec' in bonds.columns else None
+
+        result = pd.DataFrame({'id': bonds['id'], 'secid': bonds['secid']})
+        for col, to_put in (('ytm', False), ('ytp', True)):
+            cf = CashFlows(bonds, flows, to_put=to_put)
+            y = self.solve(cf.times, self.after_tax(cf, bonds), cost, guess)
+            result[col] = np.round(y * 100, 2)
+        return result
@@ -1,8 +1,22 @@
-__all__ = ['moex', 'db', 'an']
+__all__ = ['moex', 'db', 'an', 'metrics']
 
 from inc.Analytics import Analytics
+from inc.Metrics import metrics
 from inc.Db import Db
 from inc.Moex import Moex
+from inc.AsyncMoex import AsyncMoex
+from inc.Watcher import Watcher
+from inc.Yields import YieldEngine
+from inc.Screener import Screener
+from inc.Profiler import Profiler
+from inc.Mirror import Mirror
+from inc.Portfolio import Portfolio
+from inc.Scenarios import ScenarioEngine
+from inc.Candles import CandleStore, CandleIngester
+from inc.History import HistoryIngester
+from inc.Backtest import Backtest
+from inc.Alerts import AlertEngine
+from inc.Synthetic import SyntheticMarket
 
 moex = Moex()
 db = Db()
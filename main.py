@@ -1,36 +1,160 @@
+import asyncio
 import datetime
+import time
 import click
-from inc import moex, db, an
+from inc import moex, db, an, metrics, Watcher, YieldEngine, Screener, Profiler, Mirror, Analytics, Portfolio, ScenarioEngine, CandleStore, CandleIngester, HistoryIngester, Backtest
+from inc.AsyncMoex import AsyncMoex
+from inc.Alerts import AlertEngine, StdoutSink, FileSink, WebhookSink, FIELDS as ALERT_FIELDS, OPS as ALERT_OPS
+from inc.Api import serve as api_serve
+from inc.Synthetic import SyntheticMarket, serve_stub, FREQUENCIES as SYNTH_FREQUENCIES
+from inc.Candles import MOEX_TZ
+from inc.Models import LIVE_VIEW
 import pandas as pd
 import os
 
 
+# сколько облиг обновлять в одной сессии БД
+UPDATE_BATCH_SIZE = 100
+# watch пишет закрытия в bond_history раз в день, после основной сессии (время Мосбиржи)
+HISTORY_SNAPSHOT_TIME = datetime.time(18, 50)
+
+
 def timediff(start: datetime):
     d = datetime.datetime.now() - start
     return datetime.datetime.fromtimestamp(d.total_seconds()).strftime("%M:%S")
 
 
-def _update_bonds(start_time: datetime):
+def _update_bonds(start_time: datetime, concurrency=0):
     # добаляю спеки облиги (их тоже нужно обновлять, напр за дату след купона)
     # добалвю расчет доходностей yields (кот мосбиржа считает раз в сутки по пред дню)
     # считаю только те что is_traded = True, это ~2700 из 8000 облиг
-    while True:
-        # получает облигу которая не обновлялась посл 24 часа
-        bond = db.get_next_bond(60*60*24)
-        if not bond:
-            click.secho(f"Закончила обновлять", fg='green')
-            break
-
-        db.update_bond_from_json(bond, moex.get_specs(bond.secid))
-        # db.update_bond_from_json(bond, moex.get_yield(bond.secid))
-        db.session.commit()
-
+    # состояние для оповещений - до первой записи, иначе первые изменения не увидит
+    _alerts()
+    if concurrency:
+        asyncio.run(_update_bonds_async(start_time, concurrency))
+    else:
+        while True:
+            # пачка облиг в своей сессии - после пачки модели выгружаются из памяти
+            with db.batch_session():
+                # облиги которые не обновлялись посл 24 часа
+                bonds = db.get_next_bonds(60*60*24, UPDATE_BATCH_SIZE)
+                if not bonds:
+                    click.secho(f"Закончила обновлять", fg='green')
+                    break
+
+                for bond in bonds:
+                    _update_bond(bond, start_time)
+
+    _calc_yields(YieldEngine())
+    # правила от даты (дней до оферты/погашения) - раз в день по всем облигам с ними
+    _alerts().check_dates()
+    click.secho(f"Снимок дня в истории: {db.record_history()} облиг", fg='green')
+    _sync_mirror()
+
+
+async def _update_bonds_async(start_time: datetime, concurrency: int):
+    # пачка облиг запрашивается одновременно через AsyncMoex, запись в базу - как в синхронном варианте
+    async with AsyncMoex(moex.iss_url, moex.smartlab_url, concurrency) as client:
+        while True:
+            with db.batch_session():
+                bonds = db.get_next_bonds(60*60*24, UPDATE_BATCH_SIZE)
+                if not bonds:
+                    click.secho(f"Закончила обновлять", fg='green')
+                    break
+
+                with metrics.timer("stage_seconds", stage="refresh_batch"):
+                    refreshes = await client.get_refreshes([bond.secid for bond in bonds])
+                for bond in bonds:
+                    _save_refresh(bond, *refreshes[bond.secid], start_time)
+
+
+def _update_bond(bond, start_time: datetime):
+    with moex.collect_failures() as failures:
+        with metrics.timer("stage_seconds", stage="specs"):
+            specs = moex.get_specs(bond.secid)
+        with metrics.timer("stage_seconds", stage="bondization"):
+            flows = moex.get_bondization(bond.secid)
+    # db.update_bond_from_json(bond, moex.get_yield(bond.secid))
+    _save_refresh(bond, specs, flows, failures, start_time)
+
+
+def _save_refresh(bond, specs: dict, flows: list, failures: list, start_time: datetime):
+    saved = db.apply_refresh(bond, specs, flows, failures)
+    db.commit()
+    if saved:
+        _alerts().evaluate({bond.secid: specs})
+
+    if saved:
         click.echo(click.style(timediff(start_time),
                    fg='yellow') + " / " + str(bond))
+    else:
+        click.echo(click.style(timediff(start_time),
+                   fg='yellow') + " / " + click.style(f"{bond.secid} в карантин", fg='red'))
+
+
+def _alerts() -> AlertEngine:
+    # правила и последние значения грузятся один раз за запуск, при первом обновлении
+    obj = click.get_current_context().obj
+    if 'alerts' not in obj:
+        sinks = {
+            'stdout': StdoutSink,
+            'file': FileSink,
+            'webhook': lambda: WebhookSink(obj.get('webhook_url')),
+        }
+        obj['alerts'] = AlertEngine(db, [sinks[name]() for name in obj.get('alert_sinks', ('stdout',))])
+    return obj['alerts']
+
+
+def _mirror() -> Mirror:
+    # одно соединение с DuckDB на запуск, watch синхронизирует через него каждый цикл
+    obj = click.get_current_context().obj
+    if 'mirror' not in obj:
+        obj['mirror'] = Mirror(db)
+    return obj['mirror']
+
+
+def _sync_mirror(full=False):
+    # колоночная копия для аналитики, только если стоит duckdb
+    if not Mirror.available():
+        return
+    with metrics.timer("stage_seconds", stage="mirror_sync"):
+        copied = _mirror().sync(full)
+    click.secho("Зеркало DuckDB: " + ", ".join(f"{t} +{n}" for t, n in copied.items()), fg='green')
+
+
+def _synced_mirror() -> Mirror:
+    # команды, которые пишут bonds, синхронизируют копию сами (_sync_mirror)
+    # копию еще ни разу не синхронизировали - делаю это сейчас, иначе таблиц bonds / bonds_live в ней нет
+    mirror = _mirror()
+    if 'bonds' not in mirror.tables():
+        click.secho("Зеркало DuckDB пустое, копирую базу", fg='yellow')
+        _sync_mirror()
+    return mirror
+
+
+def _get_analytics(backend):
+    return an if backend == 'pandas' else Analytics(db, _synced_mirror())
+
+
+def _calc_yields(engine: YieldEngine):
+    # ytm / ytp по графикам платежей сразу по всем облигам с ценой
+    alerts = _alerts()
+    with metrics.timer("stage_seconds", stage="calc_yields"):
+        df = db.get_df()
+        df = df[df['price'] > 0]
+        yields = engine.calc(df, db.get_cashflows_df())
+        db.update_yields(yields)
+    alerts.evaluate({r.secid: {'ytm': r.ytm, 'ytp': r.ytp} for r in yields.itertuples()})
+    click.secho(f"Посчитала ytm для {yields['ytm'].notna().sum()}, ytp для {yields['ytp'].notna().sum()} облиг", fg='green')
+
+
+CONCURRENCY_OPTION = click.option('--concurrency', '-c', default=0, show_default=True,
+                                  help='Обновлять спеки асинхронно, столько запросов к ISS одновременно (нужен aiohttp)')
 
 
 @click.command()
-def get_bonds():
+@CONCURRENCY_OPTION
+def get_bonds(concurrency):
     """
     Парсинг всех (вкл не торгуемые) облигаций, кот отдает ISS MOEX
     и добавление в базу или обновление в базе
@@ -44,38 +168,176 @@ def get_bonds():
     # без спеков и доходностей - только secid, isin, boiard id n etc.
 
     for page in range(1, 1000):
-        bonds = moex.get_bonds(page, 100)
+        with metrics.timer("stage_seconds", stage="list_page"):
+            bonds = moex.get_bonds(page, 100)
 
         if len(bonds) < 1:
             click.secho(
                 f"Закончила обновлять список облигаций на стр. № {page}", fg='green')
             break
 
-        [db.add_bond(bond) for bond in bonds]
-        db.session.commit()
+        with db.batch_session():
+            [db.add_bond(bond) for bond in bonds]
+            db.add_issuers(bonds)
+            db.commit()
         click.echo(click.style(timediff(start_time),
                    fg='yellow') + f" / page {page}")
-    _update_bonds(start_time)
+    _update_bonds(start_time, concurrency)
 
 
 @click.command()
-def update_bonds():
+@CONCURRENCY_OPTION
+def update_bonds(concurrency):
     start_time = datetime.datetime.now()
     db.reset_all_updated()
-    _update_bonds(start_time)
+    _update_bonds(start_time, concurrency)
+
+
+@click.command()
+@click.option('--interval', '-i', default=60, show_default=True,
+              help='Интервал опроса marketdata, сек')
+@click.option('--specs-per-cycle', '-s', default=10, show_default=True,
+              help='Сколько облиг со старыми спеками обновлять между опросами')
+@click.pass_context
+def watch(ctx, interval, specs_per_cycle):
+    """
+    Демон: внутридневные цены по всему рынку раз в interval секунд,
+    в базу пишутся только изменения, спеки обновляются в фоне порциями
+    """
+    start_time = datetime.datetime.now()
+    watcher = Watcher(moex, db)
+    alerts = _alerts()
+    snapshot_day = None
+    click.secho(f"Слежу за {len(watcher.state)} облигациями, опрос раз в {interval} сек", fg='green')
+
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            deadline = cycle_start + interval
+
+            with metrics.timer("stage_seconds", stage="poll"):
+                deltas = watcher.poll()
+            # запас в секунду, чтобы не опоздать к следующему опросу
+            with metrics.timer("stage_seconds", stage="specs_batch"):
+                refreshed = watcher.refresh_specs(deadline - 1, specs_per_cycle)
+            metrics.inc("watch_deltas_total", len(deltas))
+            alerts.evaluate(deltas)
+            alerts.check_dates()
+            if deltas or refreshed:
+                _sync_mirror()
+            # снимок не каждый цикл: каждая запись истории сбрасывает ее снимок на диске для бэктеста
+            now = datetime.datetime.now(MOEX_TZ)
+            if now.time() >= HISTORY_SNAPSHOT_TIME and now.date() != snapshot_day:
+                click.secho(f"Закрытия дня в истории: {db.record_history()} облиг", fg='green')
+                snapshot_day = now.date()
+
+            # демон не завершается, поэтому метрики для мониторинга выгружаю каждый цикл
+            if ctx.obj.get('metrics_out'):
+                metrics.export(ctx.obj['metrics_out'])
+
+            click.echo(click.style(timediff(start_time), fg='yellow') +
+                       f" / изменилось {len(deltas)}, обновлено спеков {refreshed}")
+            time.sleep(max(0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        click.secho("Остановлено", fg='green')
+
+
+@click.command()
+@click.option('--tax', default=0.13, show_default=True, help='НДФЛ с купонов и дохода от погашения, доли')
+@click.option('--fee-rate', default=0.0, show_default=True, help='Комиссия от суммы покупки, доли')
+@click.option('--fee-fixed', default=0.0, show_default=True, help='Фикс. комиссия на облигу, в валюте номинала')
+def calc_yields(tax, fee_rate, fee_fixed):
+    """
+    Пересчет ytm / ytp по сохраненным данным, без запросов к ISS
+    """
+    _calc_yields(YieldEngine(tax, fee_rate, fee_fixed))
+    _sync_mirror()
+
+
+@click.command()
+@click.option('--requeue', '-r', is_flag=True, default=False,
+              help='Выпустить из карантина указанные облиги (без secid - все)')
+@click.argument('secids', nargs=-1)
+def quarantine(requeue, secids):
+    """
+    Облиги, которые не удалось обновить, и когда будет следующая попытка
+    """
+    if requeue:
+        count = db.requeue(list(secids))
+        click.secho(f"Выпущено из карантина: {count}", fg='green')
+        return
+
+    rows = db.get_quarantine()
+    for q in rows:
+        if secids and q.secid not in secids:
+            continue
+        click.echo(click.style(q.secid, fg='bright_white') +
+                   f" / {q.endpoint}, попыток {q.attempts}, след. {q.next_retry:%Y-%m-%d %H:%M} / " +
+                   click.style(str(q.last_error), fg='red'))
+    click.echo("в карантине %s записей" % click.style(f"{len(rows)}", fg='green'))
+
+
+@click.command()
+@click.argument('field', type=click.Choice(list(ALERT_FIELDS)))
+@click.argument('op', type=click.Choice(list(ALERT_OPS)))
+@click.argument('value', type=float)
+@click.option('--secid', '-s', default=None, help='Только по одной облиге, по умолчанию по всем')
+@click.option('--name', default=None, help='Название в оповещении')
+def alert_add(field, op, value, secid, name):
+    """
+    Новое правило оповещения, напр.: price "<" 100 (ниже номинала), calc_yield ">" 20, days_to_buyback "<=" 30
+    """
+    rule = db.add_alert_rule(field, op, value, secid, name)
+    click.secho(f"Добавлено правило {rule.id}: {rule.name}", fg='green')
+
+
+@click.command()
+@click.option('--remove', '-r', is_flag=True, default=False, help='Удалить правила с указанными id')
+@click.argument('ids', nargs=-1, type=int)
+def alerts(remove, ids):
+    """
+    Правила оповещений (срабатывают при update-bonds, watch, calc-yields)
+    """
+    if remove:
+        count = db.remove_alert_rules(list(ids))
+        click.secho(f"Удалено правил: {count}", fg='green')
+        return
+
+    rules = db.get_alert_rules()
+    for rule in rules:
+        click.echo(click.style(f"{rule.id}", fg='bright_white') + f" / {rule.name}")
+    click.echo("правил %s" % click.style(f"{len(rules)}", fg='green'))
+
+
+@click.command()
+@click.option('--full', is_flag=True, default=False, help='Пересоздать копию целиком')
+def mirror_sync(full):
+    """
+    Синхронизация колоночной копии базы в DuckDB (_db/mirror.duckdb)
+    """
+    if not Mirror.available():
+        click.secho("Не установлен duckdb: python -m pip install duckdb", fg='red')
+        return
+    _sync_mirror(full)
+
+
+BACKEND_OPTION = click.option('--backend', type=click.Choice(['pandas', 'duckdb']), default='pandas',
+                              show_default=True, help='Где считать: pandas по SQLite или копия в DuckDB')
 
 
 @click.command()
-def stats():
-    for k, v in an.get_main_stats().items():
+@BACKEND_OPTION
+def stats(backend):
+    for k, v in _get_analytics(backend).get_main_stats().items():
         click.echo(click.style(k, fg='bright_white') +
                    " .. " + click.style(v, fg='green'))
 
 
 @click.command()
 @click.option('--rep', '-r', default='lowest_price', show_default=True, required=False)
-def report(rep="lowest_price"):
-    method = getattr(an, f"report_{rep}")
+@BACKEND_OPTION
+def report(rep="lowest_price", backend='pandas'):
+    method = getattr(_get_analytics(backend), f"report_{rep}")
     df = method()
 
     # df = an.report_lowest_price()
@@ -91,19 +353,470 @@ def report(rep="lowest_price"):
     ))
 
 
+@click.command()
+@click.option('--order-by', '-o', type=click.Choice(['outstanding', 'issuesize', 'bonds', 'weighted_yield']),
+              default='outstanding', show_default=True)
+@click.option('--yield-column', default='ytm', show_default=True, help='Какую доходность взвешивать')
+@click.option('--limit', '-n', default=20, show_default=True)
+@click.option('--filename', '-f', default=None, help='Сохранить все строки в reports/<filename>.xlsx')
+@BACKEND_OPTION
+def issuers(order_by, yield_column, limit, filename, backend):
+    """
+    Эмитенты: выпуски, объем в обращении, средневзвешенная доходность, лестница погашений
+    """
+    df = _get_analytics(backend).issuer_stats(yield_column)
+    if df.empty:
+        click.secho("Нет облиг с emitent_id", fg='red')
+        return
+    df = df.sort_values(order_by, ascending=False, na_position='last')
+
+    for _, r in df.head(limit).iterrows():
+        title = r['title'] if pd.notna(r['title']) else r['emitent_id']
+        print(f"{title}, {r['bonds']} выпусков : {r['outstanding']:,.0f} {r['faceunit']}, {r['weighted_yield']}%")
+
+    if filename:
+        reports_dir = "reports"
+        if not os.path.exists(reports_dir):
+            os.makedirs(reports_dir)
+        if not filename.endswith('.xlsx'):
+            filename += '.xlsx'
+        df.to_excel(os.path.join(reports_dir, filename), index=False, engine='openpyxl')
+    click.echo("issuers, эмитентов %s" % click.style(f"{df['emitent_id'].nunique()}", fg='green'))
+
+
+@click.command()
+@click.option('--listlevel', '-l', type=int, multiple=True, help='Уровень листинга, можно несколько')
+@click.option('--faceunit', '-u', multiple=True, help='Валюта номинала, можно несколько (SUR, USD ..)')
+@click.option('--bondtype', '-t', multiple=True, help='Тип купона со Smart-Lab, можно несколько')
+@click.option('--all', 'all_bonds', is_flag=True, default=False, help='Включая неторгуемые')
+@click.option('--price', type=(float, float), default=(None, None), help='Цена от и до, %')
+@click.option('--yield', 'yield_', type=(float, float), default=(None, None), help='Доходность от и до, %')
+@click.option('--days', type=(float, float), default=(None, None), help='Дней до погашения от и до')
+@click.option('--yield-column', default='ytm', show_default=True, help='Какую доходность использовать')
+@click.option('--order-by', '-o', type=click.Choice(Screener.RANGE_COLUMNS), default=None,
+              help='Сортировка, по умолчанию по доходности')
+@click.option('--asc', is_flag=True, default=False, help='Сортировка по возрастанию')
+@click.option('--limit', '-n', default=20, show_default=True)
+def screen(listlevel, faceunit, bondtype, all_bonds, price, yield_, days, yield_column, order_by, asc, limit):
+    """
+    Отбор облиг по нескольким критериям через индекс в памяти
+    разовый запуск: индекс строится из снимка на диске при каждом вызове, прогретый индекс держит serve (/screen)
+    """
+    sc = Screener.from_db(db, yield_column)
+
+    start = time.perf_counter()
+    rows = sc.query(order_by, asc, limit,
+                    listlevel=list(listlevel) or None,
+                    faceunit=list(faceunit) or None,
+                    bondtype=list(bondtype) or None,
+                    is_traded=None if all_bonds else True,
+                    price=price,
+                    matdays=days,
+                    **{yield_column: yield_})
+    elapsed = (time.perf_counter() - start) * 1000
+
+    for _, r in sc.df.iloc[rows].iterrows():
+        print(f"{r['shortname']}, {r['matdays']} : {r['price']}, {r[yield_column]} / https://www.moex.com/ru/issue.aspx?code={r['secid']}")
+
+    click.echo("screen нашла %s облиг за %s мс" % (
+        click.style(f"{len(rows)}", fg='green'),
+        click.style(f"{elapsed:.3f}", fg='green')
+    ))
+
+
+@click.command()
+@click.argument('query', nargs=-1)
+@click.option('--limit', '-n', default=20, show_default=True)
+@click.option('--traded', is_flag=True, default=False, help='Только торгуемые')
+@click.option('--rebuild', is_flag=True, default=False, help='Перестроить индекс поиска из базы')
+def search(query, limit, traded, rebuild):
+    """
+    Поиск облиг по части secid, ISIN, названия или эмитента (вкл. неторгуемые), лучшие совпадения первыми
+    """
+    if rebuild:
+        click.secho(f"Индекс поиска перестроен: {db.rebuild_search_index()} облиг", fg='green')
+    if not query:
+        return
+
+    start = time.perf_counter()
+    df = db.search(" ".join(query), limit, traded)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    for r in df.itertuples():
+        traded_mark = "" if r.is_traded else click.style(" (не торгуется)", fg='red')
+        click.echo(f"{r.secid} / {r.shortname}, {r.issuer or 'n/a'}{traded_mark} : "
+                   f"{r.price}, {r.ytm} / https://www.moex.com/ru/issue.aspx?code={r.secid}")
+
+    click.echo("search нашла %s облиг за %s мс" % (
+        click.style(f"{len(df)}", fg='green'),
+        click.style(f"{elapsed:.3f}", fg='green')
+    ))
+
+
+@click.command()
+@click.argument('positions', type=click.Path(exists=True, dir_okay=False))
+@click.option('--horizon', '-h', default=365, show_default=True, help='Горизонт, дней')
+@click.option('--by', type=click.Choice(Portfolio.GROUPS), default='month', show_default=True,
+              help='Как складывать выплаты')
+@click.option('--tax', default=0.13, show_default=True, help='НДФЛ с купонов и дохода от погашения, доли')
+@click.option('--filename', '-f', default=None, help='Имя файла отчета в reports/, по умолчанию portfolio_<by>.xlsx')
+def portfolio(positions, horizon, by, tax, filename):
+    """
+    Календарь выплат по портфелю из файла позиций (csv / xlsx: secid, quantity, необяз. price)
+    """
+    with metrics.timer("stage_seconds", stage="portfolio"):
+        p = Portfolio.from_file(db, positions, tax)
+        df = p.project(horizon, by)
+
+    if p.missing:
+        click.secho(f"Нет в базе: {', '.join(p.missing)}", fg='red')
+
+    reports_dir = "reports"
+    if not os.path.exists(reports_dir):
+        os.makedirs(reports_dir)
+    filename = os.path.join(reports_dir, filename or f"portfolio_{by}.xlsx")
+    df.to_excel(filename, index=False, engine='openpyxl')
+
+    for unit, total in df.groupby('faceunit', dropna=False)[list(Portfolio.AMOUNTS)].sum().iterrows():
+        click.echo(click.style(str(unit), fg='bright_white') + " .. " +
+                   ", ".join(f"{k} {v:,.2f}" for k, v in total.items()))
+    click.secho(f"Выплаты за {horizon} дн. сохранены в {filename}", fg='green')
+
+
+@click.command()
+@click.option('--grid', type=(int, int, int), default=(-300, 300, 100), show_default=True,
+              help='Параллельные сдвиги: от, до, шаг, б.п.')
+@click.option('--bucket', '-k', multiple=True,
+              help='Сдвиг по сроку срок_лет:б.п., все -k вместе - один доп. сценарий, напр. -k 1:-50 -k 10:100')
+@click.option('--positions', '-p', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Файл позиций как у portfolio, без него - вся база с ценой')
+@click.option('--to-put', is_flag=True, default=False, help='Платежи до оферты')
+@click.option('--filename', '-f', default='shocks.xlsx', show_default=True, help='Имя файла отчета в reports/')
+def shocks(grid, bucket, positions, to_put, filename):
+    """
+    Дюрация, выпуклость и переоценка под сдвиги ставок
+    """
+    start, stop, step = grid
+    scenarios = ScenarioEngine.parallel(range(start, stop + 1, step))
+    if bucket:
+        shifts = {float(t): float(bp) for t, bp in (b.split(':') for b in bucket)}
+        scenarios = pd.concat([scenarios, ScenarioEngine.bucketed(" ".join(bucket), shifts)])
+
+    with metrics.timer("stage_seconds", stage="shocks"):
+        if positions:
+            p = Portfolio.from_file(db, positions)
+            se = ScenarioEngine(p.bonds, db.get_cashflows_df(), p.quantity, to_put)
+        else:
+            se = ScenarioEngine.from_db(db, to_put)
+        risk = se.risk()
+        prices = se.reprice(scenarios)
+        total = se.pnl(scenarios)
+
+    for (scenario, unit), r in total.iterrows():
+        click.echo(click.style(f"{scenario} {unit}", fg='bright_white') +
+                   f" .. {r['value']:,.2f}, " + click.style(f"{r['change']:+,.2f} ({r['change_pct']:+.2f}%)",
+                                                            fg='green' if r['change'] >= 0 else 'red'))
+
+    reports_dir = "reports"
+    if not os.path.exists(reports_dir):
+        os.makedirs(reports_dir)
+    filename = os.path.join(reports_dir, filename)
+    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        risk.to_excel(writer, sheet_name='risk', index=False)
+        prices.round(2).to_excel(writer, sheet_name='scenarios')
+        total.to_excel(writer, sheet_name='total')
+    click.secho(f"Дюрация по {risk['duration'].notna().sum()} облигам, {len(scenarios)} сценариев "
+                f"сохранены в {filename}", fg='green')
+
+
+CANDLE_INTERVAL_OPTION = click.option('--interval', '-i', type=click.Choice(['1', '10', '60', '24', '7', '31']),
+                                      default='24', show_default=True,
+                                      help='Свечи: 1, 10, 60 минут, 24 - день, 7 - неделя, 31 - месяц')
+
+
+@click.command()
+@CANDLE_INTERVAL_OPTION
+@click.option('--workers', '-w', default=8, show_default=True, help='Сколько облиг качать параллельно')
+@click.option('--all', 'all_bonds', is_flag=True, default=False, help='Включая неторгуемые')
+@click.argument('secids', nargs=-1)
+def get_candles(interval, workers, all_bonds, secids):
+    """
+    Докачка свечей OHLCV в _db/candles: по каждой облиге только новее последней сохраненной
+    """
+    start_time = datetime.datetime.now()
+    if not secids:
+        filters = {} if all_bonds else {'is_traded': True}
+        secids = [secid for secid, in db.iter_bonds(['secid'], **filters)]
+
+    counts = CandleIngester(moex, CandleStore(), workers).ingest(list(secids), int(interval))
+    failed = [secid for secid, n in counts.items() if n is None]
+    written = sum(n for n in counts.values() if n)
+    click.echo(click.style(timediff(start_time), fg='yellow') +
+               f" / облиг {len(counts)}, дописано свечей {written}")
+    if failed:
+        click.secho(f"Не удалось: {', '.join(failed)}", fg='red')
+
+
+@click.command()
+@CANDLE_INTERVAL_OPTION
+@click.option('--days', '-d', default=90, show_default=True, help='За сколько последних дней')
+@click.option('--limit', '-n', default=20, show_default=True)
+@click.argument('secids', nargs=-1)
+def volatility(interval, days, limit, secids):
+    """
+    Годовая волатильность по сохраненным свечам, самые волатильные сверху
+    """
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    df = CandleStore().volatility(int(interval), start, secids=list(secids) or None)
+    df = df.sort_values('volatility', ascending=False, na_position='last')
+
+    for _, r in df.head(limit).iterrows():
+        print(f"{r['secid']}, {r['bars']} свечей : {r['last']}, {r['volatility']}%")
+    click.echo("volatility по %s облигам за %s дн." % (
+        click.style(f"{df['volatility'].notna().sum()}", fg='green'),
+        click.style(f"{days}", fg='green')
+    ))
+
+
+@click.command()
+@click.option('--days', '-d', default=365 * 3, show_default=True, help='Глубина для облиг, по которым истории еще нет')
+@click.option('--workers', '-w', default=8, show_default=True, help='Сколько облиг качать параллельно')
+@click.option('--all', 'all_bonds', is_flag=True, default=False, help='Включая неторгуемые')
+@click.argument('secids', nargs=-1)
+def get_history(days, workers, all_bonds, secids):
+    """
+    Докачка дневной истории (цена закрытия, НКД, доходность) из ISS для backtest: по каждой облиге только новые дни
+    """
+    start_time = datetime.datetime.now()
+    if not secids:
+        filters = {} if all_bonds else {'is_traded': True}
+        secids = [secid for secid, in db.iter_bonds(['secid'], **filters)]
+
+    counts = HistoryIngester(moex, db, workers).ingest(list(secids), days)
+    failed = [secid for secid, n in counts.items() if n is None]
+    written = sum(n for n in counts.values() if n)
+    click.echo(click.style(timediff(start_time), fg='yellow') +
+               f" / облиг {len(counts)}, дописано дней {written}")
+    if failed:
+        click.secho(f"Не удалось: {', '.join(failed)}", fg='red')
+
+
+@click.command()
+@click.option('--rule', '-r', type=click.Choice(Backtest.rules()), default=None,
+              help='Правило отбора, как report; без него - только критерии ниже')
+@click.option('--listlevel', '-l', type=int, multiple=True, help='Уровень листинга, можно несколько')
+@click.option('--faceunit', '-u', multiple=True, help='Валюта номинала, можно несколько (SUR, USD ..)')
+@click.option('--bondtype', '-t', multiple=True, help='Тип купона со Smart-Lab, можно несколько')
+@click.option('--price', type=(float, float), default=(None, None), help='Цена от и до, %')
+@click.option('--yield', 'yield_', type=(float, float), default=(None, None), help='Доходность мосбиржи от и до, %')
+@click.option('--days', type=(float, float), default=(None, None), help='Дней до погашения от и до')
+@click.option('--min-volume', default=0, show_default=True, help='Объем торгов за день не меньше')
+@click.option('--horizon', '-h', default=365, show_default=True, help='Сколько дней держать')
+@click.option('--step', '-s', default=21, show_default=True, help='Торговых дней между входами')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), default=None, help='История с даты')
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), default=None, help='История по дату')
+@click.option('--tax', default=0.13, show_default=True, help='НДФЛ с купонов и дохода, доли')
+@click.option('--fee-rate', default=0.0, show_default=True, help='Комиссия от суммы сделки, доли')
+@click.option('--filename', '-f', default=None, help='Сохранить все входы в reports/<filename>.xlsx')
+def backtest(rule, listlevel, faceunit, bondtype, price, yield_, days, min_volume, horizon, step, start, end,
+             tax, fee_rate, filename):
+    """
+    Бэктест правила отбора по сохраненной дневной истории (get-history, снимки после update-bonds и watch):
+    покупка отобранных облиг на каждую дату входа, держим horizon дней с купонами и погашениями
+    """
+    with metrics.timer("stage_seconds", stage="backtest_load"):
+        bt = Backtest.from_db(db, start, end, tax_rate=tax, fee_rate=fee_rate)
+    if not len(bt.dates):
+        click.secho("Нет истории, запустите get-history", fg='red')
+        return
+
+    with metrics.timer("stage_seconds", stage="backtest"):
+        mask = bt.screen(listlevel=list(listlevel) or None,
+                         faceunit=list(faceunit) or None,
+                         bondtype=list(bondtype) or None,
+                         price=price, yield_=yield_, days=days, min_volume=min_volume)
+        if rule:
+            mask &= getattr(bt, f"rule_{rule}")()
+        periods = bt.run(mask, horizon, step)
+
+    for r in periods.itertuples():
+        print(f"{r.date:%Y-%m-%d} - {r.exit:%Y-%m-%d}, {r.bonds} облиг : {r.annual}% годовых, рынок {r.universe}%")
+    for k, v in bt.summary(periods).items():
+        click.echo(click.style(k, fg='bright_white') + " .. " + click.style(v, fg='green'))
+
+    if filename:
+        reports_dir = "reports"
+        if not os.path.exists(reports_dir):
+            os.makedirs(reports_dir)
+        if not filename.endswith('.xlsx'):
+            filename += '.xlsx'
+        periods.to_excel(os.path.join(reports_dir, filename), index=False, engine='openpyxl')
+    click.echo("backtest %s, история %s дней x %s облиг" % (
+        click.style(rule or "screen", fg='green'),
+        click.style(f"{len(bt.dates)}", fg='green'),
+        click.style(f"{len(bt.bonds)}", fg='green')
+    ))
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', '-p', default=8080, show_default=True)
+def serve(host, port):
+    """
+    Локальный HTTP API только для чтения (json): /stats, /reports/<name>, /screen?..., /search?q=..., /bonds/<secid>, /issuers
+    данные в памяти, перечитываются из базы только после новых записей (update-bonds, watch ..)
+    """
+    server = api_serve(db, host, port)
+    click.secho(f"API на http://{host}:{port}/stats", fg='green')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.secho("Остановлено", fg='green')
+    finally:
+        server.server_close()
+
+
+def _synth_market(n, seed, frequency, offer_share, amortization_share, floating_share, untraded_share,
+                  illiquid_share) -> SyntheticMarket:
+    frequencies = None
+    if frequency:
+        try:
+            frequencies = {int(f): float(share) for f, share in (v.split(':') for v in frequency)}
+        except ValueError:
+            raise click.BadParameter("частота:доля, напр. 2:0.5", param_hint='--frequency')
+    with metrics.timer("stage_seconds", stage="synthetic_generate"):
+        market = SyntheticMarket(n, seed, frequencies, offer_share, amortization_share, floating_share,
+                                 untraded_share, illiquid_share)
+    click.secho(f"Синтетический рынок: {n} облиг, {len(market.issuers)} эмитентов", fg='green')
+    return market
+
+
+SYNTH_OPTIONS = [
+    click.option('--bonds', '-n', 'n', default=100_000, show_default=True, help='Сколько облиг'),
+    click.option('--seed', default=0, show_default=True, help='Один seed - один и тот же рынок'),
+    click.option('--frequency', multiple=True,
+                 help=f'Частота купона:доля, можно несколько, по умолчанию {SYNTH_FREQUENCIES}'),
+    click.option('--offer-share', default=0.15, show_default=True, help='Доля с офертой'),
+    click.option('--amortization-share', default=0.1, show_default=True, help='Доля с амортизацией'),
+    click.option('--floating-share', default=0.15, show_default=True, help='Доля с плавающим купоном'),
+    click.option('--untraded-share', default=0.6, show_default=True, help='Доля неторгуемых'),
+    click.option('--illiquid-share', default=0.3, show_default=True, help='Доля торгуемых без сделок'),
+]
+
+
+def _synth_options(command):
+    for option in reversed(SYNTH_OPTIONS):
+        command = option(command)
+    return command
+
+
+@click.command()
+@_synth_options
+@click.option('--chunk', default=50_000, show_default=True, help='Облиг в пачке записи')
+@click.option('--no-cashflows', is_flag=True, default=False, help='Без графиков платежей')
+@click.option('--history-days', default=0, show_default=True,
+              help='Дневная история ликвидных облиг для backtest за столько дней')
+def synth_seed(n, seed, frequency, offer_share, amortization_share, floating_share, untraded_share,
+               illiquid_share, chunk, no_cashflows, history_days):
+    """
+    Запись синтетического рынка в базу (secid SYN..., прежние синтетические строки заменяются)
+    для проверки базы, аналитики и выгрузок на 100k - 1M облиг, лучше в отдельной копии проекта
+    """
+    start_time = datetime.datetime.now()
+    market = _synth_market(n, seed, frequency, offer_share, amortization_share, floating_share,
+                           untraded_share, illiquid_share)
+    written = market.seed(db, chunk, not no_cashflows, history_days=history_days)
+    _sync_mirror()
+    click.echo(click.style(timediff(start_time), fg='yellow') + " / " +
+               ", ".join(f"{table}: {count}" for table, count in written.items()))
+
+
+@click.command()
+@_synth_options
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', '-p', default=8081, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help='Задержка каждого ответа, сек')
+@click.option('--error-rate', default=0.0, show_default=True, help='Доля ответов с ошибкой 500')
+def iss_stub(n, seed, frequency, offer_share, amortization_share, floating_share, untraded_share,
+             illiquid_share, host, port, latency, error_rate):
+    """
+    Заглушка ISS MOEX и Smart-Lab на синтетическом рынке, для замеров без сети:
+    python main.py --iss-url http://127.0.0.1:8081/iss --smartlab-url http://127.0.0.1:8081 get-bonds
+    """
+    market = _synth_market(n, seed, frequency, offer_share, amortization_share, floating_share,
+                           untraded_share, illiquid_share)
+    server = serve_stub(market, host, port, latency, error_rate)
+    click.secho(f"Заглушка ISS на http://{host}:{port}/iss", fg='green')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.secho("Остановлено", fg='green')
+    finally:
+        server.server_close()
+
+
 @click.command()
 def test():
     b = db.get_random_bond()
     j = moex.get_yield(b.secid)
 
     db.update_bond_from_json(b, j)
-    db.session.commit()
+    db.commit()
     click.echo([j, b.primary_boardid])
 
 
+def _report_metrics(metrics_out):
+    if metrics.is_empty():
+        return
+    click.secho("Метрики:", fg='bright_white')
+    for line in metrics.summary():
+        click.echo("  " + line)
+    if metrics_out:
+        metrics.export(metrics_out)
+        click.secho(f"Метрики сохранены в {metrics_out}", fg='green')
+
+
+def _stop_profiler(profiler: Profiler, show_stages: bool):
+    for filename in profiler.stop():
+        click.secho(f"Профиль сохранен в {filename}", fg='green')
+
+    if show_stages:
+        click.secho("Время по этапам:", fg='bright_white')
+        for stage, count, seconds, share in metrics.breakdown():
+            click.echo(f"  {stage}: {count} раз, {seconds:.2f} сек, {share * 100:.1f}%")
+
+
 @click.group()
-def cli_group():
-    pass
+@click.option('--metrics-out', default=None,
+              help='Файл для выгрузки метрик: *.json или Prometheus text для остальных расширений')
+@click.option('--profile', is_flag=True, default=False,
+              help='Профилировать команду: reports/profile/<команда>-<время>.pstats и .collapsed (flamegraph)')
+@click.option('--profile-stages', is_flag=True, default=False,
+              help='Вместе с --profile вывести разбивку времени по этапам')
+@click.option('--alert-sink', type=click.Choice(['stdout', 'file', 'webhook']), multiple=True, default=['stdout'],
+              show_default=True, help='Куда слать оповещения, можно несколько (file - reports/alerts.jsonl)')
+@click.option('--webhook-url', default=None, help='URL для --alert-sink webhook')
+@click.option('--iss-url', default=None, help='Другой адрес ISS, напр. заглушка iss-stub: http://127.0.0.1:8081/iss')
+@click.option('--smartlab-url', default=None, help='Другой адрес Smart-Lab, для iss-stub: http://127.0.0.1:8081')
+@click.pass_context
+def cli_group(ctx, metrics_out, profile, profile_stages, alert_sink, webhook_url, iss_url, smartlab_url):
+    ctx.ensure_object(dict)
+    if iss_url:
+        moex.iss_url = iss_url.rstrip('/')
+    if smartlab_url:
+        moex.smartlab_url = smartlab_url.rstrip('/')
+    ctx.obj['metrics_out'] = metrics_out
+    ctx.obj['alert_sinks'] = alert_sink
+    ctx.obj['webhook_url'] = webhook_url
+    # и при обычном завершении, и при Ctrl+C
+    ctx.call_on_close(lambda: _report_metrics(metrics_out))
+
+    if profile:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        profiler = Profiler(os.path.join("reports", "profile", f"{ctx.invoked_subcommand}-{stamp}"))
+        profiler.start()
+        # call_on_close выполняются в обратном порядке - профиль остановится до вывода метрик
+        ctx.call_on_close(lambda: _stop_profiler(profiler, profile_stages))
 
 
 @click.command()
@@ -113,7 +826,16 @@ def cli_group():
               help='Экспортировать только облигации с оффертой (buybackdate NOT NULL)')
 @click.option('--all_data', '-a', is_flag=True, default=False,
               help='Экспортировать все облигации без фильтров')
-def export_bonds(filename, only_buyback, all_data):
+@BACKEND_OPTION
+def export_bonds(filename, only_buyback, all_data, backend):
+    if backend == 'duckdb':
+        read_query = _synced_mirror().sql
+        # в DuckDB нет date('now') из SQLite
+        today = "current_date"
+    else:
+        def read_query(q):
+            return pd.read_sql_query(q, db.engine)
+        today = "date('now')"
 
     if all_data:
         """
@@ -121,8 +843,8 @@ def export_bonds(filename, only_buyback, all_data):
         """
         try:
             # Получаем все облигации из базы данных
-            query = "SELECT * FROM bonds"
-            df = pd.read_sql_query(query, db.engine)
+            query = f"SELECT * FROM {LIVE_VIEW} AS bonds"
+            df = read_query(query)
 
             if len(df) == 0:
                 click.secho(
@@ -153,14 +875,14 @@ def export_bonds(filename, only_buyback, all_data):
         """
         try:
             # Базовый SQL запрос
-            query = """
-            SELECT * FROM bonds 
+            query = f"""
+            SELECT * FROM {LIVE_VIEW} AS bonds
             WHERE 
                 is_traded = 1 AND
                 bonds.isqualifiedinvestors != 1 AND
                 bonds.issuedate NOT NULL AND
                 bonds.couponpercent > 1 AND
-                bonds.matdate > date('now') AND
+                bonds.matdate > {today} AND
                 bonds.faceunit IN ('SUR', 'RUB')
             """
 
@@ -180,7 +902,7 @@ def export_bonds(filename, only_buyback, all_data):
             """
 
             # Выполняем запрос через SQLAlchemy или используем pandas
-            df = pd.read_sql_query(query, db.engine)
+            df = read_query(query)
 
             # Сохраняем в Excel
             reports_dir = "reports"
@@ -216,4 +938,22 @@ if __name__ == '__main__':
     cli_group.add_command(export_bonds)
     cli_group.add_command(test)
     cli_group.add_command(update_bonds)
+    cli_group.add_command(watch)
+    cli_group.add_command(calc_yields)
+    cli_group.add_command(screen)
+    cli_group.add_command(search)
+    cli_group.add_command(quarantine)
+    cli_group.add_command(mirror_sync)
+    cli_group.add_command(portfolio)
+    cli_group.add_command(shocks)
+    cli_group.add_command(get_candles)
+    cli_group.add_command(volatility)
+    cli_group.add_command(get_history)
+    cli_group.add_command(backtest)
+    cli_group.add_command(issuers)
+    cli_group.add_command(alert_add)
+    cli_group.add_command(alerts)
+    cli_group.add_command(serve)
+    cli_group.add_command(synth_seed)
+    cli_group.add_command(iss_stub)
     cli_group()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# пакет inc при импорте открывает базу _db/db.db в текущей папке - тесты работают во временной,
+# чтобы не трогать рабочую базу
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bonds-tests-")
+os.chdir(WORKDIR)
+sys.path[:0] = [WORKDIR, ROOT]
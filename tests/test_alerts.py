@@ -0,0 +1,61 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from inc import db
+from inc.Alerts import AlertEngine
+from inc.Models import Bond
+
+DAY = date(2025, 1, 1)
+
+
+class ListSink:
+    def __init__(self):
+        self.events = []
+
+    def send(self, event: dict):
+        self.events.append(event)
+
+
+@pytest.fixture
+def rules():
+    buyback = datetime.combine(DAY + timedelta(days=40), datetime.min.time())
+    db.session.add(Bond(secid='ALERT1', price=101.0, buybackdate=buyback))
+    db.commit()
+    added = [db.add_alert_rule('days_to_buyback', '<=', 30, secid='ALERT1'),
+             db.add_alert_rule('price', '<', 100, secid='ALERT1')]
+    yield buyback
+    db.remove_alert_rules([r.id for r in added])
+    db.session.query(Bond).filter_by(secid='ALERT1').delete()
+    db.commit()
+
+
+def fired(events):
+    return [(e['field'], e['value'], e['previous']) for e in events]
+
+
+def test_date_rule_fires_as_days_pass(rules):
+    sink = ListSink()
+    engine = AlertEngine(db, [sink])
+
+    assert engine.check_dates(DAY) == []
+    # повтор той же даты оферты в спеках - дни пересчитаны на новый день, порог еще не пройден
+    assert engine.evaluate({'ALERT1': {'buybackdate': rules}}, today=DAY + timedelta(days=5)) == []
+    assert engine.check_dates(DAY + timedelta(days=5)) == []
+
+    assert fired(engine.check_dates(DAY + timedelta(days=10))) == [('days_to_buyback', 30, 35)]
+    assert engine.check_dates(DAY + timedelta(days=11)) == []
+    assert len(sink.events) == 1
+
+    # после перезапуска дни считаются от дня прошлой проверки - условие уже выполнялось
+    restarted = AlertEngine(db, [sink])
+    assert restarted.state['ALERT1']['days_to_buyback'] == 29
+    assert restarted.check_dates(DAY + timedelta(days=12)) == []
+
+
+def test_value_rule_fires_on_crossing(rules):
+    engine = AlertEngine(db, [ListSink()])
+
+    assert engine.evaluate({'ALERT1': {'price': 100.5}}) == []
+    assert fired(engine.evaluate({'ALERT1': {'price': 99}})) == [('price', 99.0, 100.5)]
+    assert engine.evaluate({'ALERT1': {'price': 98}}) == []
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from inc import db
+from inc.Analytics import Analytics
+
+
+def bonds(faceunit):
+    return pd.DataFrame({
+        'emitent_id': [1, 1, 2],
+        'faceunit': faceunit,
+        'is_traded': [1, 0, 1],
+        'issuesize': [1000, 500, 2000],
+        'facevalue': [1000.0, 1000.0, 100.0],
+        'ytm': [20.0, np.nan, 12.0],
+        'days_to_finish': [100.0, 800.0, 2000.0],
+    })
+
+
+def test_issuer_stats_null_faceunit():
+    an = Analytics(db)
+    # без спеков faceunit NULL, в снимке колонка может быть категорией
+    for faceunit in (['SUR', None, 'SUR'], pd.Categorical(['SUR', None, 'SUR'])):
+        an.df = bonds(faceunit)
+        stats = an.issuer_stats().set_index(['emitent_id', 'faceunit'])
+
+        assert sorted(stats.index) == [(1, ''), (1, 'SUR'), (2, 'SUR')]
+        assert stats.loc[(1, 'SUR'), 'outstanding'] == 1_000_000
+        assert stats.loc[(1, ''), 'bonds'] == 1
+        assert np.isnan(stats.loc[(1, ''), 'weighted_yield'])
+        assert stats.loc[(2, 'SUR'), 'weighted_yield'] == 12.0
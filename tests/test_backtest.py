@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from inc.Backtest import Backtest
+
+
+def backtest(**kw):
+    bonds = pd.DataFrame([
+        dict(secid='A', shortname='A', listlevel=1, faceunit='SUR', bondtype=None, isqualifiedinvestors=False,
+             matdate='2026-01-01', buybackdate=None, coupondate='2025-02-01', couponfrequency=4,
+             couponvalue=50.0, facevalue=1000.0),
+        dict(secid='B', shortname='B', listlevel=2, faceunit='SUR', bondtype=None, isqualifiedinvestors=False,
+             matdate='2025-01-20', buybackdate=None, coupondate=None, couponfrequency=0,
+             couponvalue=0.0, facevalue=1000.0),
+    ])
+    flows = pd.DataFrame([
+        {'secid': 'A', 'date': '2025-02-01', 'kind': 'coupon', 'value': 50.0},
+        {'secid': 'A', 'date': '2026-01-01', 'kind': 'amortization', 'value': 1000.0},
+    ])
+    days = pd.date_range('2025-01-01', '2025-03-01')
+    a = pd.DataFrame({'date': days, 'secid': 'A', 'price': 100.0, 'accruedint': 0.0, 'yieldsec': 20.0,
+                      'volume': 1000, 'facevalue': 1000.0})
+    # B погашена 20.01 - дальше цен нет
+    b = pd.DataFrame({'date': days[days < '2025-01-20'], 'secid': 'B', 'price': 99.0, 'accruedint': 0.0,
+                      'yieldsec': 15.0, 'volume': 1000, 'facevalue': 1000.0})
+    return Backtest(pd.concat([a, b]), bonds, flows, **kw)
+
+
+def day(bt: Backtest, value: str) -> int:
+    return int(np.searchsorted(bt.dates, np.datetime64(value)))
+
+
+def test_coupon_and_redemption_after_tax():
+    bt = backtest()
+    r = bt.returns(np.array([0]), np.array([day(bt, '2025-02-10')]))[0]
+
+    # A: купон 50 после НДФЛ, продажа по номиналу
+    assert r[0] == pytest.approx(50 * 0.87 / 1000)
+    # B: погашение 1000 при покупке за 990, НДФЛ с разницы
+    assert r[1] == pytest.approx((1000 - 10 * 0.13) / 990 - 1)
+
+
+def test_fees_on_entry_and_exit():
+    bt = backtest(fee_rate=0.001)
+    r = bt.returns(np.array([0]), np.array([day(bt, '2025-01-10')]))[0]
+
+    assert r[0] == pytest.approx(1000 * 0.999 / (1000 * 1.001) - 1)
+
+
+def test_run_against_universe():
+    bt = backtest()
+    periods = bt.run(bt.screen(listlevel=[1]), horizon=40, step=100)
+    row = periods.iloc[0]
+
+    assert len(periods) == 1
+    assert (row['bonds'], row['days'], row['return']) == (1, 40, 4.35)
+    universe = (50 * 0.87 / 1000 + (1000 - 10 * 0.13) / 990 - 1) / 2
+    assert row['universe'] == pytest.approx(((1 + universe) ** (365 / 40) - 1) * 100, abs=0.01)
+    assert Backtest.summary(periods)['входов с отбором'] == 1
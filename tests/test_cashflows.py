@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from inc.CashFlows import CashFlows
+
+TODAY = datetime(2025, 1, 1)
+
+
+def bond(**kw):
+    row = dict(secid='A', coupondate='2025-07-01', couponfrequency=1, couponvalue=100.0, facevalue=1000.0,
+               matdate='2027-07-01', buybackdate=None)
+    row.update(kw)
+    return row
+
+
+def dates(cf: CashFlows, i=0):
+    return [str(d) for d in cf.dates[i, :cf.counts[i]]]
+
+
+def test_synthetic_schedule():
+    cf = CashFlows(pd.DataFrame([bond()]), today=TODAY)
+
+    assert dates(cf) == ['2025-07-01', '2026-07-01', '2027-07-01']
+    assert cf.coupons[0, :3].tolist() == [100.0, 100.0, 100.0]
+    assert cf.principal[0, :3].tolist() == [0.0, 0.0, 1000.0]
+    assert np.allclose(cf.times[0, :3], np.array([181, 546, 911]) / 365)
+
+
+def test_synthetic_coupon_past_maturity_is_capped():
+    # шаг 365 / 2 дает купон на 2 дня позже погашения - он переносится на дату погашения
+    cf = CashFlows(pd.DataFrame([bond(couponfrequency=2, couponvalue=50.0, matdate='2025-12-29')]), today=TODAY)
+
+    assert dates(cf) == ['2025-07-01', '2025-12-29']
+    assert cf.amounts[0, :2].tolist() == [50.0, 1050.0]
+
+
+def test_bondization_schedule_replaces_synthetic():
+    flows = pd.DataFrame([
+        {'secid': 'A', 'date': '2024-07-01', 'kind': 'coupon', 'value': 90.0},
+        {'secid': 'A', 'date': '2025-07-01', 'kind': 'coupon', 'value': 90.0},
+        {'secid': 'A', 'date': '2025-07-01', 'kind': 'amortization', 'value': 500.0},
+        {'secid': 'A', 'date': '2026-07-01', 'kind': 'coupon', 'value': None},
+        {'secid': 'A', 'date': '2026-07-01', 'kind': 'amortization', 'value': 500.0},
+    ])
+    cf = CashFlows(pd.DataFrame([bond(matdate='2026-07-01')]), flows, today=TODAY)
+
+    # прошедший купон отброшен, неизвестный плавающий - как текущий couponvalue
+    assert dates(cf) == ['2025-07-01', '2026-07-01']
+    assert cf.coupons[0, :2].tolist() == [90.0, 100.0]
+    assert cf.principal[0, :2].tolist() == [500.0, 500.0]
+
+
+
+def test_amortization_without_value_is_not_coupon():
+    flows = pd.DataFrame([
+        {'secid': 'A', 'date': '2025-07-01', 'kind': 'coupon', 'value': 90.0},
+        {'secid': 'A', 'date': '2025-07-01', 'kind': 'amortization', 'value': None},
+        {'secid': 'A', 'date': '2026-07-01', 'kind': 'coupon', 'value': 90.0},
+    ])
+    cf = CashFlows(pd.DataFrame([bond(matdate='2026-07-01')]), flows, today=TODAY)
+
+    # сумма амортизации неизвестна - весь номинал возвращается в дату погашения
+    assert cf.coupons[0, :2].tolist() == [90.0, 90.0]
+    assert cf.principal[0, :2].tolist() == [0.0, 1000.0]
+
+def test_to_put_redeems_face_at_offer():
+    cf = CashFlows(pd.DataFrame([bond(buybackdate='2026-07-01')]), to_put=True, today=TODAY)
+
+    assert dates(cf) == ['2025-07-01', '2026-07-01']
+    assert cf.principal[0, :2].tolist() == [0.0, 1000.0]
+
+
+def test_matured_and_duplicate_secids():
+    bonds = pd.DataFrame([bond(), bond(), bond(secid='B', matdate='2024-12-01')])
+    flows = pd.DataFrame([{'secid': 'A', 'date': '2025-07-01', 'kind': 'amortization', 'value': 1000.0}])
+    cf = CashFlows(bonds, flows, today=TODAY)
+
+    assert cf.counts.tolist() == [1, 1, 0]
+    assert cf.principal[:2, 0].tolist() == [1000.0, 1000.0]
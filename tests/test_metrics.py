@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from inc.Metrics import Metrics
+from inc.Moex import Moex
+
+
+def test_counters_and_histograms_from_threads():
+    m = Metrics()
+
+    def work(_):
+        for _ in range(10_000):
+            m.inc("requests_total", endpoint="x")
+            m.observe("request_seconds", 0.001, endpoint="x")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+
+    assert m.total("requests_total") == 80_000
+    assert m.histograms[("request_seconds", (("endpoint", "x"),))].count == 80_000
+
+
+def test_failures_collected_per_thread():
+    moex = Moex()
+
+    def fetch(secid):
+        with moex.collect_failures() as failures:
+            moex._fail(f"securities/{secid}", "timeout")
+            return failures
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        collected = list(pool.map(fetch, ["A", "B", "C", "D"]))
+
+    assert collected == [[(f"securities/{s}", "timeout")] for s in "ABCD"]
+    # вне collect_failures неудачи только считаются в метриках
+    moex._fail("securities/E", "timeout")
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+from inc import db
+from inc.Mirror import Mirror
+from inc.Models import Bond, CashFlow
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    db.session.add_all([Bond(secid='MIRR1', price=99.5), Bond(secid='MIRR2', price=101.0)])
+    db.session.add(CashFlow(secid='MIRR2', kind='coupon', value=40.0))
+    db.commit()
+    yield Mirror(db, os.path.join(tmp_path, "mirror.duckdb"))
+    db.session.query(Bond).filter(Bond.secid.in_(['MIRR1', 'MIRR2'])).delete()
+    db.session.query(CashFlow).filter_by(secid='MIRR2').delete()
+    db.commit()
+
+
+def ytm(mirror, secid):
+    return mirror.con.execute("SELECT ytm FROM bonds WHERE secid = ?", [secid]).fetchone()[0]
+
+
+def test_null_float_column_keeps_fractions(mirror):
+    # первая синхронизация - ytm еще не посчитаны, колонка из одних NULL
+    mirror.sync()
+    assert mirror.column_types('bonds')['ytm'] == 'DOUBLE'
+
+    db.session.query(Bond).filter_by(secid='MIRR1').update({'ytm': 20.21})
+    db.commit()
+    assert mirror.sync()['bonds'] == 1
+    assert ytm(mirror, 'MIRR1') == 20.21
+
+
+def test_deleted_rows_leave_mirror(mirror):
+    mirror.sync()
+    db.session.query(Bond).filter_by(secid='MIRR2').delete()
+    db.session.query(CashFlow).filter_by(secid='MIRR2').delete()
+    db.commit()
+
+    mirror.sync()
+    assert mirror.sql("SELECT secid FROM bonds")['secid'].tolist() == ['MIRR1']
+    assert mirror.sql("SELECT count(*) AS n FROM cashflows")['n'][0] == 0
+
+
+def test_mismatched_types_rebuild(mirror):
+    mirror.sync()
+    # как в копиях до схемы по модели: дробная колонка создана целой
+    mirror.con.execute("ALTER TABLE bonds ALTER ytm TYPE BIGINT")
+    assert mirror._outdated('bonds')
+    assert mirror.sync()['bonds'] == 2
+    assert mirror.column_types('bonds')['ytm'] == 'DOUBLE'
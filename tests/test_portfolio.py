@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from inc.Portfolio import Portfolio
+
+TODAY = datetime(2025, 1, 1)
+
+
+def bonds():
+    common = dict(coupondate='2025-07-01', couponfrequency=1, facevalue=1000.0, matdate='2026-07-01',
+                  buybackdate=None)
+    return pd.DataFrame([
+        dict(common, secid='A', couponvalue=100.0, emitent_id=1, faceunit='SUR'),
+        dict(common, secid='B', couponvalue=20.0, emitent_id=2, faceunit='USD'),
+    ])
+
+
+def portfolio():
+    positions = pd.DataFrame({'secid': ['A', 'A', 'B', 'C'], 'quantity': [10, 5, 1, 3],
+                              'price': [95.0, None, 100.0, 100.0]})
+    return Portfolio(positions, bonds(), tax_rate=0.13, today=TODAY)
+
+
+def test_positions_are_summed_and_unknown_reported():
+    p = portfolio()
+    assert p.quantity.tolist() == [15.0, 1.0]
+    assert p.missing == ['C']
+
+
+def test_coupons_within_horizon():
+    flows = portfolio().flows(horizon=365)
+    a = flows[flows['secid'] == 'A'].iloc[0]
+
+    assert len(flows) == 2
+    assert (a['coupon'], a['redemption'], a['tax'], a['net']) == pytest.approx((1500, 0, 195, 1305))
+
+
+def test_redemption_taxed_only_above_known_price():
+    flows = portfolio().flows(horizon=600)
+    last = flows[(flows['secid'] == 'A') & (flows['date'] == pd.Timestamp('2026-07-01'))].iloc[0]
+
+    # налог с погашения: 10 шт куплены по 95% (+50 на штуку), у 5 шт цены нет - без налога
+    assert last['redemption'] == pytest.approx(15_000)
+    assert last['tax'] == pytest.approx(1500 * 0.13 + 10 * 50 * 0.13)
+
+
+def test_project_groups_by_currency():
+    result = portfolio().project(horizon=600, by='month').set_index(['month', 'faceunit'])
+
+    assert result.loc[('2025-07', 'SUR'), 'coupon'] == 1500
+    assert result.loc[('2026-07', 'USD'), 'redemption'] == 1000
+    with pytest.raises(ValueError):
+        portfolio().project(by='week')
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from inc.Scenarios import ScenarioEngine
+
+TODAY = datetime(2025, 1, 1)
+
+
+def engine(quantity=None):
+    # один платеж 1000 через год по цене 1000 / 1.1 - доходность ровно 10%
+    bonds = pd.DataFrame([dict(secid='Z', coupondate=None, couponfrequency=0, couponvalue=0.0, facevalue=1000.0,
+                               matdate='2026-01-01', buybackdate=None, price=100 / 1.1, accruedint=0.0,
+                               faceunit='SUR')])
+    return ScenarioEngine(bonds, quantity=quantity, today=TODAY)
+
+
+def test_risk_of_single_payment():
+    risk = engine().risk().iloc[0]
+
+    assert risk['yield'] == pytest.approx(10.0)
+    assert risk['duration'] == pytest.approx(1 / 1.1, abs=1e-3)
+    assert risk['convexity'] == pytest.approx(2 / 1.1 ** 2, abs=1e-3)
+    assert risk['dv01'] == pytest.approx(-1000 / 1.1 / 1.1 / 10_000, abs=1e-4)
+
+
+def test_parallel_and_bucketed_shifts():
+    scenarios = pd.concat([ScenarioEngine.parallel([0, 100]), ScenarioEngine.bucketed('long', {1: 0, 2: 100})])
+    prices = engine().reprice(scenarios).loc['Z']
+
+    assert prices['+0bp'] == pytest.approx(1000 / 1.1)
+    assert prices['+100bp'] == pytest.approx(1000 / 1.11)
+    # сдвиг только дальше года платеж не задевает
+    assert prices['long'] == pytest.approx(1000 / 1.1)
+
+
+def test_pnl_by_currency():
+    pnl = engine(quantity=np.array([2.0])).pnl(ScenarioEngine.parallel([100])).loc[('+100bp', 'SUR')]
+
+    assert pnl['value'] == pytest.approx(2000 / 1.11, abs=0.01)
+    assert pnl['change'] == pytest.approx(2000 / 1.11 - 2000 / 1.1, abs=0.01)
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from inc import db
+from inc.Models import Bond, BondHistory
+
+
+@pytest.fixture
+def bonds():
+    db.session.add_all([
+        Bond(secid='SNAP1', is_traded=True, price=99.5, volume=10, listlevel=1, faceunit='SUR',
+             matdate=datetime(2027, 3, 1), ytm=14.2, couponfrequency=2),
+        # облига без спеков: почти все NULL
+        Bond(secid='SNAP2', is_traded=False),
+        Bond(secid='SNAP3', is_traded=True, price=101.0, faceunit='USD', days_to_finish=400.0),
+    ])
+    db.session.add_all([
+        BondHistory(date=datetime(2025, 1, 10), secid='SNAP1', price=99.0, volume=5, source='iss'),
+        BondHistory(date=datetime(2025, 1, 10), secid='SNAP3', price=None, volume=0, source='iss'),
+    ])
+    db.history_changed(db.session)
+    db.commit()
+    yield
+    db.session.query(Bond).filter(Bond.secid.like('SNAP%')).delete(synchronize_session=False)
+    db.session.query(BondHistory).filter(BondHistory.secid.like('SNAP%')).delete(synchronize_session=False)
+    db.history_changed(db.session)
+    db.commit()
+
+
+def test_snapshot_matches_sql(bonds):
+    # первый вызов собирает снимок, второй читает его с диска
+    for _ in range(2):
+        pd.testing.assert_frame_equal(db.get_snapshot_df(), db.get_df())
+
+
+def test_history_snapshot_matches_sql(bonds):
+    for _ in range(2):
+        pd.testing.assert_frame_equal(db.get_history_df(), db._read_history())
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from inc.CashFlows import CashFlows
+from inc.Yields import YieldEngine
+
+TODAY = datetime(2025, 1, 1)
+
+
+def bonds(price, **kw):
+    row = dict(id=1, secid='A', coupondate='2026-01-01', couponfrequency=1, couponvalue=100.0, facevalue=1000.0,
+               matdate='2027-01-01', buybackdate=None, price=price, accruedint=0.0)
+    row.update(kw)
+    return pd.DataFrame([row])
+
+
+def ytm(engine: YieldEngine, bonds: pd.DataFrame):
+    cf = CashFlows(bonds, today=TODAY)
+    return engine.solve(cf.times, engine.after_tax(cf, bonds), engine.cost(bonds))[0]
+
+
+def test_par_bond_yields_coupon_rate():
+    assert ytm(YieldEngine(tax_rate=0.0), bonds(100)) == pytest.approx(0.10, abs=1e-9)
+
+
+def test_discount_bond_against_closed_form():
+    # 950 = 100 / (1 + y) + 1100 / (1 + y) ** 2 -> 1 + y = (100 + sqrt(100 ** 2 + 4 * 950 * 1100)) / (2 * 950)
+    expected = (100 + np.sqrt(100 ** 2 + 4 * 950 * 1100)) / (2 * 950) - 1
+    assert ytm(YieldEngine(tax_rate=0.0), bonds(95)) == pytest.approx(expected, abs=1e-9)
+
+
+def test_tax_on_coupons_and_discount():
+    # один платеж через год: купон 100 и номинал 1000, куплено за 950
+    # после налога 87 + 1000 - 0.13 * 50
+    one_year = bonds(95, matdate='2026-01-01')
+    expected = (87 + 1000 - 6.5) / 950 - 1
+    assert ytm(YieldEngine(tax_rate=0.13), one_year) == pytest.approx(expected, abs=1e-9)
+
+
+def test_fees_and_accrued_raise_cost():
+    engine = YieldEngine(tax_rate=0.0, fee_rate=0.01, fee_fixed=2.0)
+    cost = engine.cost(bonds(100, accruedint=20.0))
+    assert cost[0] == pytest.approx(1020 * 1.01 + 2)
+
+
+def test_no_price_or_no_flows_is_nan():
+    engine = YieldEngine()
+    assert np.isnan(ytm(engine, bonds(0)))
+    assert np.isnan(ytm(engine, bonds(100, matdate='2024-01-01')))